@@ -1,132 +1,139 @@
 import argparse
 import datetime
-import importlib
 import logging
 from pathlib import Path
 
-import backtrader as bt
-import matplotlib.pylab as pylab
 import pandas as pd
-# import pyfolio as pf
-import yaml
-from backtrader_plotting import Bokeh, OptBrowser
-from backtrader_plotting.schemes import Blackly, Tradimo
 
-from util import OrderHistoryTracker, order_history_tracker
+from runner import load_config, load_experiment_dataset, run_backtest
+from runner.optimizer import run_optimizer
+from runner.sweep import has_sweep, run_sweep
+from util import OrderHistoryTracker
+from util.strategy_logging import LOG_FORMAT, start_queue_logging
 
 # from strategy import GoldenCrossStrategy, GridTradingStrategy
 
 argparser = argparse.ArgumentParser()
 argparser.add_argument('config_path')
-args = argparser.parse_args()
+argparser.add_argument('--processes', type=int, default=None,
+                       help='worker processes for sweep and optimize mode, '
+                            'defaults to their processes setting or the cpu count')
 
 
-def parse_config():
-    with open(args.config_path, 'r', encoding='utf-8') as f:
-        config = yaml.safe_load(f)
+def init_logging(config_path, logging_config=None):
+    '''
+    Log to logs/<config>/<time>.log and the console through a background queue.
 
-    for strategy_config in config['strategies']:
-        strategy = getattr(importlib.import_module(
-            f"strategy.{strategy_config['strategy']}"), strategy_config['strategy'])
-        strategy_config['strategy'] = strategy
-
-    return config
-
-
-def init_logging():
+    logging_config = the config's logging section, level (DEBUG by default,
+    INFO drops the per-order grid messages and WARNING all strategy
+    messages) and console (true by default).
+    '''
+    logging_config = logging_config or {}
     log_root_dir = Path('logs')
     log_root_dir.mkdir(exist_ok=True)
 
-    log_dir = log_root_dir / Path(args.config_path).stem
+    log_dir = log_root_dir / Path(config_path).stem
     log_dir.mkdir(exist_ok=True)
 
     log_path = log_dir / f'{datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}.log'
-    logging.basicConfig(
-        filename=str(log_path),
-        filemode='w',
-        level=logging.DEBUG)
-
-    console = logging.StreamHandler()
-    console.setLevel(logging.DEBUG)
-    logging.getLogger().addHandler(console)
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.FileHandler(str(log_path), mode='w')]
+    if logging_config.get('console', True):
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    start_queue_logging(handlers, level=logging_config.get('level', 'DEBUG'))
     logging.getLogger('matplotlib.font_manager').disabled = True
     return log_path
 
 
 def set_figsize(width, height):
+    import matplotlib.pylab as pylab
+
     pylab.rcParams['figure.figsize'] = width, height
 
 
-def load_dataset():
-
-    df = pd.read_csv(config['dataset'])
-    df['time'] = pd.to_datetime(df['time'])
-    df.set_index('time', inplace=True)
-    df.sort_index(inplace=True)
-    if 'real_volume' in df.columns:
-        df.drop(columns=['real_volume'], inplace=True)
-    df.rename(columns={'tick_volume': 'volume'}, inplace=True)
-    if config.get('start_date') is not None:
-        df = df.loc[config.get('start_date'):]
-    if config.get('end_date') is not None:
-        df = df.loc[: config.get('end_date')]
-    return df
-
-
-config = parse_config()
-log_path = init_logging()
-order_history_tracker = OrderHistoryTracker(
-    log_path.parent / f'{log_path.stem}.csv',)
-
-logging.info('import', config['dataset'])
-df = load_dataset()
-logging.info(df.head())
-data_feed = bt.feeds.PandasData(dataname=df)
-
-cerebro = bt.Cerebro(stdstats=False, runonce=False)
-cerebro.broker.set_coc(True)
-logging.info('init cash', config['broker']['init_cash'])
-cerebro.broker.set_cash(config['broker']['init_cash'])
-
-logging.info('default stake', config['sizer']['default_stake'])
-cerebro.addsizer(bt.sizers.SizerFix, stake=config['sizer']['default_stake'])
-
-cerebro.adddata(data_feed)
-
-cerebro.addobserver(bt.observers.Broker)
-cerebro.addobserver(bt.observers.BuySell, barplot=True)
-cerebro.addobserver(bt.observers.Trades)
-cerebro.addobserver(bt.observers.TimeReturn)
-
-cerebro.addanalyzer(bt.analyzers.TradeAnalyzer)
-cerebro.addanalyzer(bt.analyzers.PyFolio)
-for strategy_config in config['strategies']:
-    logging.info('Add strategy', strategy_config['name'])
-    logging.info('params', strategy_config['params'])
-    cerebro.addstrategy(
-        strategy=strategy_config['strategy'],
-        # tracker=order_history_tracker,
-        **strategy_config['params'])
-
-strategy_results = cerebro.run()
-
-
-# pyfoliozer = strategy_results[0].analyzers.getbyname('pyfolio')
-# returns, positions, transactions, gross_lev = pyfoliozer.get_pf_items()
-
-# import pyfolio as pf
-# pf.create_full_tear_sheet(
-#     returns,
-#     positions=positions,
-#     transactions=transactions,
-#     # gross_lev=gross_lev,
-#     # live_start_date='2005-05-01',  # This date is sample specific
-#     round_trips=False,
-#     )
-ending_value = cerebro.broker.getvalue()
-print('ending value', ending_value)
-if config.get('plot'):
+def plot(cerebro):
+    # Plotting stacks are only imported when a run is plotted, headless runs
+    # start without them.
     set_figsize(10, 8)
+    # from backtrader_plotting import Bokeh
+    # from backtrader_plotting.schemes import Blackly
     # b = Bokeh(style='bar', plot_mode='single', scheme=Blackly())
     # cerebro.plot(b)
     cerebro.plot(iplot=True, style='bar')
+
+
+def sweep(config, log_path, processes=None):
+    result_df = run_sweep(config, processes=processes)
+    result_path = log_path.parent / f'{log_path.stem}_sweep.csv'
+    result_df.to_csv(result_path)
+    logging.info('sweep results saved to %s', result_path)
+    print(result_df.to_string())
+    return result_df
+
+
+def optimize(config, log_path, processes=None):
+    # The evaluations file is kept per config, not per run, so a rerun resumes.
+    state_path = config['optimize'].get('state_path') or log_path.parent / 'optimize.json'
+    result_df, summary = run_optimizer(config, state_path=state_path, processes=processes)
+    result_path = log_path.parent / f'{log_path.stem}_optimize.csv'
+    result_df.to_csv(result_path)
+    logging.info('optimize results saved to %s, %s', result_path, summary)
+    print(result_df.to_string())
+    return result_df
+
+
+def main():
+    args = argparser.parse_args()
+    config = load_config(args.config_path)
+    log_path = init_logging(args.config_path, config.get('logging'))
+
+    if config.get('optimize') and has_sweep(config):
+        optimize(config, log_path, processes=args.processes)
+        return
+
+    if has_sweep(config):
+        sweep(config, log_path, processes=args.processes)
+        return
+
+    if config.get('order_history_format', 'csv') == 'csv':
+        history_path = log_path.parent / f'{log_path.stem}.csv'
+    else:
+        history_path = log_path.parent / f'{log_path.stem}_orders'
+    order_history_tracker = OrderHistoryTracker(history_path, file_format=config.get('order_history_format'))
+
+    logging.info('import %s', config['dataset'])
+    # A streaming feed reads the dataset itself, chunk by chunk.
+    df = None if config.get('feed') else load_experiment_dataset(config)
+    if df is not None:
+        logging.info(df.head())
+
+    # Observers only feed the plot, unplotted runs just record equity and trades.
+    cerebro, strategy_results = run_backtest(config, df, stats=bool(config.get('plot')),
+                                             tracker=order_history_tracker)
+    order_history_tracker.flush()
+
+    # pyfoliozer = strategy_results[0].analyzers.getbyname('pyfolio')
+    # returns, positions, transactions, gross_lev = pyfoliozer.get_pf_items()
+
+    # import pyfolio as pf
+    # pf.create_full_tear_sheet(
+    #     returns,
+    #     positions=positions,
+    #     transactions=transactions,
+    #     # gross_lev=gross_lev,
+    #     # live_start_date='2005-05-01',  # This date is sample specific
+    #     round_trips=False,
+    #     )
+    ending_value = cerebro.broker.getvalue()
+    print('ending value', ending_value)
+    analysis = strategy_results[0].analyzers.analytics.get_analysis()
+    logging.info('analytics %s', analysis)
+    print(pd.Series(analysis).to_string())
+    if config.get('plot'):
+        plot(cerebro)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,2 @@
+from .synthetic import generate_ohlcv, write_ohlcv_csv
+from .suite import BENCHMARKS, run_benchmarks
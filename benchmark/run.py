@@ -0,0 +1,105 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .suite import BENCHMARKS, run_benchmarks
+
+DEFAULT_RESULTS_DIR = Path('benchmark') / 'results'
+DEFAULT_BASELINE_PATH = DEFAULT_RESULTS_DIR / 'baseline.json'
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def save_results(results, path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=1)
+    return path
+
+
+def load_results(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)['results']
+
+
+def compare_results(results, baseline, tolerance=0.2) -> pd.DataFrame:
+    '''
+    Rates against a baseline run, matched by benchmark name and bar count.
+
+    ratio = rate / baseline rate, a run is flagged as regressed when it is
+    slower than the baseline by more than tolerance.
+    '''
+    baseline_rates = {(row['benchmark'], row['bars']): row['rate'] for row in baseline}
+    rows = []
+    for row in results:
+        baseline_rate = baseline_rates.get((row['benchmark'], row['bars']))
+        if baseline_rate is None:
+            continue
+        ratio = row['rate'] / baseline_rate
+        rows.append({'benchmark': row['benchmark'], 'bars': row['bars'], 'rate': row['rate'],
+                     'baseline_rate': baseline_rate, 'ratio': ratio, 'regressed': ratio < 1 - tolerance})
+    return pd.DataFrame(rows, columns=['benchmark', 'bars', 'rate', 'baseline_rate', 'ratio', 'regressed'])
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description='Benchmark the data, model, strategy and tracker hot paths on synthetic bars')
+    argparser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000],
+                           help='synthetic bar counts, 10k to 10M')
+    argparser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=None)
+    argparser.add_argument('--repeat', type=int, default=3)
+    argparser.add_argument('--model-path', default=None,
+                           help='window 48 regression model, a small one is trained when not given')
+    argparser.add_argument('--output', default=None,
+                           help='defaults to benchmark/results/<time>.json')
+    argparser.add_argument('--baseline', default=str(DEFAULT_BASELINE_PATH),
+                           help='results file to compare against, when it exists')
+    argparser.add_argument('--save-baseline', action='store_true',
+                           help='also store this run as the baseline')
+    argparser.add_argument('--tolerance', type=float, default=0.2,
+                           help='allowed slowdown against the baseline before a run is flagged')
+    args = argparser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    results = run_benchmarks(args.sizes, names=args.only, repeat=args.repeat, model_path=args.model_path)
+    output = args.output or DEFAULT_RESULTS_DIR / f"{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json"
+    save_results(results, output)
+    with pd.option_context('display.width', 200):
+        print(pd.DataFrame(results).to_string(index=False))
+    print(f'results saved to {output}')
+
+    regressed = False
+    if Path(args.baseline).exists() and not args.save_baseline:
+        comparison = compare_results(results, load_results(args.baseline), tolerance=args.tolerance)
+        with pd.option_context('display.width', 200):
+            print(comparison.to_string(index=False))
+        regressed = bool(comparison['regressed'].any())
+    if args.save_baseline:
+        save_results(results, args.baseline)
+        print(f'baseline saved to {args.baseline}')
+    sys.exit(1 if regressed else 0)
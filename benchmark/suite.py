@@ -0,0 +1,210 @@
+import contextlib
+import importlib
+import inspect
+import logging
+import pickle
+import pkgutil
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import backtrader as bt
+import numpy as np
+
+from data import DatasetCache, load_cached_dataset
+from runner import build_cerebro, load_dataset
+from util import OrderHistoryTracker
+
+from .synthetic import generate_ohlcv, write_ohlcv_csv
+
+# Params per strategy class, scaled to the first close of the synthetic
+# series. Strategies missing here are reported as skipped.
+STRATEGY_PARAMS = {
+    'GoldenCrossStrategy': lambda price: {'fast': 30, 'slow': 60},
+    'GridTradingStrategy': lambda price: {
+        'base_grid_price': price * 0.8, 'n_grid': 32, 'grid_size': price * 0.0125, 'grid_share': 1},
+    'GridBasicStrategy': lambda price: {
+        'n_grid': 32, 'zone': {'top_grid_price': price * 1.5, 'bottom_grid_price': price * 0.5},
+        'position': {'type': 'FIX_CASH', 'position_cash': 1000}},
+    'GridAdaptiveZoneStrategy': lambda price: {
+        'n_grid': 32, 'zone': {'start_price': price, 'high_side_ratio': 0.5, 'low_side_ratio': 0.5},
+        'position': {'type': 'FIX_CASH', 'position_cash': 1000}},
+    'RegressionStrategy': lambda price: {'window_size': 48, 'prediction_cache': False},
+}
+
+
+class BenchmarkContext:
+    '''
+    Synthetic inputs of one size, generated lazily and shared by the benchmarks.
+
+    model_path = pickled RegressionModel compatible model with window 48, a
+    small LightGBM model is trained on the synthetic bars when None.
+    '''
+
+    def __init__(self, n_bars, work_dir, model_path=None, seed=0):
+        self.n_bars = n_bars
+        self.work_dir = Path(work_dir)
+        self.seed = seed
+        self._model_path = model_path
+        self._df = None
+        self._csv_path = None
+
+    @property
+    def df(self):
+        if self._df is None:
+            self._df = generate_ohlcv(self.n_bars, seed=self.seed)
+        return self._df
+
+    @property
+    def csv_path(self):
+        if self._csv_path is None:
+            self._csv_path = write_ohlcv_csv(self.df, self.work_dir / f'synthetic_{self.n_bars}.csv')
+        return self._csv_path
+
+    @property
+    def model_path(self):
+        if self._model_path is None:
+            self._model_path = train_benchmark_model(self.df, self.work_dir / 'model.pickle')
+        return self._model_path
+
+
+def train_benchmark_model(df, path, max_rows=20000):
+    from runner.walk_forward import FeatureSet, train_model
+
+    features = FeatureSet(df.iloc[:max_rows + 48])
+    model = train_model(features, np.isfinite(features.target), {'n_estimators': 50, 'verbose': -1})
+    with open(path, 'wb') as f:
+        pickle.dump(model, f)
+    return path
+
+
+def measure(fn, repeat=3):
+    '''Best wall time of repeat calls, setup belongs outside fn.'''
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+@contextlib.contextmanager
+def quiet():
+    '''Runs log their setup and strategies their orders, keep that out of the timings and their output.'''
+    logging.disable(logging.INFO)
+    try:
+        yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def bench_load_dataset(context, repeat):
+    csv_path = context.csv_path
+    cache_dir = context.work_dir / 'dataset_cache'
+    DatasetCache(cache_dir).ingest(csv_path)
+    yield 'load_dataset.csv', measure(lambda: load_dataset(csv_path, cache=False), repeat), context.n_bars
+    yield 'load_dataset.cached', measure(lambda: load_cached_dataset(csv_path, cache_dir=cache_dir),
+                                         repeat), context.n_bars
+
+
+def bench_regression_model(context, repeat):
+    from machine_learning import RegressionModel
+
+    model = RegressionModel(context.model_path, window_size=48)
+    df = context.df.reset_index()
+    yield 'regression_model.preprocess', measure(lambda: model.preprocess(df), repeat), context.n_bars
+    yield 'regression_model.predict', measure(lambda: model.predict(df), repeat), context.n_bars
+
+
+def strategy_classes():
+    '''bt.Strategy subclasses defined in the strategy package, by name.'''
+    import strategy as strategy_package
+
+    classes = {}
+    for module_info in pkgutil.iter_modules(strategy_package.__path__):
+        module = importlib.import_module(f'strategy.{module_info.name}')
+        for name, obj in inspect.getmembers(module, inspect.isclass):
+            if issubclass(obj, bt.Strategy) and obj.__module__ == module.__name__:
+                classes[name] = obj
+    return classes
+
+
+def bench_strategies(context, repeat):
+    price = float(context.df['close'].iloc[0])
+    for name, strategy in sorted(strategy_classes().items()):
+        if name not in STRATEGY_PARAMS:
+            logging.warning('no benchmark params for %s, skipped', name)
+            continue
+        params = STRATEGY_PARAMS[name](price)
+        if name == 'RegressionStrategy':
+            params['model_path'] = str(context.model_path)
+        config = {
+            'broker': {'init_cash': 1e9},
+            'sizer': {'default_stake': 1},
+            'strategies': [{'strategy': strategy, 'name': name, 'params': params}],
+        }
+
+        def run():
+            with quiet():
+                build_cerebro(config, context.df, stats=False).run()
+        yield f'strategy.{name}', measure(run, repeat), context.n_bars
+
+
+class _Order:
+    '''Just the attributes OrderHistoryTracker.notify_order reads.'''
+
+    def __init__(self, ref, status, price, buy):
+        self.ref = ref
+        self.status = status
+        self.parent = None
+        self.created = self.executed = SimpleNamespace(price=price)
+        self.order_type = 'LONG' if buy else 'LONG_TP'
+        self.buy = buy
+
+    def isbuy(self):
+        return self.buy
+
+
+def bench_order_history_tracker(context, repeat):
+    n_events = context.n_bars
+    statuses = [bt.Order.Created, bt.Order.Accepted, bt.Order.Completed]
+    orders = [_Order(i // 3, statuses[i % 3], 100.0 + i % 7, (i // 3) % 2 == 0) for i in range(min(n_events, 3000))]
+    strategy = SimpleNamespace(datas=[SimpleNamespace(datetime=[bt.date2num(context.df.index[0])])],
+                               position=SimpleNamespace(size=1.0))
+
+    for file_format, suffix in (('csv', '.csv'), ('columnar', '')):
+        def run():
+            tracker = OrderHistoryTracker(context.work_dir / f'history{suffix}', file_format=file_format)
+            for i in range(n_events):
+                tracker.notify_order(strategy, orders[i % len(orders)])
+            tracker.flush()
+        yield f'order_history_tracker.{file_format}', measure(run, repeat), n_events
+
+
+BENCHMARKS = {
+    'load_dataset': bench_load_dataset,
+    'regression_model': bench_regression_model,
+    'strategy': bench_strategies,
+    'order_history_tracker': bench_order_history_tracker,
+}
+
+
+def run_benchmarks(sizes, names=None, repeat=3, model_path=None):
+    '''
+    Run the selected BENCHMARKS at every size, returns result records.
+
+    Each record holds the benchmark name, bars (or events) processed, the best
+    time of repeat runs in seconds and the resulting rate per second.
+    '''
+    names = names or list(BENCHMARKS)
+    results = []
+    for n_bars in sizes:
+        with tempfile.TemporaryDirectory(prefix='benchmark-') as work_dir:
+            context = BenchmarkContext(n_bars, work_dir, model_path=model_path)
+            for name in names:
+                for benchmark, seconds, items in BENCHMARKS[name](context, repeat):
+                    results.append({'benchmark': benchmark, 'bars': items, 'seconds': seconds,
+                                    'rate': items / seconds if seconds else float('inf')})
+                    logging.info('%s @ %d bars: %.4fs, %.0f/s', benchmark, items, seconds, results[-1]['rate'])
+    return results
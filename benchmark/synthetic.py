@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+CSV_COLUMNS = ['time', 'open', 'high', 'low', 'close', 'tick_volume']
+
+
+def generate_ohlcv(n_bars, timeframe='1min', start='2000-01-01', start_price=100.0,
+                   volatility=0.002, gap_ratio=0.0, seed=0) -> pd.DataFrame:
+    '''
+    Random walk OHLCV bars in the canonical schema, indexed by time.
+
+    Closes follow a geometric random walk with volatility per bar, every bar
+    opens at the previous close and high / low extend past the body by a
+    random wick. gap_ratio = share of bars dropped at random, like market
+    closes in MT5 exports. The default 1min timeframe keeps 10M bars inside
+    the pandas timestamp range.
+    '''
+    rng = np.random.default_rng(seed)
+    n_total = int(n_bars / (1 - gap_ratio)) + 1 if gap_ratio else n_bars
+
+    close = start_price * np.exp(np.cumsum(rng.normal(0.0, volatility, n_total)))
+    open_ = np.empty(n_total)
+    open_[0] = start_price
+    open_[1:] = close[:-1]
+    wick = np.abs(rng.normal(0.0, volatility / 2, (2, n_total)))
+    high = np.maximum(open_, close) * (1 + wick[0])
+    low = np.minimum(open_, close) * (1 - wick[1])
+    volume = rng.gamma(2.0, 500.0, n_total)
+    time = pd.date_range(start, periods=n_total, freq=timeframe, name='time')
+
+    df = pd.DataFrame({'open': open_, 'high': high, 'low': low, 'close': close, 'volume': volume},
+                      index=time)
+    if gap_ratio:
+        keep = np.sort(rng.choice(n_total, size=n_bars, replace=False))
+        df = df.iloc[keep]
+    return df
+
+
+def write_ohlcv_csv(df: pd.DataFrame, path):
+    '''Write generated bars in the layout of the dataset/ csv files.'''
+    out = df.rename(columns={'volume': 'tick_volume'}).reset_index()
+    out[CSV_COLUMNS].to_csv(path, index=False, date_format='%Y-%m-%d %H:%M:%S', float_format='%.6f')
+    return path
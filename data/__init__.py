@@ -0,0 +1,19 @@
+from .dataset_cache import CANONICAL_COLUMNS, CachedDataset, DatasetCache, load_cached_dataset, normalize_dataset
+from .resample import ResampleCache, aggregate_ohlcv, load_resampled_dataset, resample_frame, timeframe_ns
+
+# The fetcher pulls in asyncio and is only needed to download data.
+FETCHER_NAMES = ['CcxtExchange', 'ExchangeAdapter', 'FakeExchange', 'OhlcvFetcher', 'RateLimitError', 'fetch']
+# The feed pulls in backtrader.
+FEED_NAMES = ['CachedDatasetFeed', 'CsvTail', 'date2num_ns']
+
+
+def __getattr__(name):
+    if name in FETCHER_NAMES:
+        from . import fetcher
+
+        return getattr(fetcher, name)
+    if name in FEED_NAMES:
+        from . import feed
+
+        return getattr(feed, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
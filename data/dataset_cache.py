@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+CANONICAL_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+DEFAULT_CACHE_DIR = Path('.cache') / 'dataset'
+SCHEMA_VERSION = 1
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalize_dataset(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Bring a raw MT5 or Binance export to the canonical time-sorted OHLCV schema.
+
+    MT5 files carry tick_volume, spread and real_volume, Binance exports also
+    carry symbol and tradecount and are stored newest first.
+    '''
+    df = df.rename(columns={'tick_volume': 'volume'})
+    if 'volume' not in df.columns:
+        df['volume'] = 0.0
+    df['time'] = pd.to_datetime(df['time'])
+    df = df.sort_values('time', kind='mergesort')
+    return df[['time'] + CANONICAL_COLUMNS].reset_index(drop=True)
+
+
+class CachedDataset:
+    '''
+    Memory-mapped columnar view of one ingested dataset.
+
+    Every column is a .npy file, time is stored as int64 nanoseconds so a date
+    range is located with a binary search and only that slice is read.
+    '''
+
+    def __init__(self, cache_path):
+        self.cache_path = Path(cache_path)
+        with open(self.cache_path / 'meta.json', 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.time = np.load(self.cache_path / 'time.npy', mmap_mode='r')
+        self.columns = {col: np.load(self.cache_path / f'{col}.npy', mmap_mode='r')
+                        for col in CANONICAL_COLUMNS}
+
+    def __len__(self):
+        return len(self.time)
+
+    @staticmethod
+    def _to_ns(value, end=False):
+        # A date-only string end bound includes the whole day, like DataFrame.loc
+        # partial string indexing. Date objects (YAML dates) mean midnight.
+        date_only = isinstance(value, str) and len(value.strip()) <= 10
+        timestamp = pd.Timestamp(value)
+        if end and date_only:
+            return (timestamp + pd.Timedelta(days=1)).value, 'left'
+        return timestamp.value, 'right' if end else 'left'
+
+    def locate(self, start_date=None, end_date=None):
+        start, stop = 0, len(self.time)
+        if start_date is not None:
+            value, side = self._to_ns(start_date)
+            start = int(np.searchsorted(self.time, value, side=side))
+        if end_date is not None:
+            value, side = self._to_ns(end_date, end=True)
+            stop = int(np.searchsorted(self.time, value, side=side))
+        return start, max(start, stop)
+
+    def to_dataframe(self, start_date=None, end_date=None) -> pd.DataFrame:
+        start, stop = self.locate(start_date, end_date)
+        index = pd.DatetimeIndex(np.asarray(self.time[start:stop]).astype('datetime64[ns]'), name='time')
+        return pd.DataFrame({col: np.asarray(self.columns[col][start:stop]) for col in CANONICAL_COLUMNS},
+                            index=index)
+
+
+class DatasetCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.index_path = self.cache_dir / 'index.json'
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def source_hash(self, source_path):
+        '''
+        Content hash of the source file. The stat-keyed index only saves the
+        re-hash while the file is untouched, the cache key is always the hash.
+        '''
+        source_path = Path(source_path).resolve()
+        stat = source_path.stat()
+        entry = self._load_index().get(str(source_path))
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['hash']
+
+        digest = file_hash(source_path)
+        index = self._load_index()
+        index[str(source_path)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': digest}
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_name(f'index.json.{os.getpid()}')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp_path, self.index_path)
+        return digest
+
+    def cache_path(self, source_path, digest):
+        return self.cache_dir / f'{Path(source_path).stem}-{digest[:16]}-v{SCHEMA_VERSION}'
+
+    def ingest(self, source_path, force=False):
+        digest = self.source_hash(source_path)
+        cache_path = self.cache_path(source_path, digest)
+        if cache_path.exists() and not force:
+            return cache_path
+
+        df = normalize_dataset(pd.read_csv(source_path))
+
+        # Write next to the target and rename, so concurrent sweep workers
+        # never see a half written dataset.
+        tmp_path = cache_path.with_name(f'{cache_path.name}.tmp-{os.getpid()}')
+        tmp_path.mkdir(parents=True, exist_ok=True)
+        np.save(tmp_path / 'time.npy', df['time'].values.astype('datetime64[ns]').astype(np.int64))
+        for col in CANONICAL_COLUMNS:
+            np.save(tmp_path / f'{col}.npy', df[col].to_numpy(dtype=np.float64))
+        with open(tmp_path / 'meta.json', 'w', encoding='utf-8') as f:
+            json.dump({'source': str(source_path), 'hash': digest, 'rows': len(df),
+                       'schema_version': SCHEMA_VERSION}, f, indent=1)
+
+        if force and cache_path.exists():
+            shutil.rmtree(cache_path)
+        try:
+            os.rename(tmp_path, cache_path)
+        except OSError:
+            # Another process finished the same ingest first.
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        return cache_path
+
+    def open(self, source_path):
+        return CachedDataset(self.ingest(source_path))
+
+    def ingest_all(self, dataset_dir='dataset', pattern='*.csv', force=False):
+        return [self.ingest(path, force=force) for path in sorted(Path(dataset_dir).glob(pattern))]
+
+
+def load_cached_dataset(source_path, start_date=None, end_date=None, cache_dir=DEFAULT_CACHE_DIR):
+    return DatasetCache(cache_dir).open(source_path).to_dataframe(start_date, end_date)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    argparser = argparse.ArgumentParser(description='Ingest CSV datasets into the binary columnar cache')
+    argparser.add_argument('dataset_dir', nargs='?', default='dataset')
+    argparser.add_argument('--cache-dir', default=str(DEFAULT_CACHE_DIR))
+    argparser.add_argument('--force', action='store_true')
+    args = argparser.parse_args()
+
+    for cache_path in DatasetCache(args.cache_dir).ingest_all(args.dataset_dir, force=args.force):
+        print(cache_path)
@@ -0,0 +1,218 @@
+import csv
+import math
+import queue
+from pathlib import Path
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+from .dataset_cache import CANONICAL_COLUMNS, DEFAULT_CACHE_DIR, CachedDataset, DatasetCache
+
+NS_PER_DAY = 86400 * 10 ** 9
+# date.toordinal() of 1970-01-01
+EPOCH_ORDINAL = 719163
+
+
+def date2num_ns(time_ns):
+    '''bt.date2num of int64 nanosecond UTC times, as a list, identical to the per datetime version.'''
+    days, ns = np.divmod(np.asarray(time_ns, dtype=np.int64), NS_PER_DAY)
+    hours, ns = np.divmod(ns, 3600 * 10 ** 9)
+    minutes, ns = np.divmod(ns, 60 * 10 ** 9)
+    seconds, ns = np.divmod(ns, 10 ** 9)
+    return [math.fsum((float(day + EPOCH_ORDINAL), hour / 24.0, minute / 1440.0,
+                       second / 86400.0, microsecond / 86400000000.0))
+            for day, hour, minute, second, microsecond
+            in zip(days.tolist(), hours.tolist(), minutes.tolist(), seconds.tolist(), (ns // 1000).tolist())]
+
+
+class CsvTail:
+    '''
+    Rows appended to an ascending OHLCV csv after offset, such as the fetcher writes.
+
+    read returns the complete lines added since the last read as time_ns and
+    canonical column arrays, a partly written last line is left for the next.
+    '''
+
+    def __init__(self, path, offset):
+        self.path = Path(path)
+        self.offset = offset
+        with open(self.path, 'r', encoding='utf-8') as f:
+            self.header = next(csv.reader([f.readline()]))
+
+    def read(self):
+        size = self.path.stat().st_size
+        if size <= self.offset:
+            return None
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        end = data.rfind(b'\n') + 1
+        if not end:
+            return None
+        self.offset += end
+        df = pd.DataFrame(list(csv.reader(data[:end].decode('utf-8').splitlines())), columns=self.header)
+        df = df.rename(columns={'tick_volume': 'volume'})
+        if 'volume' not in df.columns:
+            df['volume'] = 0.0
+        time_ns = pd.to_datetime(df['time']).values.astype('datetime64[ns]').astype(np.int64)
+        return time_ns, {col: df[col].to_numpy(dtype=np.float64) for col in CANONICAL_COLUMNS}
+
+
+class CachedDatasetFeed(bt.feed.DataBase):
+    '''
+    Feed streaming a cached dataset in chunks, that also takes appended bars.
+
+    Only chunk_size bars of the memory-mapped dataset are converted at a
+    time, instead of holding the history in a DataFrame for PandasData.
+    After the dataset, bars passed to append from any thread are loaded,
+    as are rows appended to the dataset csv when follow is set. Bars not
+    after the last loaded one are dropped, so overlapping appends are
+    harmless. Without follow the feed ends with the bars it has. With follow
+    it waits for more until finish is called, rolling a backtest on into
+    forward testing. The bars available at start are preloaded when cerebro
+    preloads, later ones are loaded as they arrive. build_cerebro turns
+    preloading off and bounds the line buffers, so memory follows chunk_size
+    rather than the history.
+
+    dataname = source csv path or a CachedDataset, None for appended bars
+    only. start_date / end_date = range of the dataset, end_date also caps
+    appended bars. tag = tag passed to append with the current bar, None
+    for dataset bars.
+    '''
+    params = (
+        ('start_date', None),
+        ('end_date', None),
+        ('chunk_size', 65536),
+        ('follow', False),
+        # seconds between checks of a followed csv for new rows
+        ('poll_interval', 1.0),
+        ('cache_dir', DEFAULT_CACHE_DIR),
+    )
+
+    def __init__(self):
+        self.appended = queue.SimpleQueue()
+        self.tag = None
+
+    def start(self):
+        super().start()
+        self.dataset = None
+        self.csv_tail = None
+        self.cursor = self.stop_row = 0
+        self.end = CachedDataset._to_ns(self.p.end_date, end=True) if self.p.end_date is not None else None
+        source = self.p.dataname
+        if isinstance(source, CachedDataset):
+            self.dataset = source
+        elif source is not None:
+            # Stat before ingesting, rows appended meanwhile are read twice and dropped, never missed.
+            offset = Path(source).stat().st_size
+            self.dataset = DatasetCache(self.p.cache_dir).open(source)
+            if self.p.follow and self.p.end_date is None:
+                self.csv_tail = CsvTail(source, offset)
+        if self.dataset is not None:
+            self.cursor, self.stop_row = self.dataset.locate(self.p.start_date, self.p.end_date)
+
+        self.last_ns = None
+        self.finished = False
+        self.preloading = False
+        self.chunk = None
+        self.position = 0
+
+    def preload(self):
+        self.preloading = True
+        try:
+            super().preload()
+        finally:
+            self.preloading = False
+
+    def append(self, rows, tag=None):
+        '''Thread safe, rows = [[timestamp_ms, open, high, low, close, volume], ...] as fetch_ohlcv returns them.'''
+        if not rows:
+            return
+        array = np.asarray([row[:6] for row in rows], dtype=np.float64)
+        time_ns = array[:, 0].astype(np.int64) * 10 ** 6
+        self.appended.put((time_ns, dict(zip(CANONICAL_COLUMNS, array[:, 1:].T)), tag))
+
+    def finish(self):
+        '''Let a following feed end once the bars appended so far are loaded.'''
+        self.appended.put(None)
+
+    def frames(self):
+        '''The dataset range as time-indexed frames of chunk_size bars, for indicators that predict it ahead.'''
+        if self.dataset is None:
+            return
+        start, stop = self.dataset.locate(self.p.start_date, self.p.end_date)
+        for first in range(start, stop, self.p.chunk_size):
+            last = min(first + self.p.chunk_size, stop)
+            index = pd.DatetimeIndex(np.asarray(self.dataset.time[first:last]).astype('datetime64[ns]'), name='time')
+            yield pd.DataFrame({col: np.asarray(self.dataset.columns[col][first:last]) for col in CANONICAL_COLUMNS},
+                               index=index)
+
+    def __set_chunk(self, time_ns, columns, tag=None):
+        if self.last_ns is not None or self.end is not None:
+            keep = np.ones(len(time_ns), dtype=bool)
+            if self.last_ns is not None:
+                keep &= time_ns > self.last_ns
+            if self.end is not None:
+                end_ns, side = self.end
+                keep &= time_ns <= end_ns if side == 'right' else time_ns < end_ns
+            if not keep.all():
+                time_ns, columns = time_ns[keep], {col: values[keep] for col, values in columns.items()}
+        if not len(time_ns):
+            return False
+        self.last_ns = int(time_ns[-1])
+        self.chunk = [date2num_ns(time_ns)] + [np.asarray(columns[col]).tolist() for col in CANONICAL_COLUMNS]
+        self.chunk_tag = tag
+        self.position = 0
+        return True
+
+    def __get_appended(self, block):
+        try:
+            item = self.appended.get(timeout=self.p.poll_interval) if block else self.appended.get_nowait()
+        except queue.Empty:
+            return None
+        if item is None:
+            self.finished = True
+        return item
+
+    def __next_chunk(self):
+        '''Move to the next chunk of bars, False when there is none for now, or for good once finished.'''
+        while not self.finished:
+            if self.cursor < self.stop_row:
+                stop = min(self.cursor + self.p.chunk_size, self.stop_row)
+                time_ns = np.asarray(self.dataset.time[self.cursor:stop])
+                columns = {col: np.asarray(self.dataset.columns[col][self.cursor:stop]) for col in CANONICAL_COLUMNS}
+                self.cursor = stop
+                if self.__set_chunk(time_ns, columns):
+                    return True
+                continue
+
+            waiting = self.p.follow and not self.preloading
+            item = self.__get_appended(block=False)
+            if item is None and self.csv_tail is not None and not self.finished:
+                item = self.csv_tail.read()
+            if item is None and waiting and not self.finished:
+                # Wakes up early on append, otherwise rechecks the csv every poll_interval.
+                item = self.__get_appended(block=True)
+            if item is not None and self.__set_chunk(*item):
+                return True
+            if item is None and not waiting:
+                return False
+        return False
+
+    def _load(self):
+        if self.chunk is None or self.position >= len(self.chunk[0]):
+            if not self.__next_chunk():
+                return False
+        i = self.position
+        self.position += 1
+        datetime_, open_, high, low, close, volume = self.chunk
+        self.tag = self.chunk_tag
+        self.lines.datetime[0] = datetime_[i]
+        self.lines.open[0] = open_[i]
+        self.lines.high[0] = high[i]
+        self.lines.low[0] = low[i]
+        self.lines.close[0] = close[i]
+        self.lines.volume[0] = volume[i]
+        self.lines.openinterest[0] = 0.0
+        return True
@@ -0,0 +1,318 @@
+import asyncio
+import calendar
+import collections
+import csv
+import datetime
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+
+OHLCV_HEADER = ['time', 'open', 'high', 'low', 'close', 'tick_volume']
+DAY_MS = 86400 * 1000
+
+
+class RateLimitError(Exception):
+    '''Raised by adapters when the exchange asks to slow down or a request fails transiently.'''
+
+
+class ExchangeAdapter:
+    '''
+    Minimal exchange interface the fetcher needs.
+
+    fetch_ohlcv returns [[timestamp_ms, open, high, low, close, volume], ...]
+    starting at the first candle at or after since, at most limit rows.
+    '''
+    page_limit = 500
+    # Minimum seconds between two requests, shared by all concurrent fetches
+    rate_limit = 0.0
+    # Exchange clock ms per wall clock ms, above 1 for accelerated replays
+    speed = 1.0
+
+    async def fetch_ohlcv(self, symbol, timeframe, since, limit):
+        raise NotImplementedError
+
+    def timeframe_ms(self, timeframe):
+        raise NotImplementedError
+
+    def now_ms(self):
+        return int(time.time() * 1000)
+
+    async def wait_until(self, ms):
+        '''Sleep until the exchange clock reads ms.'''
+        delay = (ms - self.now_ms()) / 1000
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def close(self):
+        pass
+
+
+class CcxtExchange(ExchangeAdapter):
+    '''ccxt async_support exchange, e.g. CcxtExchange('binance').'''
+
+    def __init__(self, exchange_id='binance', page_limit=1000, config=None):
+        import ccxt
+        import ccxt.async_support as ccxt_async
+
+        self._errors = ccxt
+        # Requests are throttled by the fetcher so ccxt's own limiter is off.
+        self.exchange = getattr(ccxt_async, exchange_id)({'enableRateLimit': False, **(config or {})})
+        self.page_limit = page_limit
+        self.rate_limit = self.exchange.rateLimit / 1000
+
+    async def fetch_ohlcv(self, symbol, timeframe, since, limit):
+        try:
+            return await self.exchange.fetch_ohlcv(symbol, timeframe, since=since, limit=limit)
+        except (self._errors.RateLimitExceeded, self._errors.DDoSProtection,
+                self._errors.RequestTimeout, self._errors.NetworkError) as e:
+            raise RateLimitError(str(e)) from e
+
+    def timeframe_ms(self, timeframe):
+        return self.exchange.parse_timeframe(timeframe) * 1000
+
+    def now_ms(self):
+        return self.exchange.milliseconds()
+
+    async def close(self):
+        await self.exchange.close()
+
+
+class FakeExchange(ExchangeAdapter):
+    '''
+    Deterministic in-memory exchange for tests and benchmarks.
+
+    Serves a candle every timeframe from listed_ms up to now_ms, optionally
+    sleeping latency seconds per request and raising RateLimitError on every
+    fail_every-th request. Requests are recorded in calls.
+    '''
+    TIMEFRAMES = {'1m': 60 * 1000, '5m': 300 * 1000, '15m': 900 * 1000,
+                  '1h': 3600 * 1000, '4h': 4 * 3600 * 1000, '1d': DAY_MS}
+
+    def __init__(self, listed_ms, now_ms, page_limit=500, latency=0.0, fail_every=None):
+        self.listed_ms = listed_ms
+        self._now_ms = now_ms
+        self.page_limit = page_limit
+        self.latency = latency
+        self.fail_every = fail_every
+        self.calls = []
+
+    async def fetch_ohlcv(self, symbol, timeframe, since, limit):
+        self.calls.append((symbol, timeframe, since, limit))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.fail_every and len(self.calls) % self.fail_every == 0:
+            raise RateLimitError('fake rate limit')
+
+        step = self.timeframe_ms(timeframe)
+        first = max(since, self.listed_ms)
+        first = -(-(first - self.listed_ms) // step) * step + self.listed_ms
+        rows = []
+        for ts in range(first, self._now_ms, step):
+            if len(rows) == min(limit, self.page_limit):
+                break
+            price = 100.0 + (ts // step) % 50
+            rows.append([ts, price, price + 1.0, price - 1.0, price + 0.5, 10.0])
+        return rows
+
+    def timeframe_ms(self, timeframe):
+        return self.TIMEFRAMES[timeframe]
+
+    def now_ms(self):
+        return self._now_ms
+
+
+class RateLimiter:
+    '''Spaces request starts at least interval seconds apart across tasks.'''
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = asyncio.Lock()
+        self._next_at = 0.0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            delay = self._next_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_at = loop.time() + self.interval
+
+
+def to_ms(value):
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime(value.year, value.month, value.day)
+    return calendar.timegm(value.utctimetuple()) * 1000
+
+
+def output_path(output_dir, symbol, timeframe):
+    return Path(output_dir) / f'{symbol.replace("/", "")}_{timeframe}.csv'
+
+
+def first_timestamp_ms(path):
+    '''Time of the first row of an ascending OHLCV csv, None when there is none.'''
+    if not path.exists() or path.stat().st_size == 0:
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip() and not line.startswith('time'):
+                return to_ms(line.split(',', 1)[0])
+    return None
+
+
+def last_timestamp_ms(path):
+    '''Time of the last row of an ascending OHLCV csv, None when there is none.'''
+    if not path.exists() or path.stat().st_size == 0:
+        return None
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        tail = b''
+        while position > 0 and tail.count(b'\n') < 3:
+            step = min(4096, position)
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+    lines = [line for line in tail.decode('utf-8').splitlines() if line.strip()]
+    if not lines or lines[-1].startswith('time'):
+        return None
+    return to_ms(lines[-1].split(',', 1)[0])
+
+
+class OhlcvFetcher:
+    '''
+    Concurrent, incremental OHLCV downloader.
+
+    Every symbol / timeframe is resumed after the last row of its csv in
+    output_dir (or fetched from start_datetime) up to the last closed candle.
+    When start_datetime is before the first stored row that gap is fetched
+    first, into a separate file the csv is then appended to and replaces.
+    The missing range is cut into page-sized time windows, of which at most
+    max_concurrency per symbol are scheduled ahead. Requests of all symbols
+    are bounded by max_concurrency and the exchange rate limit, and pages
+    are appended to the csv in order as they arrive, so an interrupted run
+    resumes where it stopped. Timeframes must be regular (not 1M).
+    '''
+
+    def __init__(self, exchange, output_dir='dataset', max_concurrency=8, max_retries=5, retry_delay=1.0):
+        self.exchange = exchange
+        self.output_dir = Path(output_dir)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+    async def _request(self, symbol, timeframe, since, limit):
+        for attempt in range(self.max_retries + 1):
+            async with self._semaphore:
+                await self._rate_limiter.wait()
+                try:
+                    return await self.exchange.fetch_ohlcv(symbol, timeframe, since, limit)
+                except RateLimitError as e:
+                    if attempt == self.max_retries:
+                        raise
+                    delay = self.retry_delay * 2 ** attempt
+                    logging.warning('%s %s since %s: %s, retrying in %.1fs', symbol, timeframe, since, e, delay)
+            await asyncio.sleep(delay)
+
+    async def _fetch_window(self, symbol, timeframe, start, end):
+        limit = self.exchange.page_limit
+        rows = await self._request(symbol, timeframe, start, limit)
+        return [row for row in rows if start <= row[0] < end]
+
+    def _write_rows(self, path, rows, step):
+        time_format = '%Y-%m-%d' if step % DAY_MS == 0 else '%Y-%m-%d %H:%M:%S'
+        is_new = not path.exists() or path.stat().st_size == 0
+        with open(path, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if is_new:
+                writer.writerow(OHLCV_HEADER)
+            for ts, *values in rows:
+                dt = datetime.datetime.fromtimestamp(ts / 1000, datetime.timezone.utc)
+                writer.writerow([dt.strftime(time_format)] + values)
+
+    async def _fetch_range(self, symbol, timeframe, path, since, until):
+        '''Append the candles from since up to until to path, returns the number of rows.'''
+        step = self.exchange.timeframe_ms(timeframe)
+        window = step * self.exchange.page_limit
+
+        # A sliding window of pages is in flight, the next one is only scheduled once the oldest is
+        # written, so a long history never queues thousands of requests at a rate-limited exchange.
+        starts = iter(range(since, until, window))
+        pending = collections.deque()
+        appended = 0
+        try:
+            while True:
+                while len(pending) < self.max_concurrency:
+                    start = next(starts, None)
+                    if start is None:
+                        break
+                    pending.append(asyncio.ensure_future(
+                        self._fetch_window(symbol, timeframe, start, min(start + window, until))))
+                if not pending:
+                    break
+                rows = await pending.popleft()
+                if rows:
+                    self._write_rows(path, rows, step)
+                    appended += len(rows)
+        finally:
+            for task in pending:
+                task.cancel()
+        return appended
+
+    async def _fetch_head(self, symbol, timeframe, path, since, first):
+        '''Prepend the candles from since up to the first stored row, returns the number of rows.'''
+        head = path.with_name(path.name + '.head')
+        # Left over by an interrupted run, its rows are fetched again.
+        head.unlink(missing_ok=True)
+        added = await self._fetch_range(symbol, timeframe, head, since, first)
+        if added:
+            with open(path, 'rb') as src, open(head, 'ab') as dst:
+                src.readline()
+                shutil.copyfileobj(src, dst)
+            os.replace(head, path)
+        return added
+
+    async def fetch_symbol(self, symbol, timeframe, start_datetime):
+        '''Bring one csv up to date, returns the number of rows added.'''
+        path = output_path(self.output_dir, symbol, timeframe)
+        step = self.exchange.timeframe_ms(timeframe)
+        start = to_ms(start_datetime)
+        # Only closed candles are stored, the running one would never be updated.
+        until = (self.exchange.now_ms() // step) * step
+        added = 0
+        first = first_timestamp_ms(path)
+        if first is not None and start < first:
+            added += await self._fetch_head(symbol, timeframe, path, start, first)
+        last = last_timestamp_ms(path)
+        since = last + step if last is not None else start
+        added += await self._fetch_range(symbol, timeframe, path, since, until)
+        logging.info('%s %s: %d rows added to %s', symbol, timeframe, added, path)
+        return added
+
+    async def fetch_all(self, symbols, timeframes, start_datetime):
+        '''Fetch every symbol x timeframe concurrently, returns {(symbol, timeframe): rows appended}.'''
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._rate_limiter = RateLimiter(self.exchange.rate_limit)
+        pairs = [(symbol, timeframe) for symbol in symbols for timeframe in timeframes]
+        counts = await asyncio.gather(*[self.fetch_symbol(symbol, timeframe, start_datetime)
+                                        for symbol, timeframe in pairs])
+        return dict(zip(pairs, counts))
+
+
+def fetch(exchange, symbols, timeframes, start_datetime, output_dir='dataset', max_concurrency=8):
+    '''Synchronous entry point, closes the exchange when done.'''
+    async def run():
+        try:
+            return await OhlcvFetcher(exchange, output_dir, max_concurrency).fetch_all(
+                symbols, timeframes, start_datetime)
+        finally:
+            await exchange.close()
+    return asyncio.run(run())
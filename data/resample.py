@@ -0,0 +1,244 @@
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .dataset_cache import (CANONICAL_COLUMNS, DEFAULT_CACHE_DIR, SCHEMA_VERSION, CachedDataset, DatasetCache)
+
+RESAMPLE_VERSION = 1
+
+
+def timeframe_ns(rule) -> int:
+    '''Length of a fixed timeframe such as '4h', '15min' or '1d' in nanoseconds.'''
+    step = pd.Timedelta(rule).value
+    if step <= 0:
+        raise ValueError(f'timeframe {rule!r} must be positive')
+    return step
+
+
+def aggregate_ohlcv(time_ns, columns, step_ns):
+    '''
+    OHLCV bars of step_ns from time-sorted base bars.
+
+    Buckets are aligned to the epoch, so the same base bar always lands in
+    the same bucket however much history precedes it. Each bar is labelled
+    with the time of the last base bar it contains, the moment it is
+    complete, so a feed of derived bars never runs ahead of the base feed.
+    Returns the bar times, the bar columns and the base row where every bar
+    starts.
+    '''
+    if len(time_ns) == 0:
+        return time_ns[:0], {col: columns[col][:0] for col in CANONICAL_COLUMNS}, np.zeros(0, dtype=np.int64)
+    bucket = time_ns // step_ns
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(bucket)) + 1])
+    ends = np.append(starts[1:], len(time_ns))
+    bars = {
+        'open': columns['open'][starts],
+        'high': np.maximum.reduceat(columns['high'], starts),
+        'low': np.minimum.reduceat(columns['low'], starts),
+        'close': columns['close'][ends - 1],
+        'volume': np.add.reduceat(columns['volume'], starts),
+    }
+    return time_ns[ends - 1], bars, starts
+
+
+def drop_partial_head(df: pd.DataFrame, step_ns, start_ns) -> pd.DataFrame:
+    '''
+    Derived bars of df whose bucket starts at or after start_ns, the first base bar of the window.
+
+    A window starting mid-bucket would otherwise open with a bar that
+    aggregates only part of its bucket, or base bars before the window.
+    '''
+    time_ns = df.index.values.astype('datetime64[ns]').astype(np.int64)
+    return df[time_ns // step_ns * step_ns >= start_ns]
+
+
+def base_step_ns(time_ns) -> int:
+    '''Most common spacing of time-sorted base bars, 0 when they have fewer than 2 distinct times.'''
+    deltas = np.diff(time_ns)
+    deltas, counts = np.unique(deltas[deltas > 0], return_counts=True)
+    return int(deltas[np.argmax(counts)]) if len(deltas) else 0
+
+
+def drop_partial_tail(df: pd.DataFrame, step_ns, end_ns) -> pd.DataFrame:
+    '''
+    Derived bars of df whose bucket ends at or before end_ns, the end of the last base bar of the window.
+
+    A window ending mid-bucket would otherwise close with a bar that
+    aggregates only part of its bucket, labelled as if it were complete.
+    '''
+    time_ns = df.index.values.astype('datetime64[ns]').astype(np.int64)
+    return df[time_ns // step_ns * step_ns + step_ns <= end_ns]
+
+
+def drop_partial_bars(df: pd.DataFrame, step_ns, base_time_ns) -> pd.DataFrame:
+    '''Derived bars of df covering only whole buckets of the window of base bars at base_time_ns.'''
+    if not len(base_time_ns):
+        return df
+    df = drop_partial_head(df, step_ns, int(base_time_ns[0]))
+    return drop_partial_tail(df, step_ns, int(base_time_ns[-1]) + base_step_ns(base_time_ns))
+
+
+def resample_frame(df: pd.DataFrame, rule) -> pd.DataFrame:
+    '''In-memory aggregate_ohlcv of a canonical time-indexed frame, for uncached datasets.'''
+    step_ns = timeframe_ns(rule)
+    time_ns = df.index.values.astype('datetime64[ns]').astype(np.int64)
+    columns = {col: df[col].to_numpy(dtype=np.float64) for col in CANONICAL_COLUMNS}
+    bar_time, bars, _ = aggregate_ohlcv(time_ns, columns, step_ns)
+    frame = pd.DataFrame(bars, index=pd.DatetimeIndex(bar_time.astype('datetime64[ns]'), name='time'))
+    return drop_partial_bars(frame, step_ns, time_ns)
+
+
+class ResampleCache:
+    '''
+    Derived timeframes of cached datasets, stored inside the base dataset's cache.
+
+    Bars are written in the CachedDataset layout under
+    <base cache>/resample-<seconds>s, so they are computed once per dataset
+    version and memory mapped afterwards. When a source csv grew, e.g. after
+    fetch_crypto appended candles, the bars of its previous version are
+    reused and only the base rows from its last, possibly partial, bar on
+    are aggregated.
+    '''
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.dataset_cache = DatasetCache(cache_dir)
+        self.cache_dir = Path(cache_dir)
+
+    @staticmethod
+    def resample_path(base_path, step_ns):
+        return Path(base_path) / f'resample-{step_ns // 10 ** 9}s'
+
+    def ingest(self, source_path, rule, force=False):
+        base_path = self.dataset_cache.ingest(source_path)
+        step_ns = timeframe_ns(rule)
+        if step_ns % 10 ** 9:
+            raise ValueError(f'timeframe {rule!r} must be a whole number of seconds')
+        resample_path = self.resample_path(base_path, step_ns)
+        if resample_path.exists() and not force:
+            return resample_path
+
+        base = CachedDataset(base_path)
+        base_time = np.asarray(base.time)
+        previous = None if force else self._previous_version(source_path, base_path, base, step_ns)
+        if previous is None:
+            resume, time_ns, bars = 0, base_time[:0], None
+        else:
+            # The last stored bar may have been partial, rebuild it from its first base row.
+            resume = previous.meta['last_start']
+            time_ns = np.asarray(previous.time[:-1])
+            bars = {col: np.asarray(previous.columns[col][:-1]) for col in CANONICAL_COLUMNS}
+
+        tail_time, tail_bars, tail_starts = aggregate_ohlcv(
+            base_time[resume:], {col: np.asarray(base.columns[col][resume:]) for col in CANONICAL_COLUMNS}, step_ns)
+        time_ns = np.concatenate([time_ns, tail_time])
+        if bars is None:
+            bars = tail_bars
+        else:
+            bars = {col: np.concatenate([bars[col], tail_bars[col]]) for col in CANONICAL_COLUMNS}
+        last_start = resume + int(tail_starts[-1]) if len(tail_starts) else None
+
+        self._write(resample_path, time_ns, bars, {
+            'source': str(source_path), 'base': base_path.name, 'base_rows': len(base_time),
+            'step_ns': step_ns, 'rows': len(time_ns), 'resumed_at': int(resume), 'last_start': last_start,
+            'schema_version': SCHEMA_VERSION, 'resample_version': RESAMPLE_VERSION,
+        }, force=force)
+        return resample_path
+
+    def _previous_version(self, source_path, base_path, base, step_ns):
+        '''Resampled bars of an older version of source_path whose base is a prefix of base.'''
+        best = None
+        for other_base in self.cache_dir.glob(f'{Path(source_path).stem}-*-v{SCHEMA_VERSION}'):
+            candidate_path = self.resample_path(other_base, step_ns)
+            if other_base == base_path or not (candidate_path / 'meta.json').exists():
+                continue
+            candidate = CachedDataset(candidate_path)
+            meta = candidate.meta
+            n = meta['base_rows']
+            if (meta.get('resample_version') != RESAMPLE_VERSION or n > len(base) or meta['last_start'] is None
+                    or (best is not None and n <= best.meta['base_rows'])):
+                continue
+            other = CachedDataset(other_base)
+            if len(other) == n and all(np.array_equal(other.columns[col], base.columns[col][:n])
+                                       for col in CANONICAL_COLUMNS) and np.array_equal(other.time, base.time[:n]):
+                best = candidate
+        return best
+
+    @staticmethod
+    def _write(resample_path, time_ns, bars, meta, force=False):
+        tmp_path = resample_path.with_name(f'{resample_path.name}.tmp-{os.getpid()}')
+        tmp_path.mkdir(parents=True, exist_ok=True)
+        np.save(tmp_path / 'time.npy', time_ns.astype(np.int64))
+        for col in CANONICAL_COLUMNS:
+            np.save(tmp_path / f'{col}.npy', bars[col].astype(np.float64))
+        with open(tmp_path / 'meta.json', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=1)
+
+        if force and resample_path.exists():
+            shutil.rmtree(resample_path)
+        try:
+            os.rename(tmp_path, resample_path)
+        except OSError:
+            # Another process finished the same resample first.
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def open(self, source_path, rule):
+        return CachedDataset(self.ingest(source_path, rule))
+
+
+def load_resampled_dataset(source_path, rule, start_date=None, end_date=None, cache_dir=DEFAULT_CACHE_DIR):
+    '''
+    Derived bars labelled within the dates, over whole buckets of the base bars within them.
+
+    Equal to resample_frame of the base bars within the dates, the bars are
+    only read from the cache.
+    '''
+    cache = ResampleCache(cache_dir)
+    df = cache.open(source_path, rule).to_dataframe(start_date, end_date)
+    base = cache.dataset_cache.open(source_path)
+    first, stop = base.locate(start_date, end_date)
+    return drop_partial_bars(df, timeframe_ns(rule), np.asarray(base.time[first:stop]))
+
+
+def check_resample(source_path, rule, start_date=None, end_date=None, cache_dir=DEFAULT_CACHE_DIR):
+    '''Compare the cached and the in-memory bars of a window, None when they are identical, else the mismatch.'''
+    cache = ResampleCache(cache_dir)
+    base = cache.dataset_cache.open(source_path).to_dataframe(start_date, end_date)
+    expected = resample_frame(base, rule)
+    actual = load_resampled_dataset(source_path, rule, start_date, end_date, cache_dir=cache_dir)
+    if not expected.index.equals(actual.index):
+        return f'{len(expected)} in-memory bars {list(expected.index[-1:])}, {len(actual)} cached {list(actual.index[-1:])}'
+    for col in CANONICAL_COLUMNS:
+        if not np.array_equal(expected[col].to_numpy(), actual[col].to_numpy()):
+            return f'{col} differs'
+    return None
+
+
+if __name__ == '__main__':
+    import argparse
+
+    argparser = argparse.ArgumentParser(description='Build the cached higher timeframe bars of CSV datasets')
+    argparser.add_argument('datasets', nargs='+')
+    argparser.add_argument('--timeframes', nargs='+', required=True, help="e.g. 4h 1d")
+    argparser.add_argument('--cache-dir', default=str(DEFAULT_CACHE_DIR))
+    argparser.add_argument('--force', action='store_true')
+    argparser.add_argument('--check', action='store_true',
+                           help='compare the cached bars with an in-memory resample of the window')
+    argparser.add_argument('--start-date')
+    argparser.add_argument('--end-date')
+    args = argparser.parse_args()
+
+    cache = ResampleCache(args.cache_dir)
+    failed = False
+    for dataset in args.datasets:
+        for rule in args.timeframes:
+            print(cache.ingest(dataset, rule, force=args.force))
+            if args.check:
+                mismatch = check_resample(dataset, rule, args.start_date, args.end_date, cache_dir=args.cache_dir)
+                failed = failed or mismatch is not None
+                print(f'{dataset} {rule}: {mismatch or "cached and in-memory bars agree"}')
+    if failed:
+        raise SystemExit(1)
@@ -1,23 +1,33 @@
-import ccxt
-from itertools import product
-import datetime
-import pandas as pd
-from pathlib import Path
-import tqdm
-exchange = ccxt.binance()
-exchange.load_markets()
+import argparse
+import logging
+
+from data.fetcher import CcxtExchange, fetch
 
 symbols = ['BTC/USDT', 'ETH/USDT', 'XRP/USDT', 'BNB/USDT']
 timeframes = ['1d', '1h']
-start_datetime = datetime.datetime(2019, 1, 1)
-
-output_dir = Path('dataset')
-output_dir.mkdir(exist_ok=True)
-for symbol, timeframe in tqdm.tqdm(product(symbols, timeframes)):
-
-    data = exchange.fetch_ohlcv(
-        symbol, timeframe, since=exchange.parse8601(start_datetime))
-    df = pd.DataFrame(data, columns=['time', 'open', 'high', 'low', 'close', 'tick_volume'])
-    df['time'] = pd.to_datetime(df['time'], unit='ms')
-    
-    df.to_csv(output_dir / f'{symbol.replace("/", "")}_{timeframe}.csv', index=False)
\ No newline at end of file
+start_datetime = '2019-01-01'
+
+argparser = argparse.ArgumentParser(
+    description='Download or update OHLCV csv files, resuming after the last stored candle')
+argparser.add_argument('--symbols', nargs='+', default=symbols)
+argparser.add_argument('--timeframes', nargs='+', default=timeframes)
+argparser.add_argument('--start', default=start_datetime,
+                       help='first candle to fetch, earlier rows missing from existing files are filled in')
+argparser.add_argument('--exchange', default='binance')
+argparser.add_argument('--output-dir', default='dataset')
+argparser.add_argument('--concurrency', type=int, default=8)
+
+
+def main():
+    args = argparser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    exchange = CcxtExchange(args.exchange)
+    counts = fetch(exchange, args.symbols, args.timeframes, args.start,
+                   output_dir=args.output_dir, max_concurrency=args.concurrency)
+    for (symbol, timeframe), appended in counts.items():
+        print(f'{symbol} {timeframe}: {appended} rows added')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+import array
+
+import backtrader as bt
+import numpy as np
+
+
+class GridLevelsIndicator(bt.Indicator):
+    '''
+    One indicator with a line per grid level, reading its values from a GridLevels.
+
+    Concrete classes with the right number of lines are built by
+    GridLevelsIndicator.for_levels, use GridLevels.make_indicator instead of
+    instantiating this class directly.
+    '''
+
+    params = (('grid_levels', None), )
+
+    _classes = {}
+
+    @classmethod
+    def for_levels(cls, n_levels):
+        if n_levels not in cls._classes:
+            lines = tuple(f'level_{level}' for level in range(n_levels))
+            cls._classes[n_levels] = type(cls)(f'{cls.__name__}_{n_levels}', (cls, ), {'lines': lines})
+        return cls._classes[n_levels]
+
+    def __init__(self):
+        self.precomputed = False
+        self.plotinfo.subplot = False
+        self.plotinfo.plotlinevalues = False
+
+    def next(self):
+        for line, y in zip(self.lines, self.p.grid_levels.levels):
+            line[0] = y
+
+    def once(self, start, end):
+        self.fill(start, end)
+        self.precomputed = True
+
+    def fill(self, start, end):
+        for line, y in zip(self.lines, self.p.grid_levels.levels):
+            line.array[start:end] = array.array('d', [y]) * (end - start)
+
+    def relevel(self):
+        '''
+        In runonce mode the lines were filled up front, rewrite them from the
+        next bar on so the plot matches a next() run where the owner re-levels
+        after this indicator already produced the current bar.
+        '''
+        if self.precomputed:
+            self.fill(len(self), self.buflen())
+
+
+class GridLevels:
+    '''
+    Array-backed ladder of grid prices.
+
+    Levels are updated in place. Nothing runs per bar unless a lines view is
+    requested with make_indicator, either for plotting (plot=True) or for
+    indicators that need one backtrader line per level, such as CrossOver.
+    make_indicator has to be called from the owning strategy __init__.
+    '''
+
+    def __init__(self, levels, plot=False, plotname='grid'):
+        self.levels = np.array(levels, dtype=np.float64)
+        self.plotname = plotname
+        self.indicator = None
+        if plot:
+            self.make_indicator(plot=True)
+
+    def __len__(self):
+        return len(self.levels)
+
+    def __getitem__(self, level):
+        return self.levels[level]
+
+    def make_indicator(self, plot=False):
+        if self.indicator is None:
+            indicator_class = GridLevelsIndicator.for_levels(len(self.levels))
+            self.indicator = indicator_class(grid_levels=self, plot=plot, plotname=self.plotname)
+        return self.indicator
+
+    def update(self, levels):
+        self.levels[:] = levels
+        if self.indicator is not None:
+            self.indicator.relevel()
+
+    def update_level(self, level, y):
+        self.levels[level] = y
+        if self.indicator is not None:
+            self.indicator.relevel()
+
+
+class GridCrossOver(bt.Indicator):
+    '''
+    Single crossing detector of data over every level of a GridLevels.
+
+    Same rule as one bt.indicators.CrossOver per level: a level is crossed up
+    when the last non zero difference was negative and the current one is
+    positive, and the other way round for a cross down. Only the levels
+    between the previous and the current value are looked at, found by
+    bisection, so the levels must be in ascending order and are not expected
+    to be re-levelled while running.
+
+    crossover = 1 when any level is crossed up, else -1 when any is crossed
+    down, else 0. level = lowest crossed level in that direction, NaN if none.
+    '''
+
+    lines = ('crossover', 'level')
+
+    params = (('grid_levels', None), )
+
+    plotinfo = dict(plotymargin=0.05, plotyhlines=[0.0, 1.0])
+
+    def nextstart(self):
+        self.__seed(self.data[0])
+        self.lines.crossover[0] = 0.0
+        self.lines.level[0] = np.nan
+
+    def next(self):
+        self.lines.crossover[0], self.lines.level[0] = self.__cross(self.data[0])
+
+    def oncestart(self, start, end):
+        self.__seed(self.data.array[start])
+        self.lines.crossover.array[start] = 0.0
+        self.lines.level.array[start] = np.nan
+
+    def once(self, start, end):
+        values = self.data.array
+        crossover = self.lines.crossover.array
+        level = self.lines.level.array
+        for i in range(start, end):
+            crossover[i], level[i] = self.__cross(values[i])
+
+    def __seed(self, value):
+        self.prev = value
+        # Sign of the last non zero difference per level
+        self.signs = np.sign(value - self.p.grid_levels.levels)
+
+    def __cross(self, value):
+        levels = self.p.grid_levels.levels
+        low, high = min(self.prev, value), max(self.prev, value)
+        start = np.searchsorted(levels, low, side='left')
+        stop = np.searchsorted(levels, high, side='right')
+        self.prev = value
+
+        signs = self.signs[start:stop]
+        current = np.sign(value - levels[start:stop])
+        crossed_up = np.flatnonzero((signs < 0) & (current > 0))
+        crossed_down = np.flatnonzero((signs > 0) & (current < 0))
+        self.signs[start:stop] = np.where(current != 0, current, signs)
+
+        if len(crossed_up):
+            return 1.0, float(start + crossed_up[0])
+        if len(crossed_down):
+            return -1.0, float(start + crossed_down[0])
+        return 0.0, np.nan
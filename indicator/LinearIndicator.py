@@ -1,7 +1,11 @@
+import array
 import backtrader as bt
 import datetime
-import time
 import math
+import numpy as np
+
+# backtrader date number of 1970-01-01
+EPOCH_DATE_NUM = 719163.0
 
 
 class LinearIndicator(bt.Indicator):
@@ -17,6 +21,11 @@ class LinearIndicator(bt.Indicator):
     x2 = Date/Time, String in the following format "YYYY-MM-DD HH:MM:SS" of
     the end of the trend
     y2 = Float, the price (Y value) of the end of the trend.
+
+    Supports both next() and runonce evaluation, in runonce mode the whole
+    line is computed from the datetime array and update_range / update_line
+    calls made while running rewrite it from the next bar on. Indicators built
+    on top of this line are computed up front too and do not see such updates.
     '''
 
     lines = ('linear',)
@@ -29,9 +38,8 @@ class LinearIndicator(bt.Indicator):
                  start_datetime=datetime.datetime.min,
                  end_datetime=datetime.datetime.max):
 
-        self.start_datetime = self.__convert_x_to_datetime(start_datetime)
-        self.end_datetime = self.__convert_x_to_datetime(end_datetime)
-
+        self.precomputed = False
+        self.__define_range(start_datetime, end_datetime)
         self.__define_linear_function(x1, y1, x2, y2)
 
         self.plotinfo.subplot = False
@@ -49,13 +57,27 @@ class LinearIndicator(bt.Indicator):
                 dt = datetime.datetime.strptime(x, '%Y-%m-%d')
             return dt
 
+    def __convert_datetime_to_num(self, dt):
+        if dt == datetime.datetime.min:
+            return -math.inf
+        elif dt == datetime.datetime.max:
+            return math.inf
+        else:
+            return bt.date2num(dt)
+
     def __convert_datetime_to_timestamp(self, dt):
         if dt == datetime.datetime.min:
             return 0.0
         elif dt == datetime.datetime.max:
             return math.inf
         else:
-            return time.mktime(dt.timetuple())
+            return self.num_to_timestamp(bt.date2num(dt))
+
+    def __define_range(self, start_datetime, end_datetime):
+        self.start_datetime = self.__convert_x_to_datetime(start_datetime)
+        self.end_datetime = self.__convert_x_to_datetime(end_datetime)
+        self.start_num = self.__convert_datetime_to_num(self.start_datetime)
+        self.end_num = self.__convert_datetime_to_num(self.end_datetime)
 
     def __define_linear_function(self, x1, y1, x2, y2):
         self.x1 = self.__convert_x_to_datetime(x1)
@@ -69,15 +91,33 @@ class LinearIndicator(bt.Indicator):
             x1_timestamp, x2_timestamp, self.y1, self.y2)
         self.B = self.get_y_intercept(self.m, x1_timestamp, self.y1)
 
-    def next(self):
-        dt = self.data.datetime.datetime()
-        date_timestamp = self.__convert_datetime_to_timestamp(dt)
+    def num_to_timestamp(self, x):
+        '''x = backtrader date number(s), float or array'''
+        return (x - EPOCH_DATE_NUM) * 86400.0
 
-        if dt >= self.start_datetime and dt < self.end_datetime:
-            self.lines.linear[0] = self.get_y(date_timestamp)
+    def next(self):
+        x = self.data.datetime[0]
+        if self.start_num <= x < self.end_num:
+            self.lines.linear[0] = self.get_y(self.num_to_timestamp(x))
         else:
             self.lines.linear[0] = math.nan
 
+    def once(self, start, end):
+        self.__fill(start, end)
+        self.precomputed = True
+
+    def __fill(self, start, end):
+        x = np.frombuffer(self.data.datetime.array, dtype=np.float64)[start:end]
+        y = np.where((x >= self.start_num) & (x < self.end_num),
+                     self.get_y(self.num_to_timestamp(x)), math.nan)
+        self.lines.linear.array[start:end] = array.array('d', y.tobytes())
+
+    def __refill(self):
+        # The current bar was produced before the owner could update the line,
+        # as in next() mode the update applies from the next bar on.
+        if self.precomputed:
+            self.__fill(len(self), self.buflen())
+
     def get_slope(self, x1, x2, y1, y2):
         if math.isclose(x1, 0.0) and math.isclose(x2, math.inf):
             return 0.0
@@ -93,13 +133,16 @@ class LinearIndicator(bt.Indicator):
         return Y
 
     def update_range(self, start_datetime=None, end_datetime=None):
-        if start_datetime is not None:
-            self.start_datetime = self.__convert_x_to_datetime(start_datetime)
-        if end_datetime is not None:
-            self.end_datetime = self.__convert_x_to_datetime(end_datetime)
+        if start_datetime is None:
+            start_datetime = self.start_datetime
+        if end_datetime is None:
+            end_datetime = self.end_datetime
+        self.__define_range(start_datetime, end_datetime)
+        self.__refill()
 
     def update_line(self, x1, y1, x2, y2):
         self.__define_linear_function(x1, y1, x2, y2)
+        self.__refill()
 
 class HorizontalLinearIndicator(LinearIndicator):
     params = (('y', None), )
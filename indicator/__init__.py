@@ -1,2 +1,15 @@
+import importlib
+
 from .LinearIndicator import *
-from .machine_learning import *
\ No newline at end of file
+from .GridLevelsIndicator import GridLevels, GridLevelsIndicator, GridCrossOver
+
+# Machine learning indicators pull in the model stack, import them on first use.
+LAZY_INDICATORS = {
+    'RegressionIndicator': '.machine_learning',
+}
+
+
+def __getattr__(name):
+    if name in LAZY_INDICATORS:
+        return getattr(importlib.import_module(LAZY_INDICATORS[name], __name__), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
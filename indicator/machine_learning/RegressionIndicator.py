@@ -4,36 +4,106 @@ import time
 import numpy as np
 import math
 import pandas as pd
-from machine_learning import RegressionModel
+from machine_learning import DEFAULT_CHUNK_SIZE, PredictionCache, RegressionModel
 
 class RegressionIndicator(bt.Indicator):
+    '''
+    streaming = predict bar by bar from a ring buffer of the last window_size
+    bars instead of predicting the whole pandas feed up front. Needed for live
+    or appended feeds, set timeframe explicitly there since otherwise it is
+    inferred from the buffered bars only.
+    predictions = precomputed pd.Series of predictions indexed by bar time,
+    used instead of loading model_path, e.g. by the walk-forward harness.
+    model_key = key of a model in machine_learning.registry, instead of model_path.
+    prediction_cache = True for the default PredictionCache, or a PredictionCache.
+    Batch predictions of an unchanged model, feed and window are then loaded
+    from disk instead of recomputed.
+    chunk_size = rows of features built and predicted at once, bounds the
+    memory of batch predictions. None for the RegressionModel default.
+    A CachedDatasetFeed is predicted frame by frame as the bars reach each
+    frame, so the dataset range is never held in memory at once.
+    '''
 
     lines = ('regression',)
 
-    def __init__(self, model_path, window_size=48):
+    def __init__(self, model_path, window_size=48, timeframe=None, streaming=False, predictions=None,
+                 model_key=None, prediction_cache=None, chunk_size=None):
 
         self.window_size = window_size
-        self.regression_model = RegressionModel(model_path, window_size=window_size)
-        self.predict()
-        
+        self.prediction_cache = PredictionCache() if prediction_cache is True else prediction_cache or None
+        self.streaming = streaming and predictions is None
+        self.prediction_frames = None
+        if predictions is not None:
+            self.predictions = predictions
+        else:
+            self.regression_model = RegressionModel(model_path, window_size=window_size, timeframe=timeframe,
+                                                    model_key=model_key,
+                                                    chunk_size=chunk_size or DEFAULT_CHUNK_SIZE)
+            if streaming:
+                self.__init_buffer()
+            else:
+                self.predict()
+
         self.plotinfo.subplot = False
-    def __fetch_ohlc(self):
-        datetime_data = self.data.datetime.get(size=self.window_size)
-        datetime_data = list(map(bt.num2date, datetime_data))
-        datetime_data = pd.to_datetime(datetime_data)
-        return pd.DataFrame({
-            'time': datetime_data,
-            'open': self.data.open.get(size=self.window_size),
-            'high': self.data.high.get(size=self.window_size),
-            'low': self.data.low.get(size=self.window_size),
-            'close': self.data.close.get(size=self.window_size)
-        }).sort_values('time')
-    
+
+    def __init_buffer(self):
+        self.buffer_time = np.zeros(self.window_size, dtype=np.int64)
+        self.buffer_ohlc = np.zeros((self.window_size, 4))
+        self.buffer_count = 0
+        self.origin_ns = None
+
+    def __push_bar(self):
+        time_ns = np.datetime64(bt.num2date(self.data.datetime[0]), 'ns').astype(np.int64)
+        if self.origin_ns is None:
+            self.origin_ns = time_ns
+        position = self.buffer_count % self.window_size
+        self.buffer_time[position] = time_ns
+        self.buffer_ohlc[position] = (self.data.open[0], self.data.high[0],
+                                      self.data.low[0], self.data.close[0])
+        self.buffer_count += 1
+
+    def __buffered_bars(self):
+        '''Buffered times and ohlc rows, oldest first.'''
+        if self.buffer_count <= self.window_size:
+            return self.buffer_time[:self.buffer_count], self.buffer_ohlc[:self.buffer_count]
+        order = np.roll(np.arange(self.window_size), -(self.buffer_count % self.window_size))
+        return self.buffer_time[order], self.buffer_ohlc[order]
+
     def predict(self):
-        self.predictions = self.regression_model.predict(self.data._dataname.reset_index())
+        # A CachedDatasetFeed hands out its dataset range in frames, PandasData wraps the frame itself.
+        if hasattr(self.data, 'frames'):
+            self.prediction_frames = self.regression_model.predict_frames(
+                (frame.reset_index() for frame in self.data.frames()), cache=self.prediction_cache)
+            self.predictions = pd.Series(dtype=np.float64)
+            return
+
+        df = self.data._dataname.reset_index()
+        if self.prediction_cache is None:
+            self.predictions = self.regression_model.predict(df)
+            return
+
+        key = self.regression_model.prediction_key(df)
+        self.predictions = self.prediction_cache.get(key)
+        if self.predictions is None:
+            self.predictions = self.regression_model.predict(df)
+            if self.predictions is not None:
+                self.prediction_cache.put(key, self.predictions)
 
     def next(self):
+        if self.streaming:
+            self.__push_bar()
+            time_ns, ohlc = self.__buffered_bars()
+            self.lines.regression[0] = self.regression_model.predict_latest(time_ns, ohlc, self.origin_ns)
+            return
+
         datetime = bt.num2date(self.data.datetime[0])
+        if self.prediction_frames is not None:
+            while not len(self.predictions) or self.predictions.index[-1] < datetime:
+                self.predictions = next(self.prediction_frames, None)
+                if self.predictions is None:
+                    # Past the dataset range, e.g. appended bars.
+                    self.prediction_frames, self.predictions = None, pd.Series(dtype=np.float64)
+                    break
         prediction = self.predictions.get(datetime, default=math.nan)
-        
+
         self.lines.regression[0] = prediction
@@ -0,0 +1,93 @@
+import gc
+import hashlib
+import mmap
+import os
+import pickle
+import threading
+
+
+class ModelRegistry:
+    '''
+    Loads every pickled model once per process, keyed by its content hash.
+
+    A path is hashed and unpickled on first use, later lookups only stat the
+    file and re-hash it when it changed. Different paths with the same content
+    share one model. Files are read through mmap, so hashing and unpickling do
+    not keep a second copy of the serialized bytes around.
+
+    Call preload in the parent before starting a fork based process pool,
+    workers then inherit the loaded models copy-on-write instead of each
+    unpickling their own.
+    '''
+
+    def __init__(self):
+        self._models = {}
+        # realpath -> (st_mtime_ns, st_size, key)
+        self._paths = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self._models
+
+    def __len__(self):
+        return len(self._models)
+
+    def keys(self):
+        return list(self._models)
+
+    def load(self, model_path, expected_hash=None) -> str:
+        '''Load model_path unless already loaded, returns its key (sha256 hex digest).'''
+        path = os.path.realpath(model_path)
+        stat = os.stat(path)
+        with self._lock:
+            cached = self._paths.get(path)
+            if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                key = cached[2]
+            else:
+                key = self.__load_file(path)
+                self._paths[path] = (stat.st_mtime_ns, stat.st_size, key)
+        if expected_hash is not None and key != expected_hash:
+            raise ValueError(f'{model_path} hash {key} does not match expected {expected_hash}')
+        return key
+
+    def __load_file(self, path):
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            key = hashlib.sha256(data).hexdigest()
+            if key not in self._models:
+                self._models[key] = pickle.loads(data)
+        return key
+
+    def register(self, key, model):
+        '''Register an in-memory model, e.g. one trained in this process.'''
+        with self._lock:
+            self._models[key] = model
+        return key
+
+    def get(self, key):
+        try:
+            return self._models[key]
+        except KeyError:
+            raise KeyError(f'model {key} is not loaded, load or register it first') from None
+
+    def get_path(self, model_path, expected_hash=None):
+        return self.get(self.load(model_path, expected_hash=expected_hash))
+
+    def preload(self, model_paths):
+        '''
+        Load model_paths ahead of forking workers, returns their keys.
+
+        The loaded objects are moved to the permanent gc generation so that
+        collections in the workers do not touch, and thereby copy, their pages.
+        '''
+        keys = [self.load(model_path) for model_path in model_paths]
+        if keys:
+            gc.freeze()
+        return keys
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._paths.clear()
+
+
+registry = ModelRegistry()
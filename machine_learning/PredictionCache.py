@@ -0,0 +1,93 @@
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CACHE_DIR = Path('.cache') / 'prediction'
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+HASH_COLUMNS = ['open', 'high', 'low', 'close']
+
+
+def frame_hash(df: pd.DataFrame) -> str:
+    '''Content hash of the bar times and ohlc columns predictions are built from.'''
+    digest = hashlib.sha1()
+    time = df['time'] if 'time' in df.columns else df.index
+    digest.update(pd.to_datetime(time).values.astype('datetime64[ns]').astype(np.int64).tobytes())
+    for col in HASH_COLUMNS:
+        digest.update(np.ascontiguousarray(df[col].to_numpy(dtype=np.float64)).tobytes())
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    '''
+    On-disk cache of prediction series, one .npz per key in cache_dir.
+
+    Keys are built by the caller from everything the predictions depend on,
+    see RegressionModel.prediction_key. Entries are written atomically so
+    concurrent sweep workers can share the directory. Once the directory
+    grows past max_bytes the least recently used entries are deleted, every
+    hit refreshes the entry's mtime.
+    '''
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return self.cache_dir / f'{key}.npz'
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                time, prediction = data['time'], data['prediction']
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return pd.Series(prediction, index=pd.DatetimeIndex(time.astype('datetime64[ns]'), name='time'),
+                         name='prediction')
+
+    def put(self, key, predictions: pd.Series):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self.path(key)
+        # Not matched by the *.npz glob of entries, so other processes never evict a file still being
+        # written. Saved through a handle since np.savez appends .npz to file names.
+        tmp_path = path.with_name(f'{path.name}.tmp-{os.getpid()}')
+        with open(tmp_path, 'wb') as f:
+            np.savez(f,
+                     time=predictions.index.values.astype('datetime64[ns]').astype(np.int64),
+                     prediction=predictions.to_numpy(dtype=np.float64))
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def entries(self):
+        '''(mtime, size, path) of the cached entries, least recently used first.'''
+        entries = []
+        for path in self.cache_dir.glob('*.npz'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            path.unlink()
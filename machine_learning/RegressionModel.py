@@ -1,32 +1,116 @@
 import datetime
 import re
-import pickle
 import numpy as np
 import pandas as pd
 from .BaseModel import BaseModel
+from .ModelRegistry import registry
+from .PredictionCache import frame_hash
 
 ORIGINAL_SIGNAL_COLUMNS = ['open', 'high', 'low', 'close']
+# Bump whenever build_features changes, it invalidates cached predictions.
+FEATURE_PIPELINE_VERSION = 2
+DEFAULT_CHUNK_SIZE = 8192
+
 class RegressionModel(BaseModel):
-    def __init__(self,  model_path, window_size=48):
+    def __init__(self,  model_path, window_size=48, timeframe=None, model_key=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE, dtype='float32'):
+        '''
+        timeframe = bar interval used to align lookback steps, a pd.Timedelta
+        or a string such as '1h', '15min' or '1d'. Inferred from the most
+        common gap between bars when None.
+        model_path is loaded through the process-wide model registry, so
+        instances share one model per file. model_key = key of a model already
+        in the registry, used instead of model_path. Both may be None to only
+        build features, e.g. for training.
+        predict builds and predicts features in blocks of chunk_size rows
+        stored as dtype, so feature memory does not grow with the series.
+        '''
         self.window_size = window_size
-        with open(model_path, 'rb') as f:
-            self.model = pickle.load(f)
+        self.model = None
+        if model_key is None and model_path is not None:
+            model_key = registry.load(model_path)
+        if model_key is not None:
+            self.model = registry.get(model_key)
+        self.model_key = model_key
+        # Fitted LightGBM models predict single rows much faster through the
+        # booster than through the scikit-learn wrapper's pandas conversion.
+        self.booster = getattr(self.model, 'booster_', None)
         self.lookback_steps = np.arange(window_size)
+        self.timeframe = pd.Timedelta(timeframe) if timeframe is not None else None
+        self.selected_columns = self.get_signal_columns(self.lookback_steps)
+        self.chunk_size = chunk_size
+        self.dtype = np.dtype(dtype)
+
+    def prediction_key(self, df: pd.DataFrame) -> str:
+        '''Cache key of predict(df), see PredictionCache.'''
+        timeframe = self.timeframe.value if self.timeframe is not None else 'auto'
+        return (f'{self.model_key[:16]}-{frame_hash(df)[:16]}'
+                f'-w{self.window_size}-tf{timeframe}-{self.dtype.name}-v{FEATURE_PIPELINE_VERSION}')
+
+    def get_signal_columns(self, lookback_steps):
+        return [f'p{lookback_step}_{col}'
+                for lookback_step in lookback_steps
+                for col in ORIGINAL_SIGNAL_COLUMNS]
+
+    @staticmethod
+    def describe_window(time_ns):
+        if not len(time_ns):
+            return 'an empty date window'
+        first, last = pd.Timestamp(int(np.min(time_ns))), pd.Timestamp(int(np.max(time_ns)))
+        return f'the window {first} - {last} ({len(time_ns)} bars)'
+
+    def infer_timeframe(self, time_ns):
+        '''Most common spacing of the bars, ValueError when they have none, e.g. a window past the dataset end.'''
+        if self.timeframe is not None:
+            return self.timeframe.value
+        deltas = np.diff(np.sort(time_ns))
+        deltas, counts = np.unique(deltas[deltas > 0], return_counts=True)
+        if not len(deltas):
+            raise ValueError(f'cannot infer the timeframe of {self.describe_window(time_ns)}, '
+                             'it needs at least 2 distinct bar times, or set timeframe')
+        return int(deltas[np.argmax(counts)])
+
+    def lookback_grid(self, df, lookback_steps, origin_ns=None, timeframe=None):
+        '''
+        Place the bars on a regular grid of the timeframe.
+
+        A lookback step that lands on a missing bar is then NaN exactly like a
+        time-keyed join. Returns the mask of rows that have a full lookback,
+        the grid offsets of those rows and the open/high/low/close grid.
+        origin_ns = time where the grid of the series starts, the first bar of
+        df when None, so a frame of a longer series gets the lookback it has
+        in the whole series. timeframe = grid spacing in ns, inferred when None.
+        '''
+        max_step = int(np.max(lookback_steps))
+        time_ns = pd.to_datetime(df['time']).values.astype('datetime64[ns]').astype(np.int64)
+        if not len(time_ns):
+            raise ValueError(f'no bars to build features from in {self.describe_window(time_ns)}')
+        timeframe = timeframe or self.infer_timeframe(time_ns)
+        offsets = (time_ns - (time_ns.min() if origin_ns is None else origin_ns)) // timeframe
+        # Steps reaching back before the first bar of df land on the leading NaN rows.
+        base = max(int(offsets.min()) - max_step, 0)
+
+        grid = np.full((offsets.max() - base + 1, len(ORIGINAL_SIGNAL_COLUMNS)), np.nan)
+        grid[offsets - base] = df[ORIGINAL_SIGNAL_COLUMNS].to_numpy(dtype=np.float64)
+
+        rows = offsets >= max_step
+        return rows, offsets[rows] - base, grid
+
+    def lookback_block(self, grid, offsets, lookback_steps):
+        '''p{k}_{col} lag rows of the bars at grid offsets, columns ordered as get_signal_columns.'''
+        lags = offsets[:, None] - np.asarray(lookback_steps)[None, :]
+        return grid[lags].reshape(len(offsets), -1)
+
+    def generate_lookback_matrix(self, df, lookback_steps):
+        '''Mask of rows with a full lookback and the p{k}_{col} lag matrix of those rows.'''
+        rows, offsets, grid = self.lookback_grid(df, lookback_steps)
+        return rows, self.lookback_block(grid, offsets, lookback_steps)
 
     def generate_past_signal_data(self, df, lookback_steps):
-        
-        base_df = df[['time'] + ORIGINAL_SIGNAL_COLUMNS]
-        
-        first_datetime = df['time'].min() + pd.Timedelta(hours=max(lookback_steps))
-        df = df[df['time'] >= first_datetime]
-        for lookback_step in lookback_steps:
-            shifting_df = base_df.copy()
-            shifting_df['time'] = shifting_df['time'] + pd.Timedelta(hours=lookback_step)
-            lookback_columns = [f'p{lookback_step}_{col}' for col in ORIGINAL_SIGNAL_COLUMNS]
-            shifting_df.rename(columns=dict(zip(ORIGINAL_SIGNAL_COLUMNS, lookback_columns)), inplace=True)
-            
-            df = df.merge(shifting_df, how='left', on='time')
-        return df
+        rows, matrix = self.generate_lookback_matrix(df, lookback_steps)
+        df = df[rows].reset_index(drop=True)
+        signal_df = pd.DataFrame(matrix, columns=self.get_signal_columns(lookback_steps))
+        return pd.concat([df, signal_df], axis=1)
 
     def get_by_lookback_step(self, df, lookback_step):
         return df.filter(regex=f'p{lookback_step}')
@@ -38,29 +122,149 @@ class RegressionModel(BaseModel):
     def denormalize_target(self, y, df):
         return y * (df['max_close'] - df['min_close']) + df['min_close']
 
-    def preprocess(self, df: pd.DataFrame) -> pd.DataFrame:
-        df = self.generate_past_signal_data(df, self.lookback_steps)
-        df.set_index('time', inplace=True)
+    def normalize_signal(self, signal):
+        '''Min-max normalize signal rows in place by their close columns, returns min_close, max_close.'''
+        close_columns = signal[:, ORIGINAL_SIGNAL_COLUMNS.index('close')::len(ORIGINAL_SIGNAL_COLUMNS)]
+        min_close = np.nanmin(close_columns, axis=1)
+        max_close = np.nanmax(close_columns, axis=1)
+
+        signal -= min_close[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            signal /= (max_close - min_close)[:, None]
+        return min_close, max_close
 
-        signal_columns = list(filter(lambda col: re.match('p\d+_.', col), df.columns))
+    def build_features(self, df: pd.DataFrame):
+        '''
+        Returns the row mask, the min-max normalized signal matrix and the
+        min_close / max_close arrays used to denormalize predictions.
+        '''
+        rows, signal = self.generate_lookback_matrix(df, self.lookback_steps)
 
-        df['min_close'] = self.get_by_signal(df, 'close').min(axis=1)
-        df['max_close'] = self.get_by_signal(df, 'close').max(axis=1)
+        min_close, max_close = self.normalize_signal(signal)
+        return rows, signal, min_close, max_close
 
-        signal_df = self.get_only_signal(df)
-        signal_df = signal_df.subtract(df['min_close'], axis=0).div(df['max_close'] - df['min_close'], axis=0)
-        df[signal_df.columns] = signal_df
+    def build_latest_features(self, time_ns, values, origin_ns):
+        '''
+        build_features for the newest bar only, for streaming inference.
 
-        self.selected_columns = []
-        self.selected_columns += signal_columns
+        time_ns = int64 times of the most recent bars in order, newest last,
+        values = matching open/high/low/close rows, origin_ns = time of the
+        first bar of the series, where the timeframe grid starts. Returns None
+        while the newest bar has no full lookback, as the rows build_features
+        drops.
+        '''
+        if self.timeframe is None and len(time_ns) < 2:
+            return None
+        timeframe = self.infer_timeframe(time_ns)
+        offsets = (time_ns - origin_ns) // timeframe
+        max_step = int(self.lookback_steps.max())
+        if offsets[-1] < max_step:
+            return None
+
+        lookback = offsets[-1] - offsets
+        keep = lookback <= max_step
+        window = np.full((max_step + 1, len(ORIGINAL_SIGNAL_COLUMNS)), np.nan)
+        window[lookback[keep]] = values[keep]
+        signal = window[self.lookback_steps].reshape(1, -1)
+
+        min_close, max_close = self.normalize_signal(signal)
+        return signal.astype(self.dtype), min_close, max_close
+
+    def feature_blocks(self, grid, offsets, chunk_size=None):
+        '''
+        build_features of the rows at grid offsets in blocks of chunk_size rows.
+
+        Yields (row slice, signal, min_close, max_close). Lags are normalized
+        in float64 and stored as dtype in one buffer reused by every block, so
+        a block is only valid until the next one is built.
+        '''
+        chunk_size = chunk_size or self.chunk_size
+        buffer = np.empty((min(chunk_size, len(offsets)), len(self.selected_columns)), dtype=self.dtype)
+        for start in range(0, len(offsets), chunk_size):
+            stop = min(start + chunk_size, len(offsets))
+            signal = self.lookback_block(grid, offsets[start:stop], self.lookback_steps)
+            min_close, max_close = self.normalize_signal(signal)
+            block = buffer[:stop - start]
+            block[...] = signal
+            yield slice(start, stop), block, min_close, max_close
+
+    def predict_signal(self, signal) -> np.ndarray:
+        '''Raw model output for normalized signal rows.'''
+        if self.booster is not None:
+            return self.booster.predict(signal)
+        return self.model.predict(pd.DataFrame(signal, columns=self.selected_columns))
+
+    def predict_latest(self, time_ns, values, origin_ns) -> float:
+        '''Prediction for the newest bar, NaN while it has no full lookback.'''
+        features = self.build_latest_features(time_ns, values, origin_ns)
+        if features is None:
+            return np.nan
+        signal, min_close, max_close = features
+
+        prediction = self.predict_signal(signal) * (max_close - min_close) + min_close
+        return float(prediction[0])
+
+    def preprocess(self, df: pd.DataFrame) -> pd.DataFrame:
+        rows, signal, min_close, max_close = self.build_features(df)
+
+        df = df[rows].set_index('time')
+        signal_df = pd.DataFrame(signal, columns=self.selected_columns, index=df.index)
+        df = pd.concat([df, signal_df], axis=1)
+        df['min_close'] = min_close
+        df['max_close'] = max_close
         return df
-    def predict(self, df: pd.DataFrame) -> pd.Series:
+    def predict_grid(self, grid, offsets, chunk_size=None) -> np.ndarray:
+        '''Denormalized predictions of the rows at grid offsets, built in feature_blocks.'''
+        prediction = np.empty(len(offsets))
+        for block_rows, signal, min_close, max_close in self.feature_blocks(grid, offsets, chunk_size):
+            prediction[block_rows] = self.predict_signal(signal) * (max_close - min_close) + min_close
+        return prediction
+
+    def predict(self, df: pd.DataFrame, chunk_size=None) -> pd.Series:
         if len(df) < self.window_size:
-            return 
-        df = self.preprocess(df)
+            return
+        rows, offsets, grid = self.lookback_grid(df, self.lookback_steps)
+        prediction = self.predict_grid(grid, offsets, chunk_size)
+        return pd.Series(prediction, index=pd.DatetimeIndex(df['time'][rows], name='time'), name='prediction')
+
+    def predict_frames(self, frames, cache=None, chunk_size=None):
+        '''
+        predict over a series handed in consecutive frames, e.g. the chunks of a CachedDatasetFeed.
+
+        Yields a Series per frame over its bars, NaN where predict has no
+        prediction, so memory grows with a frame instead of the series. The
+        bars of the last lookback of a frame are carried into the next one.
+        The timeframe is inferred from the first frame when None. cache = a
+        PredictionCache keyed by frame.
+        '''
+        max_step = int(self.lookback_steps.max())
+        origin_ns = timeframe = None
+        carry, n_carry = None, 0
+        for frame in frames:
+            df = frame if carry is None else pd.concat([carry, frame], ignore_index=True)
+            time_ns = pd.to_datetime(df['time']).values.astype('datetime64[ns]').astype(np.int64)
+            if origin_ns is None:
+                if len(df) < self.window_size:
+                    # Like predict, no predictions from fewer bars, wait for more.
+                    carry = df
+                    continue
+                origin_ns, timeframe = int(time_ns[0]), self.infer_timeframe(time_ns)
 
-        prediction = self.model.predict(df[self.selected_columns])
-        df['prediction'] = self.denormalize_target(prediction, df)
+            index = pd.DatetimeIndex(df['time'][n_carry:], name='time')
+            key = f'{self.prediction_key(df)}-o{origin_ns}-tf{timeframe}-c{n_carry}' if cache is not None else None
+            predictions = cache.get(key) if cache is not None else None
+            if predictions is None:
+                rows, offsets, grid = self.lookback_grid(df, self.lookback_steps, origin_ns, timeframe)
+                new = np.arange(len(df))[rows] >= n_carry
+                prediction = np.full(len(index), np.nan)
+                prediction[rows[n_carry:]] = self.predict_grid(grid, offsets[new], chunk_size)
+                predictions = pd.Series(prediction, index=index, name='prediction')
+                if cache is not None:
+                    cache.put(key, predictions)
+            yield predictions
 
-        
-        return df['prediction']
\ No newline at end of file
+            keep = time_ns >= time_ns[-1] - max_step * timeframe
+            carry = df[keep].reset_index(drop=True)
+            n_carry = len(carry)
+        if origin_ns is None and carry is not None:
+            yield pd.Series(np.nan, index=pd.DatetimeIndex(carry['time'], name='time'), name='prediction')
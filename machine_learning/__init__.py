@@ -1 +1,3 @@
-from .RegressionModel import *
\ No newline at end of file
+from .RegressionModel import *
+from .ModelRegistry import ModelRegistry, registry
+from .PredictionCache import PredictionCache, frame_hash
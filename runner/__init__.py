@@ -0,0 +1,18 @@
+import importlib
+
+from .backtest import load_config, load_dataset, load_experiment_dataset, build_cerebro, run_backtest, summarize
+
+# Runners beyond a single backtest are imported on first use.
+LAZY_RUNNERS = {
+    'run_sweep': '.sweep',
+    'run_batch': '.batch',
+    'run_walk_forward': '.walk_forward',
+    'run_live': '.live',
+    'run_optimizer': '.optimizer',
+}
+
+
+def __getattr__(name):
+    if name in LAZY_RUNNERS:
+        return getattr(importlib.import_module(LAZY_RUNNERS[name], __name__), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,206 @@
+import logging
+
+import backtrader as bt
+import pandas as pd
+import yaml
+
+from data import load_cached_dataset, load_resampled_dataset, resample_frame, timeframe_ns
+from strategy import get_strategy
+from util import SUMMARY_KEYS, Analytics, HistoryTrim, Instrumentation
+
+
+def load_config(config_path):
+    with open(config_path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
+
+def resolve_strategy(strategy):
+    if isinstance(strategy, str):
+        strategy = get_strategy(strategy)
+    return strategy
+
+
+def config_model_paths(config):
+    '''model_path params of the strategies in an experiment config.'''
+    return [strategy_config['params']['model_path']
+            for strategy_config in config.get('strategies', [])
+            if (strategy_config.get('params') or {}).get('model_path')]
+
+
+def describe_params(params):
+    '''Strategy params for the log, pandas values such as walk-forward predictions as their length and date range.'''
+    described = {}
+    for key, value in params.items():
+        if isinstance(value, (pd.Series, pd.DataFrame)):
+            span = f' {value.index[0]} .. {value.index[-1]}' if len(value) else ''
+            value = f'<{type(value).__name__} of {len(value)} rows{span}>'
+        described[key] = value
+    return described
+
+
+def load_dataset(dataset_path, start_date=None, end_date=None, cache=True):
+    if cache:
+        return load_cached_dataset(dataset_path, start_date=start_date, end_date=end_date)
+
+    df = pd.read_csv(dataset_path)
+    df['time'] = pd.to_datetime(df['time'])
+    df.set_index('time', inplace=True)
+    df.sort_index(inplace=True)
+    if 'real_volume' in df.columns:
+        df.drop(columns=['real_volume'], inplace=True)
+    df.rename(columns={'tick_volume': 'volume'}, inplace=True)
+    if start_date is not None:
+        df = df.loc[start_date:]
+    if end_date is not None:
+        df = df.loc[: end_date]
+    return df
+
+
+def load_experiment_dataset(config):
+    return load_dataset(config['dataset'],
+                        start_date=config.get('start_date'),
+                        end_date=config.get('end_date'),
+                        cache=config.get('dataset_cache', True))
+
+
+def load_experiment_timeframes(config, df):
+    '''
+    Frames of the derived timeframes in config['timeframes'] over the span of df, by rule.
+    Over the config dates when df is None.
+
+    Cached datasets are resampled once per dataset version and the bars are
+    reused across runs, with dataset_cache off df is resampled in memory.
+    Either way the bars cover whole buckets only, a window starting or ending
+    mid-bucket drops its partial leading or trailing bar.
+    '''
+    frames = {}
+    for rule in config.get('timeframes') or []:
+        if df is None:
+            frames[rule] = load_resampled_dataset(config['dataset'], rule, config.get('start_date'),
+                                                  config.get('end_date'))
+        elif not len(df):
+            frames[rule] = df
+        elif config.get('dataset_cache', True):
+            frames[rule] = load_resampled_dataset(config['dataset'], rule, df.index[0], df.index[-1])
+        else:
+            frames[rule] = resample_frame(df, rule)
+    return frames
+
+
+def experiment_feed(config, df=None):
+    '''
+    CachedDatasetFeed of config['dataset'] over the span of df, or the config dates when df is None.
+
+    config['feed'] = true or a mapping of CachedDatasetFeed params, e.g.
+    chunk_size or follow. Following the csv needs an open end, so df None
+    and no end_date.
+    '''
+    from data import CachedDatasetFeed
+
+    params = config['feed'] if isinstance(config['feed'], dict) else {}
+    if df is not None and len(df):
+        start_date, end_date = df.index[0], df.index[-1]
+    else:
+        start_date, end_date = config.get('start_date'), config.get('end_date')
+    return CachedDatasetFeed(dataname=config['dataset'], start_date=start_date, end_date=end_date, **params)
+
+
+def feed_timeframe(rule):
+    '''backtrader (timeframe, compression) of a fixed timeframe rule, e.g. '4h' -> (Minutes, 240).'''
+    seconds = timeframe_ns(rule) // 10 ** 9
+    for timeframe, unit in ((bt.TimeFrame.Days, 86400), (bt.TimeFrame.Minutes, 60)):
+        if seconds % unit == 0:
+            return timeframe, seconds // unit
+    return bt.TimeFrame.Seconds, seconds
+
+
+def build_cerebro(config, df, stats=False, tracker=None, feed=None, broker=None):
+    '''
+    Build a ready-to-run Cerebro from an experiment config and a loaded dataset.
+
+    stats = bool, attach the plotting observers and the PyFolio analyzer,
+    only worth their per bar cost when the run is plotted. The summary
+    numbers come from the Analytics analyzer, which every run gets.
+    config['analytics'] = mapping of Analytics params, e.g. periods_per_year.
+    config['runonce'] = bool, evaluate indicators in backtrader's vectorized
+    runonce mode, off by default.
+    tracker = OrderHistoryTracker handed to strategies that declare a
+    'tracker' param and do not set it in the config.
+    config['instrumentation'] = true or a mapping of Instrumentation params,
+    times every strategy callback and reports at the end of the run.
+    config['timeframes'] = list of rules such as ['4h', '1d'], added after
+    df as feeds named by rule, e.g. self.getdatabyname('4h') or self.datas[1].
+    config['feed'] = stream the cached dataset with experiment_feed instead
+    of wrapping df in PandasData, df may be None then.
+    feed = backtrader feed used instead of df, e.g. a live feed, df is
+    ignored then. broker = broker replacing cerebro's BackBroker.
+    A streamed feed, config['feed'] or feed, is not preloaded and cerebro
+    keeps only the bars its lines look back on, config['exactbars'] = the
+    Cerebro exactbars, 1 by default and 0 with stats since plots need every
+    bar. runonce is off then. Strategies have no bar to order against in
+    __init__ then, next_open runs before the broker's turn on every bar for
+    the orders they place there instead, the broker fills as usual. The
+    HistoryTrim analyzer drops the dead orders and closed trades backtrader
+    would keep until the end.
+    '''
+    streamed = feed is not None or bool(config.get('feed'))
+    if streamed:
+        cerebro = bt.Cerebro(stdstats=False, preload=False, runonce=False,
+                             exactbars=config.get('exactbars', 0 if stats else 1),
+                             cheat_on_open=True, broker_coo=False)
+    else:
+        cerebro = bt.Cerebro(stdstats=False, runonce=config.get('runonce', False))
+    if broker is not None:
+        cerebro.setbroker(broker)
+    cerebro.broker.set_coc(True)
+    logging.info('init cash %s', config['broker']['init_cash'])
+    cerebro.broker.set_cash(config['broker']['init_cash'])
+
+    logging.info('default stake %s', config['sizer']['default_stake'])
+    cerebro.addsizer(bt.sizers.SizerFix, stake=config['sizer']['default_stake'])
+
+    timeframes = {}
+    if feed is None:
+        feed = experiment_feed(config, df) if config.get('feed') else bt.feeds.PandasData(dataname=df)
+        timeframes = load_experiment_timeframes(config, df)
+    cerebro.adddata(feed)
+    for rule, derived_df in timeframes.items():
+        timeframe, compression = feed_timeframe(rule)
+        cerebro.adddata(bt.feeds.PandasData(dataname=derived_df, timeframe=timeframe, compression=compression),
+                        name=str(rule))
+
+    if stats:
+        cerebro.addobserver(bt.observers.Broker)
+        cerebro.addobserver(bt.observers.BuySell, barplot=True)
+        cerebro.addobserver(bt.observers.Trades)
+        cerebro.addobserver(bt.observers.TimeReturn)
+        cerebro.addanalyzer(bt.analyzers.PyFolio)
+
+    cerebro.addanalyzer(Analytics, **(config.get('analytics') or {}))
+    if streamed:
+        cerebro.addanalyzer(HistoryTrim)
+    instrumentation = config.get('instrumentation')
+    if instrumentation:
+        cerebro.addanalyzer(Instrumentation, **(instrumentation if isinstance(instrumentation, dict) else {}))
+    for strategy_config in config['strategies']:
+        logging.info('Add strategy %s', strategy_config['name'])
+        logging.info('params %s', describe_params(strategy_config['params']))
+        strategy = resolve_strategy(strategy_config['strategy'])
+        params = dict(strategy_config['params'])
+        if tracker is not None and 'tracker' in strategy.params._getkeys() and params.get('tracker') is None:
+            params['tracker'] = tracker
+        cerebro.addstrategy(strategy=strategy, **params)
+    return cerebro
+
+
+def summarize(cerebro, strategy_results):
+    analysis = strategy_results[0].analyzers.analytics.get_analysis()
+    summary = {key: analysis[key] for key in SUMMARY_KEYS}
+    summary['ending_value'] = cerebro.broker.getvalue()
+    return summary
+
+
+def run_backtest(config, df, stats=False, tracker=None):
+    cerebro = build_cerebro(config, df, stats=stats, tracker=tracker)
+    strategy_results = cerebro.run()
+    return cerebro, strategy_results
@@ -0,0 +1,127 @@
+import argparse
+import contextlib
+import copy
+import datetime
+import logging
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+from util import SUMMARY_KEYS, OrderHistoryTracker
+
+from .backtest import config_model_paths, load_config, load_experiment_dataset, run_backtest, summarize
+
+SUMMARY_COLUMNS = ['config', 'dataset', 'status'] + SUMMARY_KEYS + ['seconds', 'log']
+
+
+def run_name(config_path, dataset_path):
+    return f'{Path(config_path).stem}__{Path(dataset_path).stem}'
+
+
+@contextlib.contextmanager
+def isolated_logging(log_path):
+    '''
+    Send the root logger and stdout of the current process to log_path only.
+
+    Workers inherit the parent's handlers when forked, every run swaps them
+    for its own file so logs of concurrent runs never interleave.
+    '''
+    root = logging.getLogger()
+    saved_handlers, saved_level = root.handlers[:], root.level
+    with open(log_path, 'w', encoding='utf-8') as log_file:
+        handler = logging.StreamHandler(log_file)
+        handler.setFormatter(logging.Formatter('%(levelname)s:%(name)s:%(message)s'))
+        root.handlers = [handler]
+        root.setLevel(logging.DEBUG)
+        try:
+            with contextlib.redirect_stdout(log_file):
+                yield
+        finally:
+            root.handlers = saved_handlers
+            root.setLevel(saved_level)
+
+
+def run_one(config_path, dataset_path, output_dir):
+    '''Backtest one config on one dataset, returns its summary row.'''
+    name = run_name(config_path, dataset_path)
+    log_path = Path(output_dir) / f'{name}.log'
+    row = {'config': str(config_path), 'dataset': str(dataset_path), 'log': str(log_path)}
+    started = time.perf_counter()
+    with isolated_logging(log_path):
+        try:
+            config = copy.deepcopy(load_config(config_path))
+            config['dataset'] = str(dataset_path)
+            logging.info('import %s', config['dataset'])
+            df = load_experiment_dataset(config)
+            tracker = OrderHistoryTracker(Path(output_dir) / f'{name}.csv')
+            cerebro, strategy_results = run_backtest(config, df, stats=False, tracker=tracker)
+            tracker.flush()
+            row.update(summarize(cerebro, strategy_results))
+            row['status'] = 'ok'
+        except Exception as e:
+            logging.error(traceback.format_exc())
+            row['status'] = f'error: {e!r}'
+    row['seconds'] = time.perf_counter() - started
+    return row
+
+
+def run_batch(config_paths, dataset_paths, output_dir, processes=None):
+    '''
+    Run every config on every dataset on a process pool.
+
+    Each run logs to its own <config>__<dataset>.log in output_dir and writes
+    its order history next to it. A failing run is reported in the status
+    column instead of stopping the batch. Sweep specs in the configs are not
+    expanded, the configured params are run as is. Returns the summary table,
+    one row per run in config x dataset order.
+    '''
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tasks = [(str(config_path), str(dataset_path)) for config_path in config_paths for dataset_path in dataset_paths]
+    processes = min(processes or os.cpu_count(), len(tasks)) or 1
+    logging.info('batch %d runs on %d processes, logs in %s', len(tasks), processes, output_dir)
+
+    # Loaded once here, forked workers share the models copy-on-write. A
+    # missing model is left to fail its own runs.
+    model_paths = {path for config_path in config_paths for path in config_model_paths(load_config(config_path))}
+    model_paths = sorted(path for path in model_paths if Path(path).exists())
+    if model_paths:
+        from machine_learning import registry
+        registry.preload(model_paths)
+
+    # Longest runs first, dataset size is a good enough proxy.
+    order = sorted(range(len(tasks)), key=lambda i: -Path(tasks[i][1]).stat().st_size)
+    rows = [None] * len(tasks)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {executor.submit(run_one, *tasks[i], output_dir): i for i in order}
+        for future in as_completed(futures):
+            i = futures[future]
+            rows[i] = future.result()
+            logging.info('%s %s: %s in %.1fs', *tasks[i], rows[i]['status'], rows[i]['seconds'])
+
+    return pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description='Backtest every experiment config on every dataset in parallel')
+    argparser.add_argument('config_paths', nargs='+')
+    argparser.add_argument('--datasets', nargs='+', required=True)
+    argparser.add_argument('--processes', type=int, default=None,
+                           help='worker processes, defaults to the cpu count')
+    argparser.add_argument('--output-dir', default=None,
+                           help='defaults to logs/batch/<time>')
+    args = argparser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    output_dir = args.output_dir or Path('logs') / 'batch' / datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    summary_df = run_batch(args.config_paths, args.datasets, output_dir, processes=args.processes)
+    summary_path = Path(output_dir) / 'summary.csv'
+    summary_df.to_csv(summary_path, index=False)
+    with pd.option_context('display.width', 200, 'display.max_colwidth', 60):
+        print(summary_df.drop(columns=['log']).to_string(index=False))
+    print(f'summary saved to {summary_path}')
@@ -0,0 +1,496 @@
+import argparse
+import asyncio
+import collections
+import copy
+import datetime
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+from data.feed import CachedDatasetFeed
+from data.fetcher import CcxtExchange, ExchangeAdapter, RateLimiter, RateLimitError, to_ms
+from util import SUMMARY_KEYS, OrderHistoryTracker
+
+from .backtest import build_cerebro, feed_timeframe, load_config, load_dataset, resolve_strategy, summarize
+
+LIVE_DEFAULTS = {
+    'exchange': 'binance',
+    # list of symbols, or a mapping of symbol -> strategy params overriding the config's
+    'symbols': [],
+    'timeframe': '1h',
+    # closed bars fed before the live ones so indicators are warmed up
+    'warmup_bars': 200,
+    # seconds after a bar close before it is requested
+    'poll_delay': 2.0,
+    'max_retries': 5,
+    'retry_delay': 1.0,
+    # stop a symbol after this many live bars, None runs until interrupted
+    'max_bars': None,
+}
+
+SUMMARY_COLUMNS = ['symbol', 'status', 'bars', 'live_bars', 'orders'] + SUMMARY_KEYS + [
+                   'close_to_order_p50_ms', 'close_to_order_p95_ms', 'fetch_to_order_p50_ms',
+                   'fetch_to_order_max_ms', 'ack_p50_ms']
+
+# Tag of every appended bar. live = False for warmup history, received_at =
+# perf_counter when the bar was fetched, close_lag_ms = wall ms between the
+# bar close and the fetch.
+LiveBar = collections.namedtuple('LiveBar', ['live', 'received_at', 'close_lag_ms'])
+
+
+def order_record(symbol, order):
+    return {
+        'symbol': symbol,
+        'ref': order.ref,
+        'parent': order.parent.ref if order.parent is not None else None,
+        'side': 'buy' if order.isbuy() else 'sell',
+        'exectype': bt.Order.ExecTypes[order.exectype],
+        'size': abs(order.created.size),
+        'price': order.created.price,
+        'pricelimit': order.created.pricelimit,
+    }
+
+
+class BrokerAdapter:
+    '''
+    Order side of a venue, awaited on the event loop for every routed order.
+
+    submit and cancel get the symbol and the backtrader order, order.ref
+    identifies it. Bracket children are only submitted once their parent
+    was filled, so a venue never holds an exit for an entry it did not fill.
+    '''
+
+    async def submit(self, symbol, order):
+        raise NotImplementedError
+
+    async def cancel(self, symbol, order):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class SimulatedBroker(BrokerAdapter):
+    '''Paper venue for tests, records routed orders after sleeping latency seconds.'''
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.orders = []
+        self.cancels = []
+
+    async def submit(self, symbol, order):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.orders.append(order_record(symbol, order))
+
+    async def cancel(self, symbol, order):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.cancels.append({'symbol': symbol, 'ref': order.ref})
+
+
+class CcxtBroker(BrokerAdapter):
+    '''
+    ccxt async_support venue, e.g. CcxtBroker('binance', {'apiKey': ..., 'secret': ...}).
+
+    Market and limit orders are routed, other execution types are logged
+    and left to the simulated broker.
+    '''
+    ORDER_TYPES = {bt.Order.Market: 'market', bt.Order.Limit: 'limit'}
+
+    def __init__(self, exchange_id='binance', config=None):
+        import ccxt.async_support as ccxt_async
+
+        self.exchange = getattr(ccxt_async, exchange_id)({'enableRateLimit': True, **(config or {})})
+        self.venue_ids = {}
+
+    async def submit(self, symbol, order):
+        order_type = self.ORDER_TYPES.get(order.exectype)
+        if order_type is None:
+            logging.warning('%s order #%d: %s orders are not routed',
+                            symbol, order.ref, bt.Order.ExecTypes[order.exectype])
+            return
+        price = order.created.price if order_type == 'limit' else None
+        result = await self.exchange.create_order(symbol, order_type, 'buy' if order.isbuy() else 'sell',
+                                                  abs(order.created.size), price)
+        self.venue_ids[order.ref] = result['id']
+
+    async def cancel(self, symbol, order):
+        venue_id = self.venue_ids.pop(order.ref, None)
+        if venue_id is not None:
+            await self.exchange.cancel_order(venue_id, symbol)
+
+    async def close(self):
+        await self.exchange.close()
+
+
+class LiveBroker(bt.brokers.BackBroker):
+    '''
+    BackBroker that also routes the orders of live bars to a BrokerAdapter.
+
+    Cash, positions and fills are still simulated on the fetched bars, so
+    strategies see the order lifecycle of a backtest while the adapter
+    mirrors it to the venue. Orders are routed from the first live bar on,
+    the ones the warmup left open included, the position is not. Every
+    routed submit appends (bar close to order ms, fetch to order ms) to
+    latency, adapter round trips go to acks.
+    '''
+
+    def __init__(self, adapter, symbol, feed, loop):
+        super().__init__()
+        self.adapter = adapter
+        self.symbol = symbol
+        self.feed = feed
+        self.loop = loop
+        self.is_live = False
+        self.routed = set()
+        self.deferred = {}
+        self.routes = set()
+        self.latency = []
+        self.acks = []
+
+    def next(self):
+        bar = self.feed.tag
+        if bar is not None and bar.live and not self.is_live:
+            self.is_live = True
+            # Orders left open by the warmup are mirrored once, as of the first live bar.
+            for order in list(self.submitted) + list(self.pending):
+                self.__route_or_defer(order, bar)
+        super().next()
+
+    def submit(self, order, check=True):
+        order = super().submit(order, check)
+        bar = self.feed.tag
+        if bar is not None and bar.live:
+            self.__route_or_defer(order, bar)
+        return order
+
+    def cancel(self, order, bracket=False):
+        # BackBroker notifies the cancellation, which forgets the order, so look it up first.
+        routed = order.ref in self.routed
+        cancelled = super().cancel(order, bracket)
+        if routed:
+            self.__dispatch(self.adapter.cancel(self.symbol, order))
+        return cancelled
+
+    def notify(self, order):
+        super().notify(order)
+        if order.alive():
+            return
+        children = self.deferred.pop(order.ref, None)
+        # Exits of a cancelled or rejected entry are never routed.
+        if children and order.status == bt.Order.Completed and order.ref in self.routed:
+            for child in children:
+                if child.alive():
+                    self.__route(child, self.feed.tag)
+        self.routed.discard(order.ref)
+
+    def __route_or_defer(self, order, bar):
+        parent = order.parent
+        if parent is not None and parent.status != bt.Order.Completed:
+            self.deferred.setdefault(parent.ref, []).append(order)
+        else:
+            self.__route(order, bar)
+
+    def __route(self, order, bar):
+        fetch_to_order = (time.perf_counter() - bar.received_at) * 1000
+        self.latency.append((bar.close_lag_ms + fetch_to_order, fetch_to_order))
+        self.routed.add(order.ref)
+        self.__dispatch(self.adapter.submit(self.symbol, order))
+
+    def __dispatch(self, coroutine):
+        started = time.perf_counter()
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        self.routes.add(future)
+        future.add_done_callback(lambda done: self.__acknowledged(done, started))
+
+    def __acknowledged(self, future, started):
+        self.routes.discard(future)
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logging.error('%s: routing an order failed: %r', self.symbol, future.exception())
+            return
+        self.acks.append((time.perf_counter() - started) * 1000)
+
+
+class SimulatedExchange(ExchangeAdapter):
+    '''
+    Replays datasets as a live exchange on an accelerated clock, for testing.
+
+    frames = {symbol: canonical time indexed frame}, all of timeframe. The
+    exchange clock starts at start and runs speed times faster than wall
+    time, fetch_ohlcv serves the bars opened before it, the running one
+    included, like an exchange does.
+    '''
+
+    def __init__(self, frames, timeframe, start, speed=1.0, latency=0.0, page_limit=500):
+        self.frames = {symbol: (df.index.values.astype('datetime64[ms]').astype(np.int64),
+                                df[['open', 'high', 'low', 'close', 'volume']].to_numpy(dtype=np.float64))
+                       for symbol, df in frames.items()}
+        self.step = self.timeframe_ms(timeframe)
+        self.start_ms = to_ms(start)
+        self.speed = speed
+        self.latency = latency
+        self.page_limit = page_limit
+        self.started = None
+
+    def timeframe_ms(self, timeframe):
+        return pd.Timedelta(timeframe).value // 10 ** 6
+
+    def now_ms(self):
+        if self.started is None:
+            self.started = time.monotonic()
+        return self.start_ms + int((time.monotonic() - self.started) * 1000 * self.speed)
+
+    async def wait_until(self, ms):
+        delay = (ms - self.now_ms()) / 1000 / self.speed
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def fetch_ohlcv(self, symbol, timeframe, since, limit):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        times, values = self.frames[symbol]
+        first = int(np.searchsorted(times, since, side='left'))
+        last = min(int(np.searchsorted(times, self.now_ms(), side='left')), first + min(limit, self.page_limit))
+        return [[int(ts)] + row for ts, row in zip(times[first:last], values[first:last].tolist())]
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else None
+
+
+class LiveRunner:
+    '''
+    Drives the strategies of an experiment config on live bars of many symbols.
+
+    Every symbol runs its own cerebro in a worker thread on a following
+    CachedDatasetFeed, so strategy state stays in memory between bars. The
+    last warmup_bars closed bars are appended first, then one task per
+    symbol asks the exchange for the bars closed since its last one right
+    after every close and appends them. Orders of live bars go through a LiveBroker to
+    broker_adapter. Strategies declaring 'streaming' and 'timeframe' params,
+    such as RegressionStrategy, are switched to streaming predictions.
+    live_config = LIVE_DEFAULTS overrides, config['live'] is used when None.
+    '''
+
+    def __init__(self, config, exchange, broker_adapter, live_config=None, output_dir=None):
+        self.config = config
+        self.live = {**LIVE_DEFAULTS, **(config.get('live') or {}), **(live_config or {})}
+        symbols = self.live['symbols']
+        self.symbols = dict(symbols) if isinstance(symbols, dict) else {symbol: {} for symbol in symbols}
+        if not self.symbols:
+            raise ValueError('no symbols to run live')
+        self.exchange = exchange
+        self.broker_adapter = broker_adapter
+        self.output_dir = Path(output_dir) if output_dir is not None else None
+
+    def symbol_config(self, symbol):
+        config = copy.deepcopy(self.config)
+        # Bars after the warmup are loaded as they close, runonce would need them all up front.
+        config['runonce'] = False
+        step = pd.Timedelta(self.exchange.timeframe_ms(self.live['timeframe']), unit='ms')
+        for strategy_config in config['strategies']:
+            params = {**(strategy_config.get('params') or {}), **(self.symbols[symbol] or {})}
+            keys = resolve_strategy(strategy_config['strategy']).params._getkeys()
+            if 'streaming' in keys:
+                params['streaming'] = True
+            if 'timeframe' in keys and params.get('timeframe') is None:
+                params['timeframe'] = step
+            strategy_config['params'] = params
+        return config
+
+    async def request(self, symbol, since):
+        for attempt in range(self.live['max_retries'] + 1):
+            await self.rate_limiter.wait()
+            try:
+                return await self.exchange.fetch_ohlcv(symbol, self.live['timeframe'], since, self.exchange.page_limit)
+            except RateLimitError as e:
+                if attempt == self.live['max_retries']:
+                    raise
+                delay = self.live['retry_delay'] * 2 ** attempt
+                logging.warning('%s since %s: %s, retrying in %.1fs', symbol, since, e, delay)
+            await asyncio.sleep(delay)
+
+    async def warmup(self, symbol, feed):
+        '''Append the last warmup_bars bars closed before the start to feed, returns (next since, bars).'''
+        step = self.exchange.timeframe_ms(self.live['timeframe'])
+        since = (self.started_ms // step - self.live['warmup_bars']) * step
+        bars = 0
+        while True:
+            rows = await self.request(symbol, since)
+            history = [row for row in rows if row[0] >= since and row[0] + step <= self.started_ms]
+            feed.append(history, LiveBar(False, time.perf_counter(), 0.0))
+            bars += len(history)
+            if history:
+                since = history[-1][0] + step
+            if len(rows) < self.exchange.page_limit or len(history) < len(rows):
+                return since, bars
+
+    async def poll(self, symbol, feed, run, since):
+        '''Append bars to feed as they close until max_bars or the cerebro stopped, returns the bar count.'''
+        step = self.exchange.timeframe_ms(self.live['timeframe'])
+        max_bars = self.live['max_bars']
+        bars = 0
+        while not run.done() and (max_bars is None or bars < max_bars):
+            rows = await self.request(symbol, since)
+            now_ms = self.exchange.now_ms()
+            received_at = time.perf_counter()
+            closed = [row for row in rows if row[0] >= since and row[0] + step <= now_ms]
+            for row in closed[:None if max_bars is None else max_bars - bars]:
+                feed.append([row], LiveBar(True, received_at, (now_ms - row[0] - step) / self.exchange.speed))
+                bars += 1
+                since = row[0] + step
+                logging.debug('%s bar %d closed at %d', symbol, bars, since)
+            if len(closed) == self.exchange.page_limit:
+                continue
+            # The next close, or a retry when the exchange has not published a closed bar yet.
+            await self.exchange.wait_until(max(since + step, now_ms) + int(self.live['poll_delay'] * 1000))
+        return bars
+
+    async def run_symbol(self, symbol, executor):
+        loop = asyncio.get_running_loop()
+        timeframe, compression = feed_timeframe(pd.Timedelta(self.exchange.timeframe_ms(self.live['timeframe']),
+                                                             unit='ms'))
+        feed = CachedDatasetFeed(follow=True, name=symbol, timeframe=timeframe, compression=compression)
+        broker = LiveBroker(self.broker_adapter, symbol, feed, loop)
+        tracker = None
+        if self.output_dir is not None:
+            tracker = OrderHistoryTracker(self.output_dir / f'{symbol.replace("/", "")}.csv')
+        cerebro = build_cerebro(self.symbol_config(symbol), None, stats=False, tracker=tracker,
+                                feed=feed, broker=broker)
+
+        row = {'symbol': symbol, 'bars': 0, 'live_bars': 0}
+        run = None
+        try:
+            since, row['bars'] = await self.warmup(symbol, feed)
+            # The warmup bars are loaded first, live bars as they are appended.
+            run = loop.run_in_executor(executor, cerebro.run)
+            row['live_bars'] = await self.poll(symbol, feed, run, since)
+            row['bars'] += row['live_bars']
+        except RateLimitError as e:
+            logging.error('%s: %r, stopping', symbol, e)
+            row['status'] = f'error: {e!r}'
+        finally:
+            feed.finish()
+            if run is not None:
+                try:
+                    strategy_results = await run
+                    row.update(summarize(cerebro, strategy_results))
+                    row.setdefault('status', 'ok')
+                except Exception as e:
+                    logging.exception('%s stopped', symbol)
+                    row['status'] = f'error: {e!r}'
+            await asyncio.gather(*[asyncio.wrap_future(route) for route in list(broker.routes)], return_exceptions=True)
+            if tracker is not None:
+                tracker.flush()
+
+        close_to_order = [latency[0] for latency in broker.latency]
+        fetch_to_order = [latency[1] for latency in broker.latency]
+        row.update({
+            'orders': len(broker.latency),
+            'close_to_order_p50_ms': percentile(close_to_order, 50),
+            'close_to_order_p95_ms': percentile(close_to_order, 95),
+            'fetch_to_order_p50_ms': percentile(fetch_to_order, 50),
+            'fetch_to_order_max_ms': percentile(fetch_to_order, 100),
+            'ack_p50_ms': percentile(broker.acks, 50),
+        })
+        logging.info('%s: %s, %d live bars, %d orders routed', symbol, row['status'], row['live_bars'], row['orders'])
+        return row
+
+    async def run(self):
+        '''Run every symbol concurrently, returns the summary table, one row per symbol.'''
+        self.rate_limiter = RateLimiter(self.exchange.rate_limit)
+        # Bars closed before this are warmup for every symbol.
+        self.started_ms = self.exchange.now_ms()
+        if self.output_dir is not None:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+        executor = ThreadPoolExecutor(max_workers=len(self.symbols), thread_name_prefix='cerebro')
+        try:
+            rows = await asyncio.gather(*[self.run_symbol(symbol, executor) for symbol in self.symbols])
+        finally:
+            executor.shutdown(wait=False)
+            await self.exchange.close()
+            await self.broker_adapter.close()
+        return pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+
+
+def run_live(config, exchange, broker_adapter, live_config=None, output_dir=None):
+    '''Synchronous entry point, closes the exchange and the broker adapter when done.'''
+    return asyncio.run(LiveRunner(config, exchange, broker_adapter, live_config, output_dir).run())
+
+
+def simulated_exchange(config, live_config, dataset_paths=None, speed=3600.0):
+    '''
+    SimulatedExchange replaying dataset_paths, one per symbol, or the config's dataset for every symbol.
+
+    The clock starts warmup_bars into the shortest dataset, live_config
+    max_bars defaults to the bars left after it.
+    '''
+    symbols = list(live_config['symbols'])
+    dataset_paths = dataset_paths or [config['dataset']] * len(symbols)
+    frames = {symbol: load_dataset(path, start_date=config.get('start_date'), end_date=config.get('end_date'),
+                                   cache=config.get('dataset_cache', True))
+              for symbol, path in zip(symbols, dataset_paths)}
+    shortest = min(frames.values(), key=len)
+    warmup = min(live_config['warmup_bars'], len(shortest) - 1)
+    if live_config.get('max_bars') is None:
+        live_config['max_bars'] = len(shortest) - warmup - 1
+    return SimulatedExchange(frames, live_config['timeframe'], shortest.index[warmup].to_pydatetime(), speed=speed)
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description='Run the strategies of an experiment config on live bars')
+    argparser.add_argument('config_path')
+    argparser.add_argument('--symbols', nargs='+', default=None)
+    argparser.add_argument('--timeframe', default=None)
+    argparser.add_argument('--exchange', default=None, help='ccxt exchange id')
+    argparser.add_argument('--max-bars', type=int, default=None)
+    argparser.add_argument('--broker', choices=['simulated', 'ccxt'], default='simulated',
+                           help='ccxt reads LIVE_API_KEY and LIVE_API_SECRET from the environment')
+    argparser.add_argument('--simulate', action='store_true',
+                           help='replay datasets on a SimulatedExchange instead of fetching live bars')
+    argparser.add_argument('--datasets', nargs='+', default=None,
+                           help='datasets replayed with --simulate, one per symbol')
+    argparser.add_argument('--speed', type=float, default=3600.0,
+                           help='exchange clock speed with --simulate')
+    argparser.add_argument('--output-dir', default=None,
+                           help='defaults to logs/live/<time>')
+    args = argparser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    config = load_config(args.config_path)
+    live_config = {**LIVE_DEFAULTS, **(config.get('live') or {})}
+    if args.symbols:
+        live_config['symbols'] = args.symbols
+    elif args.datasets:
+        live_config['symbols'] = [Path(path).stem for path in args.datasets]
+    for key, value in (('timeframe', args.timeframe), ('exchange', args.exchange), ('max_bars', args.max_bars)):
+        if value is not None:
+            live_config[key] = value
+
+    if args.simulate:
+        exchange = simulated_exchange(config, live_config, args.datasets, speed=args.speed)
+    else:
+        exchange = CcxtExchange(live_config['exchange'])
+    if args.broker == 'ccxt':
+        broker_adapter = CcxtBroker(live_config['exchange'], {'apiKey': os.environ['LIVE_API_KEY'],
+                                                              'secret': os.environ['LIVE_API_SECRET']})
+    else:
+        broker_adapter = SimulatedBroker()
+
+    output_dir = args.output_dir or Path('logs') / 'live' / datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    summary_df = run_live(config, exchange, broker_adapter, live_config, output_dir)
+    summary_path = Path(output_dir) / 'summary.csv'
+    summary_df.to_csv(summary_path, index=False)
+    with pd.option_context('display.width', 200):
+        print(summary_df.to_string(index=False))
+    print(f'summary saved to {summary_path}')
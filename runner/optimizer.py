@@ -0,0 +1,331 @@
+import argparse
+import copy
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+from simulator import simulate
+from util import SUMMARY_KEYS, check_sort_by
+
+from .backtest import config_model_paths, load_config, load_experiment_dataset, run_backtest, summarize
+from .sweep import apply_combination, column_name, expand_values
+
+OPTIMIZE_DEFAULTS = {
+    'method': 'random',  # random or evolutionary
+    'candidates': 27,  # candidates per bracket, tested on the shortest slice
+    'eta': 3,  # 1 / eta of the candidates is promoted to the next slice, eta times longer
+    'rungs': 3,  # slices per bracket, the last is the whole dataset
+    'brackets': 1,  # evolutionary brackets breed from the best full history results so far
+    'mutation': 0.3,  # chance to move each param of a child to a neighbouring value
+    'seed': 0,
+    'processes': None,
+    'sort_by': 'ending_value',
+    'ascending': None,  # defaults to True for max_drawdown only
+    'state_path': None,  # evaluations file, see OptimizerState
+}
+
+# Per-worker state, filled once by _init_worker, every evaluation slices the same dataset.
+_worker_config = None
+_worker_df = None
+
+
+def search_space(config):
+    '''[(strategy index, key, values)] of the sweep entries of the strategies.'''
+    return [(index, key, expand_values(spec))
+            for index, strategy_config in enumerate(config['strategies'])
+            for key, spec in (strategy_config.get('sweep') or {}).items()]
+
+
+def space_size(space):
+    return math.prod(len(values) for _, _, values in space)
+
+
+def decode_candidate(space, number):
+    '''Candidate number of the space in mixed radix, as a sweep combination.'''
+    candidate = []
+    for index, key, values in reversed(space):
+        number, position = divmod(number, len(values))
+        candidate.append((index, key, values[position]))
+    return tuple(reversed(candidate))
+
+
+def candidate_key(candidate):
+    return json.dumps([list(entry) for entry in candidate])
+
+
+def config_fingerprint(config):
+    '''Hash of everything an evaluation depends on besides the candidate and the slice.'''
+    engine = (config.get('sweep') or {}).get('engine')
+    config = copy.deepcopy({key: value for key, value in config.items() if key not in ('optimize', 'sweep')})
+    config['engine'] = engine
+    # Saved summaries are only reusable when they hold every key the search may rank by.
+    config['summary_keys'] = SUMMARY_KEYS
+    for strategy_config in config['strategies']:
+        strategy_config.pop('sweep', None)
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def slice_ends(index, rungs, eta):
+    '''End time of every rung's slice, prefixes of index eta times longer per rung.'''
+    ends = []
+    for rung in range(rungs):
+        n_rows = max(1, math.ceil(len(index) / eta ** (rungs - 1 - rung)))
+        ends.append(index[n_rows - 1].isoformat())
+    return ends
+
+
+class OptimizerState:
+    '''
+    Evaluations of a search, saved as JSON so an interrupted search resumes.
+
+    Proposals only depend on the seed and earlier results, so a rerun
+    replays the same search and only evaluates what the file lacks. A file
+    written for another dataset or base params is refused.
+    '''
+
+    def __init__(self, path, fingerprint):
+        self.path = Path(path) if path is not None else None
+        self.fingerprint = fingerprint
+        self.evaluations = {}
+        if self.path is not None and self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state['fingerprint'] != fingerprint:
+                raise ValueError(f'{self.path} belongs to a different experiment, remove it or pick another path')
+            for entry in state['evaluations']:
+                self.evaluations[(candidate_key(entry['candidate']), entry['end'])] = entry['summary']
+            logging.info('resuming from %s, %d evaluations', self.path, len(self.evaluations))
+
+    def get(self, candidate, end):
+        return self.evaluations.get((candidate_key(candidate), end))
+
+    def put(self, candidate, end, summary):
+        self.evaluations[(candidate_key(candidate), end)] = summary
+
+    def save(self):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        entries = [{'candidate': json.loads(key), 'end': end, 'summary': summary}
+                   for (key, end), summary in self.evaluations.items()]
+        tmp_path = self.path.with_name(f'{self.path.name}.tmp-{os.getpid()}')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            # Ladder summaries may hold numpy scalars.
+            json.dump({'fingerprint': self.fingerprint, 'evaluations': entries}, f, indent=1,
+                      default=lambda value: value.item())
+        os.replace(tmp_path, self.path)
+
+
+class Proposer:
+    '''
+    Candidates of a bracket.
+
+    random samples the space without repeating earlier candidates.
+    evolutionary does so for the first bracket only, later ones breed
+    children of the best full history results by uniform crossover and by
+    moving params to a neighbouring value with probability mutation.
+    '''
+
+    def __init__(self, space, method, mutation, seed):
+        if method not in ('random', 'evolutionary'):
+            raise ValueError(f'unknown optimize method {method!r}, use random or evolutionary')
+        self.space = space
+        self.method = method
+        self.mutation = mutation
+        self.seed = seed
+        self.proposed = set()
+
+    def propose(self, bracket, n, parents):
+        rng = random.Random(self.seed * 1000003 + bracket)
+        if self.method == 'evolutionary' and len(parents) >= 2:
+            candidates = self.breed(rng, n, parents)
+        else:
+            candidates = []
+        size = space_size(self.space)
+        while len(candidates) < n and len(self.proposed) < size:
+            candidate = decode_candidate(self.space, rng.randrange(size))
+            if candidate_key(candidate) not in self.proposed:
+                self.proposed.add(candidate_key(candidate))
+                candidates.append(candidate)
+        return candidates
+
+    def breed(self, rng, n, parents):
+        children = []
+        for _ in range(n * 20):
+            if len(children) == n:
+                break
+            mother, father = rng.sample(parents, 2)
+            child = []
+            for (index, key, values), a, b in zip(self.space, mother, father):
+                position = values.index(rng.choice((a, b))[2])
+                if rng.random() < self.mutation:
+                    position = min(max(position + rng.choice((-1, 1)), 0), len(values) - 1)
+                child.append((index, key, values[position]))
+            child = tuple(child)
+            if candidate_key(child) not in self.proposed:
+                self.proposed.add(candidate_key(child))
+                children.append(child)
+        return children
+
+
+def _init_worker(config, quiet):
+    global _worker_config, _worker_df
+    if quiet:
+        # Strategies log every order, see the sweep's _init_worker.
+        logging.disable(logging.INFO)
+
+    _worker_config = config
+    _worker_df = load_experiment_dataset(config)
+
+
+def _evaluate(candidate, end):
+    config = apply_combination(_worker_config, candidate)
+    df = _worker_df.loc[:pd.Timestamp(end)]
+    if (config.get('sweep') or {}).get('engine') == 'ladder':
+        return simulate(config, df).summary()
+    cerebro, strategy_results = run_backtest(config, df)
+    return summarize(cerebro, strategy_results)
+
+
+def rank(candidates, summaries, sort_by, ascending):
+    '''Candidates best first, NaN scores last, ties in proposal order.'''
+    def score(i):
+        value = summaries[i][sort_by]
+        if value is None or value != value:
+            return math.inf
+        return value if ascending else -value
+    return [candidates[i] for i in sorted(range(len(candidates)), key=score)]
+
+
+def run_optimizer(config, state_path=None, processes=None, quiet=True):
+    '''
+    Search the strategies' sweep space with successive halving over date slices.
+
+    Every bracket proposes optimize.candidates candidates and backtests them
+    on the first 1 / eta ** (rungs - 1) of the dataset. The best 1 / eta
+    of them are promoted to a slice eta times longer, until the last rung
+    runs the whole dataset. Evaluations run on a process pool and are saved
+    to state_path, rerunning with the same state_path resumes the search.
+    The engine is sweep.engine, as for sweeps.
+
+    Returns the table of full history results ranked by optimize.sort_by
+    and a summary of the bars backtested against an exhaustive sweep.
+    '''
+    optimize = {**OPTIMIZE_DEFAULTS, **(config.get('optimize') or {})}
+    sort_by, eta, rungs = optimize['sort_by'], optimize['eta'], optimize['rungs']
+    ascending = optimize['ascending'] if optimize['ascending'] is not None else sort_by == 'max_drawdown'
+    check_sort_by(sort_by)
+    space = search_space(config)
+    if not space:
+        raise ValueError('optimize needs sweep values on at least one strategy')
+
+    index = load_experiment_dataset(config).index
+    ends = slice_ends(index, rungs, eta)
+    rows_at = {end: int(index.searchsorted(pd.Timestamp(end), side='right')) for end in ends}
+    state = OptimizerState(state_path or optimize['state_path'], config_fingerprint(config))
+    proposer = Proposer(space, optimize['method'], optimize['mutation'], optimize['seed'])
+
+    model_paths = config_model_paths(config)
+    if model_paths:
+        from machine_learning import registry
+        registry.preload(model_paths)
+    processes = processes or optimize['processes'] or os.cpu_count()
+    logging.info('optimize %d brackets of %d candidates over %d rungs, slices ending %s, on %d processes',
+                 optimize['brackets'], optimize['candidates'], rungs, ends, processes)
+
+    bars = evaluations = 0
+    final = {}
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(config, quiet)) as executor:
+        try:
+            for bracket in range(optimize['brackets']):
+                parents = rank(list(final), [state.get(candidate, ends[-1]) for candidate in final],
+                               sort_by, ascending)
+                candidates = proposer.propose(bracket, optimize['candidates'],
+                                              parents[:max(2, optimize['candidates'] // eta ** (rungs - 1))])
+                for rung, end in enumerate(ends):
+                    pending = [candidate for candidate in candidates if state.get(candidate, end) is None]
+                    futures = {executor.submit(_evaluate, candidate, end): candidate for candidate in pending}
+                    for future in as_completed(futures):
+                        state.put(futures[future], end, future.result())
+                    state.save()
+
+                    bars += len(candidates) * rows_at[end]
+                    evaluations += len(candidates)
+                    ranked = rank(candidates, [state.get(candidate, end) for candidate in candidates],
+                                  sort_by, ascending)
+                    logging.info('bracket %d rung %d: %d candidates until %s, %d run, best %s %s', bracket, rung,
+                                 len(candidates), end, len(pending), sort_by,
+                                 state.get(ranked[0], end)[sort_by] if ranked else None)
+                    if rung == rungs - 1:
+                        final.update((candidate, bracket) for candidate in candidates)
+                    else:
+                        candidates = ranked[:max(1, len(candidates) // eta)]
+        finally:
+            state.save()
+
+    rows = []
+    for candidate, bracket in final.items():
+        row = {column_name(config, index, key): value for index, key, value in candidate}
+        row['bracket'] = bracket
+        row.update(state.get(candidate, ends[-1]))
+        rows.append(row)
+    result_df = pd.DataFrame(rows)
+    if len(result_df):
+        result_df.sort_values(sort_by, ascending=ascending, inplace=True, kind='mergesort', na_position='last')
+        result_df.reset_index(drop=True, inplace=True)
+    result_df.index = result_df.index + 1
+    result_df.index.name = 'rank'
+
+    exhaustive_bars = space_size(space) * len(index)
+    summary = {
+        'space': space_size(space),
+        'evaluations': evaluations,
+        'bars': bars,
+        'exhaustive_bars': exhaustive_bars,
+        'cost_ratio': bars / exhaustive_bars if exhaustive_bars else float('nan'),
+    }
+    return result_df, summary
+
+
+if __name__ == '__main__':
+    import datetime
+
+    argparser = argparse.ArgumentParser(
+        description='Successive halving search over the sweep values of an experiment config')
+    argparser.add_argument('config_path')
+    argparser.add_argument('--method', default=None, choices=['random', 'evolutionary'])
+    argparser.add_argument('--candidates', type=int, default=None)
+    argparser.add_argument('--brackets', type=int, default=None)
+    argparser.add_argument('--processes', type=int, default=None,
+                           help='worker processes, defaults to optimize.processes or the cpu count')
+    argparser.add_argument('--state', default=None,
+                           help='evaluations file to resume from, defaults to logs/optimize/<config>.json')
+    args = argparser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    config = load_config(args.config_path)
+    optimize = config.get('optimize') or {}
+    config['optimize'] = optimize
+    for key in ('method', 'candidates', 'brackets'):
+        if getattr(args, key) is not None:
+            optimize[key] = getattr(args, key)
+
+    state_path = args.state or optimize.get('state_path') or (
+        Path('logs') / 'optimize' / f'{Path(args.config_path).stem}.json')
+    result_df, summary = run_optimizer(config, state_path=state_path, processes=args.processes)
+    result_path = Path(state_path).with_name(
+        f"{Path(state_path).stem}_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv")
+    result_df.to_csv(result_path)
+    with pd.option_context('display.width', 200):
+        print(result_df.to_string())
+    for key, value in summary.items():
+        print(f'{key}: {value}')
+    print(f'results saved to {result_path}')
@@ -0,0 +1,128 @@
+import copy
+import itertools
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from simulator import simulate
+from util import check_sort_by
+
+from .backtest import config_model_paths, load_experiment_dataset, run_backtest, summarize
+
+# Per-worker state, filled once by _init_worker so that every combination
+# handled by the worker reuses the same parsed dataset.
+_worker_config = None
+_worker_df = None
+
+
+def expand_values(spec):
+    '''
+    Expand one sweep entry into its candidate values.
+
+    spec = list of values, or a mapping with start, stop and step keys which
+    is expanded to a range that includes stop.
+    '''
+    if isinstance(spec, dict):
+        start, stop, step = spec['start'], spec['stop'], spec.get('step', 1)
+        n_values = int((stop - start) / step + 1e-9) + 1
+        return [start + step * i for i in range(n_values)]
+    if isinstance(spec, (list, tuple)):
+        return list(spec)
+    return [spec]
+
+
+def set_param(params, key, value):
+    '''Set a dotted key such as zone.top_grid_price inside a nested params dict.'''
+    *parents, leaf = key.split('.')
+    for parent in parents:
+        params = params.setdefault(parent, {})
+    params[leaf] = value
+
+
+def has_sweep(config):
+    return any(strategy_config.get('sweep') for strategy_config in config['strategies'])
+
+
+def generate_combinations(config):
+    axes = []
+    for index, strategy_config in enumerate(config['strategies']):
+        for key, spec in (strategy_config.get('sweep') or {}).items():
+            axes.append([(index, key, value) for value in expand_values(spec)])
+    return [tuple(combination) for combination in itertools.product(*axes)]
+
+
+def column_name(config, index, key):
+    if len(config['strategies']) == 1:
+        return key
+    strategy_config = config['strategies'][index]
+    return f"{strategy_config.get('name', strategy_config['strategy'])}.{key}"
+
+
+def apply_combination(config, combination):
+    config = copy.deepcopy(config)
+    for index, key, value in combination:
+        set_param(config['strategies'][index]['params'], key, value)
+    return config
+
+
+def _init_worker(config, quiet):
+    global _worker_config, _worker_df
+    if quiet:
+        # Strategies log every order, hundreds of workers doing so would
+        # bury the results table and interleave the shared log file.
+        logging.disable(logging.INFO)
+
+    _worker_config = config
+    _worker_df = load_experiment_dataset(config)
+
+
+def _run_combination(combination):
+    config = apply_combination(_worker_config, combination)
+    if (config.get('sweep') or {}).get('engine') == 'ladder':
+        return simulate(config, _worker_df).summary()
+    cerebro, strategy_results = run_backtest(config, _worker_df, stats=False)
+    return summarize(cerebro, strategy_results)
+
+
+def run_sweep(config, processes=None, quiet=True):
+    '''
+    Backtest every combination of the strategies' sweep values on a process pool.
+
+    Returns the results table ranked by sweep.sort_by (ending_value by default),
+    one row per combination with the swept params, ending value, trade count
+    and max drawdown.
+    '''
+    sweep_config = config.get('sweep') or {}
+    processes = processes or sweep_config.get('processes') or os.cpu_count()
+    sort_by = sweep_config.get('sort_by', 'ending_value')
+    ascending = sweep_config.get('ascending', sort_by == 'max_drawdown')
+    check_sort_by(sort_by)
+
+    combinations = generate_combinations(config)
+    logging.info('sweep %d combinations on %d processes', len(combinations), processes)
+
+    # Loaded once here, forked workers share the models copy-on-write.
+    model_paths = config_model_paths(config)
+    if model_paths:
+        from machine_learning import registry
+        registry.preload(model_paths)
+    chunksize = max(1, len(combinations) // (processes * 4))
+    with ProcessPoolExecutor(max_workers=processes,
+                             initializer=_init_worker,
+                             initargs=(config, quiet)) as executor:
+        summaries = list(executor.map(_run_combination, combinations, chunksize=chunksize))
+
+    rows = []
+    for combination, summary in zip(combinations, summaries):
+        row = {column_name(config, index, key): value for index, key, value in combination}
+        row.update(summary)
+        rows.append(row)
+
+    result_df = pd.DataFrame(rows)
+    result_df.sort_values(sort_by, ascending=ascending, inplace=True, kind='mergesort')
+    result_df.reset_index(drop=True, inplace=True)
+    result_df.index = result_df.index + 1
+    result_df.index.name = 'rank'
+    return result_df
@@ -0,0 +1,254 @@
+import argparse
+import copy
+import datetime
+import logging
+import os
+import pickle
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from machine_learning import RegressionModel
+
+from .backtest import load_config, load_experiment_dataset, run_backtest, summarize
+
+WALK_FORWARD_DEFAULTS = {
+    'train': '365D',
+    'test': '30D',
+    'step': None,  # defaults to test, i.e. back to back test windows
+    'processes': None,
+    'model': {},  # LGBMRegressor params
+}
+
+# Per-worker state, filled once by _init_worker so that every fold handled by
+# the worker slices the same dataset and feature matrix.
+_worker_config = None
+_worker_df = None
+_worker_features = None
+
+
+class FeatureSet:
+    '''
+    Normalized lookback features and next close targets of a whole dataset.
+
+    Built once and sliced per fold. Row i describes the bar at times[i],
+    target is its next close normalized like the features, so predictions
+    denormalize with min_close / max_close as in RegressionModel.predict.
+    '''
+
+    def __init__(self, df, window_size=48, timeframe=None):
+        model = RegressionModel(None, window_size=window_size, timeframe=timeframe)
+        frame = df.reset_index()
+        rows, signal, min_close, max_close = model.build_features(frame)
+
+        close = frame['close'].to_numpy(dtype=np.float64)
+        time = pd.DatetimeIndex(frame['time'])
+        next_close = np.append(close[1:], np.nan)
+        next_time = time[1:].append(pd.DatetimeIndex([pd.NaT]))
+
+        self.columns = model.selected_columns
+        self.signal = signal
+        self.min_close = min_close
+        self.max_close = max_close
+        self.times = time[rows]
+        self.next_times = next_time[rows]
+        self.close = close[rows]
+        self.next_close = next_close[rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.target = (self.next_close - min_close) / (max_close - min_close)
+
+    def __len__(self):
+        return len(self.times)
+
+    def between(self, start, end):
+        return (self.times >= start) & (self.times < end)
+
+
+def generate_folds(index, train, test, step=None):
+    '''
+    Rolling train / test windows over a DatetimeIndex.
+
+    Each fold trains on [train_start, train_end) and tests on the following
+    [train_end, test_end), the last test window may be cut short by the end
+    of the data. Windows advance by step, folds stop once a train window
+    would reach past the data.
+    '''
+    train, test = pd.Timedelta(train), pd.Timedelta(test)
+    step = pd.Timedelta(step) if step is not None else test
+
+    folds = []
+    train_start = index[0]
+    while train_start + train <= index[-1]:
+        train_end = train_start + train
+        folds.append({
+            'fold': len(folds),
+            'train_start': train_start,
+            'train_end': train_end,
+            'test_end': train_end + test,
+        })
+        train_start += step
+    return folds
+
+
+def regression_strategy_index(config):
+    for index, strategy_config in enumerate(config['strategies']):
+        if strategy_config['strategy'] == 'RegressionStrategy':
+            return index
+    raise ValueError('walk forward needs a RegressionStrategy in strategies')
+
+
+def train_model(features, mask, model_params):
+    import lightgbm as lgb
+
+    model = lgb.LGBMRegressor(**model_params)
+    model.fit(pd.DataFrame(features.signal[mask], columns=features.columns), features.target[mask])
+    return model
+
+
+def evaluate_fold(config, df, features, fold, output_dir=None):
+    '''Train on the fold's train window and backtest RegressionStrategy on its test window.'''
+    walk_forward = {**WALK_FORWARD_DEFAULTS, **(config.get('walk_forward') or {})}
+
+    # A train row's target is the next close, which must not fall in the test window.
+    train = features.between(fold['train_start'], fold['train_end'])
+    train &= (features.next_times < fold['train_end']) & np.isfinite(features.target)
+    test = features.between(fold['train_end'], fold['test_end'])
+    if not train.any() or not test.any():
+        return {**fold, 'train_rows': int(train.sum()), 'test_rows': int(test.sum()), 'status': 'empty'}
+
+    model = train_model(features, train, walk_forward['model'])
+    if output_dir is not None:
+        with open(Path(output_dir) / f"fold_{fold['fold']:03d}.pickle", 'wb') as f:
+            pickle.dump(model, f)
+
+    signal = pd.DataFrame(features.signal[test], columns=features.columns)
+    min_close, max_close = features.min_close[test], features.max_close[test]
+    prediction = model.predict(signal) * (max_close - min_close) + min_close
+    predictions = pd.Series(prediction, index=pd.DatetimeIndex(features.times[test], name='time'),
+                            name='prediction')
+
+    next_close, close = features.next_close[test], features.close[test]
+    scored = np.isfinite(next_close) & np.isfinite(prediction)
+    rmse = np.sqrt(np.mean((prediction[scored] - next_close[scored]) ** 2)) if scored.any() else np.nan
+    direction_accuracy = (np.mean(np.sign(prediction[scored] - close[scored])
+                                  == np.sign(next_close[scored] - close[scored]))
+                          if scored.any() else np.nan)
+
+    config = copy.deepcopy({key: value for key, value in config.items() if key != 'walk_forward'})
+    config['strategies'][regression_strategy_index(config)]['params']['predictions'] = predictions
+    test_df = df[(df.index >= fold['train_end']) & (df.index < fold['test_end'])]
+    cerebro, strategy_results = run_backtest(config, test_df, stats=False)
+
+    row = {**fold, 'train_rows': int(train.sum()), 'test_rows': int(test.sum()), 'status': 'ok'}
+    row.update(summarize(cerebro, strategy_results))
+    row['return'] = row['ending_value'] / config['broker']['init_cash'] - 1
+    row['rmse'] = float(rmse)
+    row['direction_accuracy'] = float(direction_accuracy)
+    return row
+
+
+def _init_worker(config, df, features, quiet):
+    global _worker_config, _worker_df, _worker_features
+    if quiet:
+        # Strategies log every order and LightGBM prints while training.
+        sys.stdout = open(os.devnull, 'w')
+        logging.disable(logging.INFO)
+
+    _worker_config = config
+    _worker_df = df
+    _worker_features = features
+
+
+def _run_fold(fold, output_dir):
+    return evaluate_fold(_worker_config, _worker_df, _worker_features, fold, output_dir)
+
+
+def aggregate_folds(result_df):
+    '''
+    Totals across the folds that ran. compounded_return chains the test
+    windows, which is only meaningful when step equals test.
+    '''
+    ok = result_df[result_df['status'] == 'ok']
+    if ok.empty:
+        return {'folds': 0}
+    return {
+        'folds': len(ok),
+        'compounded_return': float(np.prod(1 + ok['return']) - 1),
+        'mean_return': float(ok['return'].mean()),
+        'positive_folds': float((ok['return'] > 0).mean()),
+        'trades': int(ok['trades'].sum()),
+        'worst_drawdown': float(ok['max_drawdown'].max()),
+        'mean_rmse': float(ok['rmse'].mean()),
+        'mean_direction_accuracy': float(ok['direction_accuracy'].mean()),
+    }
+
+
+def run_walk_forward(config, output_dir=None, processes=None, quiet=True):
+    '''
+    Walk-forward evaluation of RegressionStrategy with a model retrained per fold.
+
+    The dataset and its feature matrix are built once in the parent and
+    inherited by the workers, each fold only slices them, trains an
+    LGBMRegressor on its train window and backtests its test window with the
+    fold's predictions. Fold models are pickled to output_dir when given.
+    Returns the per-fold table and the aggregate summary.
+    '''
+    walk_forward = {**WALK_FORWARD_DEFAULTS, **(config.get('walk_forward') or {})}
+    strategy_params = config['strategies'][regression_strategy_index(config)]['params']
+
+    df = load_experiment_dataset(config)
+    features = FeatureSet(df, window_size=strategy_params.get('window_size', 48),
+                          timeframe=strategy_params.get('timeframe'))
+    folds = generate_folds(df.index, walk_forward['train'], walk_forward['test'], walk_forward['step'])
+    if not folds:
+        raise ValueError(f"dataset shorter than the train window {walk_forward['train']}")
+    if output_dir is not None:
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+    processes = min(processes or walk_forward['processes'] or os.cpu_count(), len(folds))
+    logging.info('walk forward %d folds over %d feature rows on %d processes',
+                 len(folds), len(features), processes)
+
+    with ProcessPoolExecutor(max_workers=processes,
+                             initializer=_init_worker,
+                             initargs=(config, df, features, quiet)) as executor:
+        rows = list(executor.map(_run_fold, folds, [output_dir] * len(folds)))
+
+    result_df = pd.DataFrame(rows).set_index('fold')
+    return result_df, aggregate_folds(result_df)
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description='Walk-forward evaluation of RegressionStrategy, retraining the model per fold')
+    argparser.add_argument('config_path')
+    argparser.add_argument('--train', default=None, help='train window, e.g. 365D')
+    argparser.add_argument('--test', default=None, help='test window, e.g. 30D')
+    argparser.add_argument('--step', default=None, help='window step, defaults to the test window')
+    argparser.add_argument('--processes', type=int, default=None,
+                           help='worker processes, defaults to walk_forward.processes or the cpu count')
+    argparser.add_argument('--output-dir', default=None,
+                           help='defaults to logs/walk_forward/<config>_<time>')
+    args = argparser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    config = load_config(args.config_path)
+    walk_forward = config.setdefault('walk_forward', {}) or {}
+    config['walk_forward'] = walk_forward
+    for key in ('train', 'test', 'step'):
+        if getattr(args, key) is not None:
+            walk_forward[key] = getattr(args, key)
+
+    output_dir = args.output_dir or Path('logs') / 'walk_forward' / (
+        f"{Path(args.config_path).stem}_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}")
+    result_df, summary = run_walk_forward(config, output_dir=output_dir, processes=args.processes)
+    result_path = Path(output_dir) / 'folds.csv'
+    result_df.to_csv(result_path)
+    with pd.option_context('display.width', 200):
+        print(result_df.to_string())
+    for key, value in summary.items():
+        print(f'{key}: {value}')
+    print(f'folds saved to {result_path}')
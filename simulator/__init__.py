@@ -0,0 +1 @@
+from .grid_ladder import GridLadderSimulator, GridLadder, AdaptiveZoneGridLadder, simulate, simulate_ladder
@@ -0,0 +1,442 @@
+import numpy as np
+
+from data.feed import EPOCH_ORDINAL, NS_PER_DAY
+from util.analytics import SUMMARY_KEYS, TRADE_COLUMNS, compute_analytics
+
+PENDING, HOLDING = 0, 1
+BUY, STOP, TAKE_PROFIT = 0, 1, 2
+
+
+class _Position:
+    '''Size and average price of the single long/short position, updated like bt.Position.update.'''
+    __slots__ = ('size', 'price')
+
+    def __init__(self, size=0.0, price=0.0):
+        self.size = size
+        self.price = price
+
+    def clone(self):
+        return _Position(self.size, self.price)
+
+    def update(self, size, price):
+        oldsize = self.size
+        self.size += size
+
+        if not self.size:
+            opened, closed = 0, size
+            self.price = 0.0
+        elif not oldsize:
+            opened, closed = size, 0
+            self.price = price
+        elif oldsize > 0:
+            if size > 0:
+                opened, closed = size, 0
+                self.price = (self.price * oldsize + size * price) / self.size
+            elif self.size > 0:
+                opened, closed = 0, size
+            else:
+                opened, closed = self.size, -oldsize
+                self.price = price
+        else:
+            if size < 0:
+                opened, closed = size, 0
+                self.price = (self.price * oldsize + size * price) / self.size
+            elif self.size < 0:
+                opened, closed = 0, size
+            else:
+                opened, closed = self.size, -oldsize
+                self.price = price
+        return opened, closed
+
+
+class GridLadderSimulator:
+    '''
+    NumPy replay of the grid strategies' bracket ladder over OHLC arrays.
+
+    Mirrors backtrader's BackBroker for the orders the grid strategies use, with
+    cheat-on-close, zero commission and stock-like cash: a bracket is cash-checked
+    on the bar after it was submitted, its buy limit fills at the open on a gap
+    or at the limit price, take profit and the stop-limit stop only become
+    active on the bar after the buy filled, and buys that cannot be paid for
+    are rejected and cancel their bracket. Which brackets fire on a bar is found
+    with array masks over the live brackets, only the brackets that fire are
+    settled one by one, in order, so cash and position match the broker exactly.
+    '''
+
+    def __init__(self, init_cash):
+        self.cash = float(init_cash)
+        self.position = _Position()
+        self.submitted = []
+        self.fills = []
+        self.trades = 0
+        # Closed trades as rows of util.analytics.TRADE_COLUMNS, with bar numbers for dtopen / dtclose.
+        self.closed_trades = []
+        self._trade = None
+        self._bar = 0
+
+        self._next_id = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._level = np.empty(0, dtype=np.int64)
+        self._price = np.empty(0)
+        self._tp = np.empty(0)
+        self._sl = np.empty(0)
+        self._state = np.empty(0, dtype=np.int8)
+        self._active_from = np.empty(0, dtype=np.int64)
+        self._triggered = np.empty(0, dtype=bool)
+        self._remaining = np.empty(0)
+        self._sl_remaining = np.empty(0)
+        self._tp_remaining = np.empty(0)
+
+    def submit_bracket(self, level, price, tp, sl, size):
+        bracket_id = self._next_id
+        self._next_id += 1
+        self.submitted.append((bracket_id, level, price, tp, sl, size))
+        return bracket_id
+
+    def _pseudo_execute(self, position, size, price, cash):
+        # check_submitted prices every order at its created price with no pnl.
+        opened, closed = position.update(size, price)
+        if closed:
+            cash += -closed * price
+        if opened:
+            cash -= opened * price
+        return cash
+
+    def _accept_submitted(self):
+        cash = self.cash
+        position = self.position.clone()
+        accepted = []
+        for bracket in self.submitted:
+            bracket_id, level, price, tp, sl, size = bracket
+            cash = self._pseudo_execute(position, size, price, cash)
+            if cash < 0.0:
+                # Margin, the children are rejected without being priced.
+                continue
+            cash = self._pseudo_execute(position, -size, sl, cash)
+            cash = self._pseudo_execute(position, -size, tp, cash)
+            accepted.append(bracket)
+        self.submitted = []
+        if not accepted:
+            return
+
+        ids, levels, prices, tps, sls, sizes = (np.array(column) for column in zip(*accepted))
+        n_accepted = len(accepted)
+        self._ids = np.concatenate([self._ids, ids.astype(np.int64)])
+        self._level = np.concatenate([self._level, levels.astype(np.int64)])
+        self._price = np.concatenate([self._price, prices.astype(np.float64)])
+        self._tp = np.concatenate([self._tp, tps.astype(np.float64)])
+        self._sl = np.concatenate([self._sl, sls.astype(np.float64)])
+        self._state = np.concatenate([self._state, np.full(n_accepted, PENDING, dtype=np.int8)])
+        self._active_from = np.concatenate([self._active_from, np.zeros(n_accepted, dtype=np.int64)])
+        self._triggered = np.concatenate([self._triggered, np.zeros(n_accepted, dtype=bool)])
+        sizes = sizes.astype(np.float64)
+        self._remaining = np.concatenate([self._remaining, sizes])
+        self._sl_remaining = np.concatenate([self._sl_remaining, sizes])
+        self._tp_remaining = np.concatenate([self._tp_remaining, sizes])
+
+    def _execute(self, size, price):
+        '''
+        Real execution as BackBroker._execute.
+
+        Returns the executed size and whether the order ran out of cash. The
+        executed size can differ from size by float residue when the position
+        flips sign, which leaves the order partially filled like in backtrader.
+        '''
+        position = self.position
+        pprice_orig = position.price
+        oldsize = position.size
+        opened, closed = position.clone().update(size, price)
+
+        cash = self.cash
+        pnl = 0.0
+        if closed:
+            pnl = -closed * (price - pprice_orig)
+            cash += -closed * pprice_orig + pnl
+            self.cash = cash
+
+        popened = opened
+        if opened:
+            cash -= opened * price
+            if cash < 0.0:
+                opened = 0
+            else:
+                self.cash = cash
+
+        execsize = closed + opened
+        if execsize:
+            position.update(execsize, price)
+            if closed:
+                self._trade[2] += pnl
+            flipped = oldsize and position.size and (oldsize > 0) != (position.size > 0)
+            if self._trade is not None and (not position.size or flipped):
+                open_bar, long, trade_pnl = self._trade
+                self.closed_trades.append((open_bar, self._bar, self._bar - open_bar, long,
+                                           trade_pnl, trade_pnl, 0.0))
+                self._trade = None
+            if not oldsize or flipped:
+                self.trades += 1
+                self._trade = [self._bar, position.size > 0, 0.0]
+        return execsize, bool(popened and not opened)
+
+    def step(self, bar, popen, phigh, plow):
+        '''Broker side of one bar, returns the ids of brackets whose take profit completed.'''
+        self._bar = bar
+        self._accept_submitted()
+        if not len(self._ids):
+            return []
+
+        state = self._state
+        pending = state == PENDING
+        holding = (state == HOLDING) & (self._active_from <= bar)
+
+        buy_hit = pending & (self._price >= plow)
+
+        sl = self._sl
+        newly_triggered = holding & ~self._triggered & (plow <= sl)
+        stop_hit = (newly_triggered & (sl <= phigh)) | \
+            (holding & self._triggered & (sl <= phigh))
+        self._triggered |= newly_triggered
+
+        tp_hit = holding & (self._tp <= phigh)
+
+        fired = np.flatnonzero(buy_hit | stop_hit | tp_hit)
+        if not len(fired):
+            return []
+
+        closed_brackets = []
+        dead = []
+        for index in fired:
+            level = self._level[index]
+            if buy_hit[index]:
+                price = self._price[index]
+                price = popen if price >= popen else price
+                execsize, margin = self._execute(self._remaining[index], price)
+                if execsize:
+                    self.fills.append((bar, BUY, price, execsize, level))
+                    self._remaining[index] -= execsize
+                if margin:
+                    dead.append(index)
+                elif not self._remaining[index]:
+                    # Children are activated on the next bar.
+                    self._state[index] = HOLDING
+                    self._active_from[index] = bar + 1
+                continue
+
+            if stop_hit[index]:
+                price = sl[index]
+                if not newly_triggered[index] and price <= popen:
+                    price = popen
+                execsize, _ = self._execute(-self._sl_remaining[index], price)
+                if execsize:
+                    self.fills.append((bar, STOP, price, -execsize, level))
+                    self._sl_remaining[index] += execsize
+                if not self._sl_remaining[index]:
+                    dead.append(index)
+                    continue
+
+            if tp_hit[index]:
+                price = self._tp[index]
+                if price <= popen:
+                    price = popen
+                execsize, _ = self._execute(-self._tp_remaining[index], price)
+                if execsize:
+                    self.fills.append((bar, TAKE_PROFIT, price, -execsize, level))
+                    self._tp_remaining[index] += execsize
+                if not self._tp_remaining[index]:
+                    dead.append(index)
+                    closed_brackets.append(self._ids[index])
+
+        if dead:
+            keep = np.ones(len(self._ids), dtype=bool)
+            keep[dead] = False
+            self._compact(keep)
+        return closed_brackets
+
+    def _compact(self, keep):
+        self._ids = self._ids[keep]
+        self._level = self._level[keep]
+        self._price = self._price[keep]
+        self._tp = self._tp[keep]
+        self._sl = self._sl[keep]
+        self._state = self._state[keep]
+        self._active_from = self._active_from[keep]
+        self._triggered = self._triggered[keep]
+        self._remaining = self._remaining[keep]
+        self._sl_remaining = self._sl_remaining[keep]
+        self._tp_remaining = self._tp_remaining[keep]
+
+    def value(self, pclose):
+        '''Portfolio value as BackBroker._get_value for a stock-like position.'''
+        position = self.position
+        dvalue = position.size * pclose
+        dunrealized = position.size * (pclose - position.price)
+        if dvalue > 0:
+            return self.cash + ((dvalue - dunrealized) + dunrealized)
+        return self.cash + dvalue
+
+    @property
+    def pending_orders(self):
+        return len(self._ids) + len(self.submitted)
+
+
+class GridLadder:
+    '''
+    Strategy side of a grid: one bracket per free level, take profit at the next level.
+
+    A level is freed only when the take profit of the bracket it currently owns
+    fills, as in the strategies' notify_order.
+    '''
+    grid_sl = 1  # Never stop loss, as the strategies
+
+    def __init__(self, n_grid, bottom_grid_price, top_grid_price, position_cash):
+        self.n_grid = n_grid
+        self.position_cash = position_cash
+        self.level_bracket = np.full(n_grid, -1, dtype=np.int64)
+        self.set_zone(bottom_grid_price, top_grid_price)
+
+    def set_zone(self, bottom_grid_price, top_grid_price):
+        self.bottom_grid_price = bottom_grid_price
+        self.top_grid_price = top_grid_price
+        grid_size = (top_grid_price - bottom_grid_price) / (self.n_grid + 1)
+        grid_no = np.arange(self.n_grid)
+        self.prices = bottom_grid_price + grid_size * grid_no
+        # Take profit at next grid bar
+        self.tps = bottom_grid_price + grid_size * (grid_no + 1)
+
+    def open_free_levels(self, simulator):
+        for level in np.flatnonzero(self.level_bracket < 0):
+            price = float(self.prices[level])
+            size = self.position_cash / price
+            self.level_bracket[level] = simulator.submit_bracket(
+                level, price, float(self.tps[level]), self.grid_sl, size)
+
+    def start(self, simulator):
+        self.open_free_levels(simulator)
+
+    def notify_closed(self, closed_brackets):
+        for bracket_id in closed_brackets:
+            self.level_bracket[self.level_bracket == bracket_id] = -1
+
+    def next(self, simulator, pclose):
+        self.open_free_levels(simulator)
+
+
+class AdaptiveZoneGridLadder(GridLadder):
+    '''GridLadder that re-centres the zone on the close when price leaves it, like create_new_zone.'''
+
+    def __init__(self, n_grid, start_price, high_side_ratio, low_side_ratio, position_cash):
+        self.high_side_ratio = high_side_ratio
+        self.low_side_ratio = low_side_ratio
+        self.base_grid_price = start_price
+        super().__init__(n_grid,
+                         bottom_grid_price=start_price * (1 - low_side_ratio),
+                         top_grid_price=start_price * (1 + high_side_ratio),
+                         position_cash=position_cash)
+
+    def next(self, simulator, pclose):
+        if pclose < self.bottom_grid_price or pclose > self.top_grid_price:
+            self.base_grid_price = pclose
+            self.set_zone(pclose * (1 - self.low_side_ratio),
+                          pclose * (1 + self.high_side_ratio))
+            # Old brackets stay with the broker, the levels just forget them.
+            self.level_bracket[:] = -1
+        self.open_free_levels(simulator)
+
+
+class GridLadderResult:
+    def __init__(self, ending_value, equity, fills, trades, cash=None, closed_trades=(), init_cash=None,
+                 times=None):
+        self.ending_value = ending_value
+        self.equity = equity
+        self.fills = fills
+        self.trades = trades
+        self.cash = cash if cash is not None else equity
+        self.closed_trades = closed_trades
+        self.init_cash = init_cash if init_cash is not None else (equity[0] if len(equity) else ending_value)
+        # Bar times as backtrader date numbers, bar numbers when unknown.
+        self.times = times if times is not None else np.arange(len(equity), dtype=np.float64)
+
+    @property
+    def max_drawdown(self):
+        peak = np.maximum.accumulate(self.equity)
+        return float(np.max(100.0 * (peak - self.equity) / peak)) if len(self.equity) else 0.0
+
+    def analysis(self):
+        '''util.analytics.compute_analytics of the run, as the Analytics analyzer reports it for backtrader.'''
+        trades = np.array(self.closed_trades, dtype=np.float64).reshape(-1, len(TRADE_COLUMNS))
+        for col in ('dtopen', 'dtclose'):
+            column = TRADE_COLUMNS.index(col)
+            trades[:, column] = self.times[trades[:, column].astype(np.int64)]
+        return compute_analytics(self.times, self.equity, self.cash, trades, self.init_cash, opened=self.trades)
+
+    def summary(self):
+        analysis = self.analysis()
+        summary = {key: analysis[key] for key in SUMMARY_KEYS}
+        summary['ending_value'] = self.ending_value
+        return summary
+
+
+def simulate_ladder(ladder, popen, phigh, plow, pclose, init_cash, times=None):
+    simulator = GridLadderSimulator(init_cash)
+    ladder.start(simulator)
+
+    n_bars = len(pclose)
+    equity = np.empty(n_bars)
+    cash = np.empty(n_bars)
+    for bar in range(n_bars):
+        closed_brackets = simulator.step(bar, popen[bar], phigh[bar], plow[bar])
+        equity[bar] = simulator.value(pclose[bar])
+        cash[bar] = simulator.cash
+        if closed_brackets:
+            ladder.notify_closed(closed_brackets)
+        ladder.next(simulator, pclose[bar])
+
+    ending_value = float(equity[-1]) if n_bars else simulator.cash
+    return GridLadderResult(ending_value, equity, simulator.fills, simulator.trades, cash=cash,
+                            closed_trades=simulator.closed_trades, init_cash=float(init_cash), times=times)
+
+
+def _strategy_params(strategy_config):
+    # Defaults come from the strategy class so a config may leave params out.
+    from runner.backtest import resolve_strategy
+
+    strategy = resolve_strategy(strategy_config['strategy'])
+    params = dict(strategy.params._getpairs())
+    params.update(strategy_config.get('params') or {})
+    return strategy.__name__, params
+
+
+def build_ladder(strategy_config):
+    name, params = _strategy_params(strategy_config)
+    if name == 'GridBasicStrategy':
+        return GridLadder(params['n_grid'],
+                          bottom_grid_price=params['zone']['bottom_grid_price'],
+                          top_grid_price=params['zone']['top_grid_price'],
+                          position_cash=params['position']['position_cash'])
+    if name == 'GridAdaptiveZoneStrategy':
+        return AdaptiveZoneGridLadder(params['n_grid'],
+                                      start_price=params['zone']['start_price'],
+                                      high_side_ratio=params['zone']['high_side_ratio'],
+                                      low_side_ratio=params['zone']['low_side_ratio'],
+                                      position_cash=params['position']['position_cash'])
+    raise ValueError(f'{name} has no vectorized ladder engine')
+
+
+def date_numbers(index):
+    '''backtrader date numbers of a DatetimeIndex, to float precision.'''
+    time_ns = index.values.astype('datetime64[ns]').astype(np.int64)
+    return time_ns / NS_PER_DAY + EPOCH_ORDINAL
+
+
+def simulate(config, df):
+    '''Run the experiment's single grid strategy on the ladder engine.'''
+    if len(config['strategies']) != 1:
+        raise ValueError('the ladder engine runs exactly one grid strategy')
+    ladder = build_ladder(config['strategies'][0])
+    return simulate_ladder(ladder,
+                           df['open'].to_numpy(dtype=np.float64),
+                           df['high'].to_numpy(dtype=np.float64),
+                           df['low'].to_numpy(dtype=np.float64),
+                           df['close'].to_numpy(dtype=np.float64),
+                           init_cash=config['broker']['init_cash'],
+                           times=date_numbers(df.index))
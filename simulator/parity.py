@@ -0,0 +1,85 @@
+import argparse
+import copy
+import math
+import sys
+
+import backtrader as bt
+
+from runner.backtest import build_cerebro, load_config, load_dataset, summarize
+from simulator.grid_ladder import BUY, simulate
+
+
+class FillRecorder(bt.Analyzer):
+    '''Records (bar, side, price, size) of every execution, partial ones included, in notification order.'''
+
+    def start(self):
+        self.fills = []
+
+    def notify_order(self, order):
+        for exbit in order.executed.iterpending():
+            self.fills.append((len(self.data) - 1, 'BUY' if order.isbuy() else 'SELL',
+                               exbit.price, abs(exbit.size)))
+
+    def get_analysis(self):
+        return self.fills
+
+
+def compare_fills(expected, actual, rtol):
+    for n_fill, (expected_fill, actual_fill) in enumerate(zip(expected, actual)):
+        same = expected_fill[:2] == actual_fill[:2] and all(
+            math.isclose(a, b, rel_tol=rtol) for a, b in zip(expected_fill[2:], actual_fill[2:]))
+        if not same:
+            return f'fill #{n_fill}: backtrader {expected_fill} ladder {actual_fill}'
+    if len(expected) != len(actual):
+        return f'{len(expected)} backtrader fills, {len(actual)} ladder fills'
+    return None
+
+
+def check_parity(config, df, rtol=1e-9):
+    '''
+    Run one grid experiment through backtrader and through the ladder engine.
+
+    Returns (mismatch, backtrader summary, ladder summary), mismatch is None
+    when fills, trade count and ending value agree.
+    '''
+    cerebro = build_cerebro(config, df, stats=False)
+    cerebro.addanalyzer(FillRecorder, _name='fills')
+    strategy_results = cerebro.run()
+    expected = strategy_results[0].analyzers.fills.get_analysis()
+    expected_summary = summarize(cerebro, strategy_results)
+
+    result = simulate(config, df)
+    actual = [(bar, 'BUY' if kind == BUY else 'SELL', price, size)
+              for bar, kind, price, size, level in result.fills]
+    actual_summary = result.summary()
+
+    mismatch = compare_fills(expected, actual, rtol)
+    if mismatch is None and not math.isclose(expected_summary['ending_value'],
+                                             actual_summary['ending_value'], rel_tol=rtol):
+        mismatch = f"ending value {expected_summary['ending_value']} != {actual_summary['ending_value']}"
+    if mismatch is None and expected_summary['trades'] != actual_summary['trades']:
+        mismatch = f"trades {expected_summary['trades']} != {actual_summary['trades']}"
+    return mismatch, expected_summary, actual_summary
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description='Check the ladder engine against backtrader on grid experiments')
+    argparser.add_argument('config_paths', nargs='+')
+    argparser.add_argument('--datasets', nargs='*', default=None,
+                           help='datasets to run every config on, defaults to each config dataset')
+    argparser.add_argument('--rtol', type=float, default=1e-9)
+    args = argparser.parse_args()
+
+    failed = False
+    for config_path in args.config_paths:
+        base_config = load_config(config_path)
+        for dataset_path in args.datasets or [base_config['dataset']]:
+            config = copy.deepcopy(base_config)
+            config['dataset'] = dataset_path
+            df = load_dataset(dataset_path, config.get('start_date'), config.get('end_date'))
+            mismatch, expected_summary, actual_summary = check_parity(config, df, rtol=args.rtol)
+            status = 'ok' if mismatch is None else f'MISMATCH {mismatch}'
+            print(f'{config_path} {dataset_path}: {status} ending value {actual_summary["ending_value"]:.6f}')
+            failed = failed or mismatch is not None
+    sys.exit(1 if failed else 0)
@@ -1,15 +1,18 @@
+import logging
+
 import backtrader as bt
+from util import StrategyLogger
 
 
 class GoldenCrossStrategy(bt.Strategy):
-    params = (('fast', 30), ('slow', 60))
+    params = (('fast', 30), ('slow', 60), ('tracker', None))
 
-    def log(self, txt, dt=None):
+    def log(self, txt, *args, dt=None, level=logging.INFO):
         ''' Logging function for this strategy'''
-        dt = dt or self.datas[0].datetime.date(0)
-        print('%s, %s position.size %s' % (dt.isoformat(), txt, self.position.size))
+        self.logger.log(level, txt, *args, dt=dt)
 
     def __init__(self):
+        self.logger = StrategyLogger(self)
         self.fast_signal = bt.indicators.MovingAverageSimple(period=self.params.fast)
         self.slow_signal = bt.indicators.MovingAverageSimple(period=self.params.slow)
         self.cross_over = bt.indicators.CrossOver(self.fast_signal, self.slow_signal)
@@ -21,15 +24,20 @@ class GoldenCrossStrategy(bt.Strategy):
             self.buy()
             # print(self.position)
         elif self.cross_over < 0:
-            self.log('close position')
-            print(self.position)
+            self.log('close position, price %.2f', self.position.price)
             self.close()
             # print(self.position)
     
     def notify_order(self, order):
+        if self.p.tracker is not None:
+            self.p.tracker.notify_order(self, order)
+
         if order.status in [order.Completed]:
             if order.isbuy():
-                self.log('BUY EXECUTED, %.2f' % order.executed.price)
+                self.log('BUY EXECUTED, %.2f', order.executed.price)
             elif order.issell():
-                self.log('SELL EXECUTED, %.2f' % order.executed.price)
-                print(self.position)
\ No newline at end of file
+                self.log('SELL EXECUTED, %.2f', order.executed.price)
+
+    def stop(self):
+        if self.p.tracker is not None:
+            self.p.tracker.flush()
\ No newline at end of file
@@ -1,40 +1,12 @@
 
+import logging
 import backtrader as bt
-from indicator import LinearIndicator, HorizontalLinearIndicator
+from util import StrategyLogger
+from .GridLadder import GridLadder
 import numpy as np
 import pandas as pd
 import math
 
-class GridBar:
-    def __init__(self,
-                 grid_no,
-                 grid_price,
-                 grid_tp,
-                 grid_sl,
-                 grid_indicator
-                 ):
-        self.grid_no = grid_no
-        self.grid_price = grid_price
-        self.grid_tp = grid_tp
-        self.grid_sl = grid_sl
-        self.grid_indicator = grid_indicator
-        self.is_opened = False
-        self.buy_order = None
-        self.tp_order = None
-        self.sl_order = None
-
-    def open_order(self, buy_order, tp_order, sl_order):
-        self.is_opened = True
-        self.buy_order = buy_order
-        self.tp_order = tp_order
-        self.sl_order = sl_order
-    
-    def close_order(self):
-        self.is_opened = False
-        self.buy_order = None
-        self.tp_order = None
-        self.sl_order = None
-
 class GridAdaptiveZoneStrategy(bt.Strategy):
 
     params = {
@@ -49,82 +21,80 @@ class GridAdaptiveZoneStrategy(bt.Strategy):
             'position_cash': 10000
         },
         'plot': {
-            'plot_grid_bar': True,
+            'plot_grid_bar': False,
             'plot_cross_over': False
-        }
+        },
+        'tracker': None
     }
 
-    def log(self, txt, dt=None):
+    def log(self, txt, *args, dt=None, level=logging.INFO):
         ''' Logging function for this strategy'''
-        dt = dt or self.datas[0].datetime.date(0)
-        print(f'{dt.isoformat()}, {txt} position.size {self.position.size:.5f}')
+        self.logger.log(level, txt, *args, dt=dt)
 
     def __init__(self):
+        self.logger = StrategyLogger(self, position_format='%.5f')
+        # backtrader takes a 'plot' kwarg as plotinfo.plot, read the options back from there.
+        if isinstance(self.plotinfo.plot, dict):
+            self.p.plot = {**self.p.plot, **self.plotinfo.plot}
+            self.plotinfo.plot = True
         self.__create_grid_bars()
 
     def __create_grid_bars(self):
         self.base_grid_price = self.p.zone['start_price']
+        prices, tp_prices = self.__zone_levels()
+        self.ladder = GridLadder(prices, tp_prices,
+                                 sl=1, # Never stop loss
+                                 plot=self.p.plot['plot_grid_bar'])
+
+        # Orders need a bar, a streamed feed has none loaded yet, see prenext_open.
+        self.grid_pending = not self.data.buflen()
+        if not self.grid_pending:
+            for level in self.ladder.next_free_levels():
+                self.open_grid(level)
+
+    def prenext_open(self):
+        # Runs on the first bar before the broker, like orders from __init__.
+        if self.grid_pending:
+            self.grid_pending = False
+            for level in self.ladder.next_free_levels():
+                self.open_grid(level)
+
+    def __zone_levels(self):
         self.top_grid_price = self.base_grid_price * (1 + self.p.zone['high_side_ratio'])
         self.bottom_grid_price = self.base_grid_price * (1 - self.p.zone['low_side_ratio'])
-        
 
         grid_size = (self.top_grid_price -
                      self.bottom_grid_price) / (self.p.n_grid+1)
-        self.grids = []
-        for grid_no in range(self.p.n_grid):
-            price = self.bottom_grid_price + grid_size*grid_no
-            # Take profit at next grid bar
-            tp_price = self.bottom_grid_price + grid_size*(grid_no+1)
-            grid_line = HorizontalLinearIndicator(
-                y=price, plot=self.p.plot['plot_grid_bar'], plotname=f'bar_{grid_no}')
-
-            grid = GridBar(
-                grid_no=grid_no,
-                grid_price=price,
-                grid_tp=tp_price,
-                grid_sl=1, # Never stop loss
-                grid_indicator=grid_line
-            )
-
-            self.open_grid(grid)
-
-            self.grids.append(grid)
+        grid_no = np.arange(self.p.n_grid)
+        prices = self.bottom_grid_price + grid_size*grid_no
+        # Take profit at next grid bar
+        tp_prices = self.bottom_grid_price + grid_size*(grid_no+1)
+        return prices, tp_prices
 
     def create_new_zone(self, new_base_grid_price):
         self.base_grid_price = new_base_grid_price
-        self.top_grid_price = self.base_grid_price * (1 + self.p.zone['high_side_ratio'])
-        self.bottom_grid_price = self.base_grid_price * (1 - self.p.zone['low_side_ratio'])
-        
-        grid_size = (self.top_grid_price -
-                     self.bottom_grid_price) / (self.p.n_grid+1)
-        
-        for grid in self.grids:
-            grid_no = grid.grid_no
-            price = self.bottom_grid_price + grid_size*grid_no
-            # Take profit at next grid bar
-            tp_price = self.bottom_grid_price + grid_size*(grid_no+1)
-
-            grid.grid_price = price
-            grid.grid_indicator.update_y(price)
-            grid.grid_tp = tp_price
-
-            # FIXME: DO something before close order
-            grid.close_order()
+        self.ladder.set_levels(*self.__zone_levels())
 
-    def open_grid(self, grid):
+        # FIXME: DO something before close order
+        self.ladder.close_all()
+        self.log('new zone %.3f - %.3f around %.3f', self.bottom_grid_price, self.top_grid_price,
+                 new_base_grid_price)
 
-        size = self.p.position['position_cash'] / grid.grid_price
+    def open_grid(self, level):
+        price = float(self.ladder.prices[level])
+        tp_price = float(self.ladder.tps[level])
+        size = self.p.position['position_cash'] / price
         buy_order, sl_order, tp_order = self.buy_bracket(size=size,
-                                                         price=grid.grid_price,
+                                                         price=price,
                                                          exectype=bt.Order.Limit,
-                                                         limitprice=grid.grid_tp,
+                                                         limitprice=tp_price,
                                                          limitexec=bt.Order.Limit,
-                                                         stopprice=grid.grid_sl,
+                                                         stopprice=self.ladder.sl,
                                                          stopexec=bt.Order.StopLimit
                                                          )
-        grid.open_order(buy_order, tp_order, sl_order)
-        self.log(
-            f'open buy #{buy_order.ref} {grid.grid_price:.3f}, tp #{tp_order.ref}: {grid.grid_tp:.3f}, sl #{sl_order.ref}: {grid.grid_sl}')
+        self.ladder.open_order(level, buy_order, tp_order, sl_order)
+        self.log('open buy #%d %.3f, tp #%d: %.3f, sl #%d: %s',
+                 buy_order.ref, price, tp_order.ref, tp_price, sl_order.ref, self.ladder.sl, level=logging.DEBUG)
 
     
     def next(self):
@@ -133,15 +103,16 @@ class GridAdaptiveZoneStrategy(bt.Strategy):
         if self.data.close[0] < self.bottom_grid_price or self.data.close[0] > self.top_grid_price:
             self.create_new_zone(self.data.close[0])
         
-        available_grids = filter(lambda grid: not grid.is_opened, self.grids)
-        for grid in available_grids:
-            self.open_grid(grid)
+        for level in self.ladder.next_free_levels():
+            self.open_grid(level)
             
     def notify_order(self, order):
+        if self.p.tracker is not None:
+            self.p.tracker.notify_order(self, order)
+
         if order.status in [order.Completed]:
             if order.isbuy():
-                self.log(
-                    f'BUY EXECUTED, #{order.ref} {order.executed.price:.3f}')
+                self.log('BUY EXECUTED, #%d %.3f', order.ref, order.executed.price)
 
                 # buy_order_df = pd.DataFrame([{
                 #     'price': order.executed.price,
@@ -150,15 +121,18 @@ class GridAdaptiveZoneStrategy(bt.Strategy):
                 # self.order_df = pd.concat([self.order_df, buy_order_df])
                 # print(self.position)
             elif order.issell():
-                self.log(
-                    f'SELL EXECUTED, #{order.ref} {order.executed.price:.3f}')
+                self.log('SELL EXECUTED, #%d %.3f', order.ref, order.executed.price)
                 
-                grid = next(filter(lambda grid: grid.is_opened and grid.tp_order.ref == order.ref, self.grids), None)
-                if grid:
-                    grid.close_order()
+                level = self.ladder.take_profit_level(order)
+                if level is not None:
+                    self.ladder.close_order(level)
 
                 # print(self.position)
         pass
     
     def notify_trade(self, trade):
-        pass
\ No newline at end of file
+        pass
+
+    def stop(self):
+        if self.p.tracker is not None:
+            self.p.tracker.flush()
\ No newline at end of file
@@ -0,0 +1,73 @@
+import numpy as np
+
+from indicator import GridLevels
+
+
+class GridLadder:
+    '''
+    Array-backed store of grid levels shared by the grid strategies.
+
+    Holds the entry / take profit price of every level in ascending price
+    order, the bracket each open level owns, an order ref -> level index and
+    the set of free levels, so fills and per-bar updates only touch the levels
+    involved instead of scanning the whole grid.
+    '''
+
+    def __init__(self, prices, tps, sl, plot=False, plotname='grid'):
+        self.grid_levels = GridLevels(prices, plot=plot, plotname=plotname)
+        self.prices = self.grid_levels.levels
+        self.tps = np.array(tps, dtype=np.float64)
+        self.sl = sl
+        self.buy_orders = [None] * len(self.prices)
+        self.tp_orders = [None] * len(self.prices)
+        self.sl_orders = [None] * len(self.prices)
+        self.ref_levels = {}
+        self.free_levels = set(range(len(self.prices)))
+
+    def __len__(self):
+        return len(self.prices)
+
+    def set_levels(self, prices, tps):
+        '''Re-level in place, open brackets keep their original prices.'''
+        self.grid_levels.update(prices)
+        self.tps[:] = tps
+
+    def is_opened(self, level):
+        return level not in self.free_levels
+
+    def next_free_levels(self):
+        '''Free levels in ascending price order, a snapshot safe to open while iterating.'''
+        return sorted(self.free_levels)
+
+    def open_order(self, level, buy_order, tp_order, sl_order):
+        self.free_levels.discard(level)
+        self.buy_orders[level] = buy_order
+        self.tp_orders[level] = tp_order
+        self.sl_orders[level] = sl_order
+        for order in (buy_order, tp_order, sl_order):
+            self.ref_levels[order.ref] = level
+
+    def close_order(self, level):
+        for order in (self.buy_orders[level], self.tp_orders[level], self.sl_orders[level]):
+            if order is not None:
+                self.ref_levels.pop(order.ref, None)
+        self.buy_orders[level] = None
+        self.tp_orders[level] = None
+        self.sl_orders[level] = None
+        self.free_levels.add(level)
+
+    def close_all(self):
+        for level in range(len(self.prices)):
+            if self.is_opened(level):
+                self.close_order(level)
+
+    def level_of(self, order):
+        '''Level that owns order, None when the ladder no longer tracks it.'''
+        return self.ref_levels.get(order.ref)
+
+    def take_profit_level(self, order):
+        '''Level whose take profit is order, None otherwise.'''
+        level = self.level_of(order)
+        if level is not None and self.tp_orders[level].ref == order.ref:
+            return level
+        return None
@@ -1,8 +1,9 @@
-import datetime
+import logging
 import backtrader as bt
-from indicator import LinearIndicator, HorizontalLinearIndicator
+from indicator import GridLevels, GridCrossOver
+from util import StrategyLogger
+from .LotInventory import LotInventory
 import numpy as np
-import pandas as pd
 
 
 class GridTradingStrategy(bt.Strategy):
@@ -12,62 +13,53 @@ class GridTradingStrategy(bt.Strategy):
         'n_grid': 8,
         'grid_size': 0.02,
         'grid_share': 500,
-        'plot_grid_bar': True,
-        'plot_cross_over': False
+        'plot_grid_bar': False,
+        'plot_cross_over': False,
+        'tracker': None
     }
 
     
-    def log(self, txt, dt=None):
+    def log(self, txt, *args, dt=None, level=logging.INFO):
         ''' Logging function for this strategy'''
-        dt = dt or self.datas[0].datetime.date(0)
-        print('%s, %s position.size %s' %
-              (dt.isoformat(), txt, self.position.size))
+        self.logger.log(level, txt, *args, dt=dt)
 
     def __init__(self):
+        self.logger = StrategyLogger(self)
         self.ma = bt.indicators.MovingAverageSimple(self.data.close, period=10)
         self.__create_grid_bars()
-        self.order_df = pd.DataFrame(columns=['price', 'share'],
-                                     index=pd.DatetimeIndex(data=[], name='time'))
+        self.lots = LotInventory()
 
     def __create_grid_bars(self):
-        def create_single_grid(grid_no):
-            y = self.p.base_grid_price + grid_no * self.p.grid_size
-            return HorizontalLinearIndicator(y=y, plot=self.p.plot_grid_bar, plotname=f'bar_{grid_no}')
-
-        def create_cross_over(grid_bar):
-            return bt.indicators.CrossOver(self.ma, grid_bar, plot=self.p.plot_cross_over, plotname=f'cross_{grid_bar.plotinfo.plotname}')
-        self.grid_bars = [create_single_grid(i) for i in range(self.p.n_grid)]
-        self.cross_overs = [create_cross_over(
-            grid_bar) for grid_bar in self.grid_bars]
+        levels = self.p.base_grid_price + np.arange(self.p.n_grid) * self.p.grid_size
+        self.grid_levels = GridLevels(levels, plot=self.p.plot_grid_bar, plotname='grid')
+        self.cross_over = GridCrossOver(self.ma, grid_levels=self.grid_levels,
+                                        plot=self.p.plot_cross_over, plotname='cross_grid')
 
     def next(self):
-        cross_over_signals = np.array(
-            [cross_over[0] for cross_over in self.cross_overs])
-        if not np.all(cross_over_signals == 0):
-            if np.max(cross_over_signals) > 0:  # Cross up signal
-                crossed_bar_index = np.argmax(cross_over_signals)
-                order = self.buy(size=self.p.grid_share, price=self.ma[0])
+        if self.cross_over.crossover[0] > 0:  # Cross up signal
+            order = self.buy(size=self.p.grid_share, price=self.ma[0])
 
-                # print(order)
-            elif np.min(cross_over_signals) < 0:  # Cross down signal
-                crossed_bar_index = np.argmin(cross_over_signals)
-                existing_buy_order_df = self.order_df[self.order_df['price'] < self.ma[0]]
-                print(existing_buy_order_df)
-                self.order_df.drop(index=existing_buy_order_df.index, inplace=True)
-                self.sell(size=existing_buy_order_df['share'].sum(), price=self.ma[0])
-                
+            # print(order)
+        elif self.cross_over.crossover[0] < 0:  # Cross down signal
+            prices, shares = self.lots.pop_below(self.ma[0])
+            if prices:
+                self.log('close %d lots below %.2f', len(prices), self.ma[0])
+            self.sell(size=sum(shares), price=self.ma[0])
 
     def notify_order(self, order):
+        if self.p.tracker is not None:
+            self.p.tracker.notify_order(self, order)
+
         if order.status in [order.Completed]:
             if order.isbuy():
-                self.log('BUY EXECUTED, %.2f' % order.executed.price)
+                self.log('BUY EXECUTED, %.2f', order.executed.price)
 
-                buy_order_df = pd.DataFrame([{
-                    'price': order.executed.price,
-                    'share': self.p.grid_share
-                }], index=pd.DatetimeIndex(data=[bt.num2date(order.executed.dt)], name='time'))
-                self.order_df = pd.concat([self.order_df, buy_order_df])
+                self.lots.add(order.executed.price, self.p.grid_share)
                 # print(self.position)
             elif order.issell():
-                self.log('SELL EXECUTED, %.2f' % order.executed.price)
+                self.log('SELL EXECUTED, %.2f', order.executed.price)
                 # print(self.position)
+
+    def stop(self):
+        if self.p.tracker is not None:
+            self.p.tracker.flush()
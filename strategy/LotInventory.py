@@ -0,0 +1,31 @@
+import heapq
+from itertools import count
+
+
+class LotInventory:
+    '''
+    Open lots kept in a min-heap by entry price.
+
+    Adding a lot is O(log n) and the lots below a price always come off the
+    top of the heap, so selling k of them is O(k log n) without scanning the
+    inventory. Lots of equal price leave in the order they were added.
+    '''
+
+    def __init__(self):
+        self.heap = []
+        self.sequence = count()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def add(self, price, share):
+        heapq.heappush(self.heap, (price, next(self.sequence), share))
+
+    def pop_below(self, price):
+        '''Remove the lots bought strictly below price, returns their (prices, shares) in ascending price.'''
+        prices, shares = [], []
+        while self.heap and self.heap[0][0] < price:
+            lot_price, _, share = heapq.heappop(self.heap)
+            prices.append(lot_price)
+            shares.append(share)
+        return prices, shares
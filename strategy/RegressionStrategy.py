@@ -6,7 +6,7 @@ from indicator.machine_learning import RegressionIndicator
 import numpy as np
 import pandas as pd
 import logging
-from util import OrderHistoryTracker
+from util import OrderHistoryTracker, StrategyLogger
 from typing import List
 
 
@@ -15,17 +15,26 @@ class RegressionStrategy(bt.Strategy):
     params = {
         'window_size': 48,
         'model_path': None,
+        'model_key': None,  # registry key, replaces model_path
+        'timeframe': None,
+        'streaming': False,
+        'predictions': None,  # precomputed pd.Series, replaces model_path
+        'prediction_cache': True,  # reuse predictions of an unchanged model and dataset
+        'chunk_size': None,  # rows predicted per feature block, None for the model default
         'tracker': None
     }
 
-    def log(self, txt, dt=None):
+    def log(self, txt, *args, dt=None, level=logging.DEBUG):
         ''' Logging function for this strategy'''
-        dt = dt or bt.num2date(self.datas[0].datetime[0])
-        logging.debug(f'{dt}, {txt} position.size {self.position.size:.2f}')
+        self.logger.log(level, txt, *args, dt=dt)
 
     def __init__(self):
+        self.logger = StrategyLogger(self, position_format='%.2f', intraday=True)
         self.regression_line = RegressionIndicator(
-            model_path=self.p.model_path, window_size=self.p.window_size, plotname='regression')
+            model_path=self.p.model_path, model_key=self.p.model_key, window_size=self.p.window_size,
+            timeframe=self.p.timeframe, streaming=self.p.streaming,
+            predictions=self.p.predictions, prediction_cache=self.p.prediction_cache,
+            chunk_size=self.p.chunk_size, plotname='regression')
         self.cross_over = bt.indicators.CrossOver(
             self.regression_line.lines.regression, self.data.close)
 
@@ -42,8 +51,8 @@ class RegressionStrategy(bt.Strategy):
         buy_order.order_type = 'LONG'
         sl_order.order_type = 'LONG_SL'
         tp_order.order_type = 'LONG_TP'
-        self.log(
-            f'buy #{buy_order.ref} {price}, tp #{tp_order.ref}: {tp_price:.3f}, sl #{sl_order.ref}: {sl_price:.3f}')
+        self.log('buy #%d %s, tp #%d: %.3f, sl #%d: %.3f',
+                 buy_order.ref, price, tp_order.ref, tp_price, sl_order.ref, sl_price)
 
     def enter_short(self, size, price, tp_price, sl_price):
 
@@ -56,8 +65,8 @@ class RegressionStrategy(bt.Strategy):
         sell_order.order_type = 'SHORT'
         sl_order.order_type = 'SHORT_SL'
         tp_order.order_type = 'SHORT_TP'
-        self.log(
-            f'sell #{sell_order.ref} {price}, tp #{tp_order.ref}: {tp_price:.3f}, sl #{sl_order.ref}: {sl_price:.3f}')
+        self.log('sell #%d %s, tp #%d: %.3f, sl #%d: %.3f',
+                 sell_order.ref, price, tp_order.ref, tp_price, sl_order.ref, sl_price)
 
     def order_target(self, size, target_price):
         if target_price > self.data.close[0]:
@@ -84,8 +93,7 @@ class RegressionStrategy(bt.Strategy):
             sl_order.order_type = 'LONG_SL'
         else:
             raise NotImplementedError
-        self.log(
-            f'{action} #{parent_order.ref} {target_price}, tp #{tp_order.ref}: {target_price:.3f}')
+        self.log('%s #%d %s, tp #%d: %.3f', action, parent_order.ref, target_price, tp_order.ref, target_price)
 
         return parent_order, tp_order
 
@@ -104,12 +112,14 @@ class RegressionStrategy(bt.Strategy):
                 parent_order, tp_order = self.order_target(size,
                                                            target_price=self.regression_line[0])
 
-        if len(self.data) == self.data.buflen():
-            self.order_history_tracker.export_result()
-
     def notify_order(self, order: bt.Order):
 
-        self.order_history_tracker.notify_order(self, order)
+        if self.order_history_tracker is not None:
+            self.order_history_tracker.notify_order(self, order)
+
+    def stop(self):
+        if self.order_history_tracker is not None:
+            self.order_history_tracker.flush()
 
     def notify_trade(self, trade):
 
@@ -1,3 +1,41 @@
-from .GoldenCrossStrategy import GoldenCrossStrategy
-from .GridTradingStrategy import GridTradingStrategy
-from .RegressionStrategy import RegressionStrategy
\ No newline at end of file
+import importlib
+
+# Strategy name -> module of this package that defines it. Strategies are
+# imported on first use, so a grid run never loads the ML stack and a
+# headless worker only pays for the strategy it runs.
+STRATEGY_MODULES = {
+    'GoldenCrossStrategy': 'GoldenCrossStrategy',
+    'GridTradingStrategy': 'GridTradingStrategy',
+    'GridBasicStrategy': 'GridBasicStrategy',
+    'GridAdaptiveZoneStrategy': 'GridAdaptiveZoneStrategy',
+    'RegressionStrategy': 'RegressionStrategy',
+}
+
+__all__ = list(STRATEGY_MODULES)
+
+
+def register_strategy(name, module):
+    '''Register a strategy class name with the module that defines it, e.g. 'strategy.MyStrategy'.'''
+    STRATEGY_MODULES[name] = module
+
+
+def get_strategy(name):
+    '''Strategy class by name, importing only its module.'''
+    module = STRATEGY_MODULES.get(name, name)
+    if '.' not in module:
+        module = f'{__name__}.{module}'
+    strategy = getattr(importlib.import_module(module), name)
+    if module.startswith(f'{__name__}.'):
+        # Importing strategy.X binds the module to X here, rebind the class.
+        globals()[name] = strategy
+    return strategy
+
+
+def __getattr__(name):
+    if name in STRATEGY_MODULES:
+        return get_strategy(name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
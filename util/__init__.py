@@ -1 +1,5 @@
-from .order_history_tracker import OrderHistoryTracker
\ No newline at end of file
+from .order_history_tracker import OrderHistoryTracker
+from .instrumentation import Instrumentation
+from .strategy_logging import StrategyLogger
+from .analytics import SUMMARY_KEYS, Analytics, check_sort_by, compute_analytics
+from .history_trim import HistoryTrim
@@ -0,0 +1,143 @@
+from array import array
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+YEAR_SECONDS = 365 * 86400
+TRADE_COLUMNS = ['dtopen', 'dtclose', 'barlen', 'long', 'pnl', 'pnlcomm', 'commission']
+# Keys of a run summary, the same for the backtrader and the ladder engine.
+SUMMARY_KEYS = ['ending_value', 'trades', 'max_drawdown', 'sharpe', 'win_rate', 'exposure']
+
+
+def compute_analytics(times, value, cash, trades, init_cash, opened=None, periods_per_year=None):
+    '''
+    Summary statistics of a run from its per bar equity and closed trades, in one vectorized pass.
+
+    times = bar times as backtrader date numbers, value / cash = broker
+    value and cash after every bar, trades = rows of TRADE_COLUMNS of the
+    closed trades, opened = trades opened, closed or not (len(trades) when
+    None). Trades count as won / lost by their pnl after commission. Sharpe
+    is annualized with periods_per_year, inferred from the median bar
+    spacing assuming markets open around the clock when None.
+    '''
+    times = np.asarray(times, dtype=np.float64)
+    value = np.asarray(value, dtype=np.float64)
+    cash = np.asarray(cash, dtype=np.float64)
+    trades = np.asarray(trades, dtype=np.float64).reshape(-1, len(TRADE_COLUMNS))
+    analysis = {'bars': len(value), 'ending_value': float(value[-1]) if len(value) else float(init_cash)}
+
+    if len(value):
+        peak = np.maximum.accumulate(value)
+        moneydown = peak - value
+        drawdown = 100.0 * moneydown / peak
+        # Length of every drawdown run, restarting at each new peak.
+        in_drawdown = drawdown > 0
+        run_start = np.maximum.accumulate(np.where(in_drawdown, 0, np.arange(len(value))))
+        drawdown_len = np.where(in_drawdown, np.arange(len(value)) - run_start, 0)
+
+        returns = np.diff(np.concatenate([[init_cash], value])) / np.concatenate([[init_cash], value[:-1]])
+        if periods_per_year is None and len(times) > 1:
+            periods_per_year = YEAR_SECONDS / (np.median(np.diff(times)) * 86400)
+        std = returns.std(ddof=1) if len(returns) > 1 else 0.0
+        sharpe = returns.mean() / std * np.sqrt(periods_per_year) if std > 0 and periods_per_year else np.nan
+        analysis.update({
+            'total_return': float(value[-1] / init_cash - 1),
+            'sharpe': float(sharpe),
+            'max_drawdown': float(drawdown.max()),
+            'max_moneydown': float(moneydown.max()),
+            'max_drawdown_len': int(drawdown_len.max()),
+            'exposure': float(np.mean(value != cash)),
+        })
+    else:
+        analysis.update({'total_return': 0.0, 'sharpe': np.nan, 'max_drawdown': 0.0, 'max_moneydown': 0.0,
+                         'max_drawdown_len': 0, 'exposure': 0.0})
+
+    pnl = trades[:, TRADE_COLUMNS.index('pnlcomm')]
+    won, lost = pnl[pnl > 0], pnl[pnl < 0]
+    barlen = trades[:, TRADE_COLUMNS.index('barlen')]
+    analysis.update({
+        'trades': int(opened if opened is not None else len(trades)),
+        'closed_trades': len(trades),
+        'won': len(won),
+        'lost': len(lost),
+        'win_rate': float(len(won) / len(trades)) if len(trades) else np.nan,
+        'pnl_net': float(pnl.sum()),
+        'avg_pnl': float(pnl.mean()) if len(pnl) else np.nan,
+        'avg_won': float(won.mean()) if len(won) else np.nan,
+        'avg_lost': float(lost.mean()) if len(lost) else np.nan,
+        'profit_factor': float(won.sum() / -lost.sum()) if len(lost) else np.nan,
+        'avg_trade_bars': float(barlen.mean()) if len(barlen) else np.nan,
+        'max_trade_bars': int(barlen.max()) if len(barlen) else 0,
+    })
+    return analysis
+
+
+def check_sort_by(sort_by):
+    '''Fail before a sweep or search starts when its results cannot be ranked by sort_by.'''
+    if sort_by not in SUMMARY_KEYS:
+        raise ValueError(f'cannot sort by {sort_by!r}, use one of {", ".join(SUMMARY_KEYS)}')
+
+
+class Analytics(bt.Analyzer):
+    '''
+    Compact recording of a run for post-run statistics.
+
+    Every bar only appends the broker value and cash, every closed trade
+    one row of TRADE_COLUMNS. The strategy's warm-up (prenext) bars are
+    recorded too, as the ladder simulator's summary counts every bar.
+    compute_analytics turns them into Sharpe,
+    drawdown, exposure and per trade stats once the run stopped, see
+    get_analysis. build_cerebro always adds it, in place of backtrader's
+    per bar TradeAnalyzer and DrawDown. max_drawdown matches DrawDown and
+    trades TradeAnalyzer's total.total.
+
+    periods_per_year = Sharpe annualization, inferred from the bars when None.
+    '''
+    params = (
+        ('periods_per_year', None),
+    )
+
+    def start(self):
+        self.init_cash = self.strategy.broker.startingcash
+        self.times = array('d')
+        self.values = array('d')
+        self.cashes = array('d')
+        self.trades = []
+        self.opened = 0
+        self.cash = self.value = self.init_cash
+
+    def notify_fund(self, cash, value, fundvalue, shares):
+        self.cash, self.value = cash, value
+
+    def notify_trade(self, trade):
+        if trade.justopened:
+            self.opened += 1
+        if trade.isclosed:
+            self.trades.append((trade.dtopen, trade.dtclose, trade.barlen, trade.long,
+                                trade.pnl, trade.pnlcomm, trade.commission))
+
+    def next(self):
+        self.times.append(self.strategy.datetime[0])
+        self.values.append(self.value)
+        self.cashes.append(self.cash)
+
+    # Spelled out rather than left to bt.Analyzer's default, the summary covers every bar.
+    prenext = next
+
+    def stop(self):
+        self.rets = compute_analytics(self.times, self.values, self.cashes, self.trades, self.init_cash,
+                                      opened=self.opened, periods_per_year=self.p.periods_per_year)
+
+    def equity_frame(self) -> pd.DataFrame:
+        '''Broker value and cash per bar, indexed by bar time.'''
+        index = pd.DatetimeIndex([bt.num2date(t) for t in self.times], name='time')
+        return pd.DataFrame({'value': self.values, 'cash': self.cashes}, index=index)
+
+    def trades_frame(self) -> pd.DataFrame:
+        '''One row per closed trade, open and close as datetimes.'''
+        df = pd.DataFrame(self.trades, columns=TRADE_COLUMNS)
+        for col in ('dtopen', 'dtclose'):
+            df[col] = [bt.num2date(t) for t in df[col]]
+        df['long'] = df['long'].astype(bool)
+        return df
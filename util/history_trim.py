@@ -0,0 +1,35 @@
+import backtrader as bt
+
+
+class HistoryTrim(bt.Analyzer):
+    '''
+    Keeps backtrader's order and trade bookkeeping from growing with the run.
+
+    The broker holds on to every order it was sent, the strategy to every
+    order notification and every trade, none of which is read back once the
+    order is dead or the trade closed. Whenever every more entries piled up
+    they are dropped, keeping the live orders and the current trade of each
+    data and tradeid. notify_order and notify_trade still see everything.
+    build_cerebro adds it for streamed feeds.
+    '''
+    params = (
+        ('every', 4096),
+    )
+
+    def start(self):
+        self.mark = self.p.every
+
+    def size(self):
+        return len(getattr(self.strategy.broker, 'orders', ())) + len(self.strategy._orders)
+
+    def next(self):
+        if self.size() < self.mark:
+            return
+        broker = self.strategy.broker
+        if hasattr(broker, 'orders'):
+            broker.orders[:] = [order for order in broker.orders if order.alive()]
+        del self.strategy._orders[:]
+        for data_trades in self.strategy._trades.values():
+            for trades in data_trades.values():
+                del trades[:-1]
+        self.mark = self.size() + self.p.every
@@ -0,0 +1,219 @@
+import datetime
+import logging
+import time
+from pathlib import Path
+
+import backtrader as bt
+import pandas as pd
+
+
+class Instrumentation(bt.Analyzer):
+    '''
+    Opt-in per-callback timing of a strategy run.
+
+    Enabled with `instrumentation: true` (or a mapping of these params) in
+    the experiment config, build_cerebro then adds it as an analyzer. At
+    start it wraps, on the instances only, the strategy's bar and notify
+    callbacks and log, every indicator's _next / _once, the other analyzers
+    and observers and the broker's next / submit / cancel. Without it nothing
+    is wrapped, so a normal run pays nothing.
+
+    Wall time is accumulated per call stack, e.g.
+    GridTradingStrategy;next;broker.submit, and reported at stop as a table
+    of the slowest frames plus folded stacks (self time in microseconds) for
+    flamegraph.pl or speedscope. Orders created and cancelled per bar and the
+    pending order count after every bar are kept in get_analysis()['bars'].
+
+    output_dir = directory for <strategy>_<time>.folded and _bars.csv,
+    nothing is written when None. top = frames listed in the report.
+    '''
+    params = (
+        ('output_dir', None),
+        ('top', 20),
+    )
+
+    STRATEGY_CALLBACKS = ('next', 'prenext', 'nextstart', 'notify_order', 'notify_trade', 'log')
+
+    def __init__(self):
+        self.stack = []
+        # stack tuple -> [calls, inclusive seconds, seconds spent in children]
+        self.frames = {}
+        self.created = 0
+        self.cancelled = 0
+        self.bars = {'datetime': [], 'created': [], 'cancelled': [], 'pending': []}
+
+    def call(self, frame_name, original, args, kwargs):
+        '''original(*args, **kwargs), timed as frame_name on top of the current stack.'''
+        stack, frames = self.stack, self.frames
+        stack.append(frame_name)
+        key = tuple(stack)
+        frame = frames.get(key)
+        if frame is None:
+            frame = frames[key] = [0, 0.0, 0.0]
+        started = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            stack.pop()
+            frame[0] += 1
+            frame[1] += elapsed
+            if len(key) > 1:
+                frames[key[:-1]][2] += elapsed
+
+    def wrap(self, obj, method_name, frame_name):
+        original = getattr(obj, method_name, None)
+        if original is None:
+            return
+        call = self.call
+
+        def timed(*args, **kwargs):
+            return call(frame_name, original, args, kwargs)
+        setattr(obj, method_name, timed)
+
+    def wrap_indicators(self, owner):
+        # Line operations such as delays are listed as indicators without children.
+        lineiterators = getattr(owner, '_lineiterators', None)
+        if lineiterators is None:
+            return
+        for indicator in lineiterators[bt.LineIterator.IndType]:
+            name = f'indicator:{type(indicator).__name__}'
+            self.wrap(indicator, '_next', name)
+            self.wrap(indicator, '_once', name)
+            self.wrap_indicators(indicator)
+
+    def start(self):
+        strategy = self.strategy
+        name = type(strategy).__name__
+        self.wrap(strategy, '_next', name)
+        self.wrap(strategy, '_oncepost', name)
+        self.wrap(strategy, '_once', f'{name}.once')
+        self.wrap(strategy, '_next_open', f'{name}.open')
+        for method_name in self.STRATEGY_CALLBACKS:
+            self.wrap(strategy, method_name, method_name)
+        self.wrap_indicators(strategy)
+
+        for analyzer in strategy.analyzers:
+            if analyzer is not self:
+                self.wrap(analyzer, '_next', f'analyzer:{type(analyzer).__name__}')
+        for observer in strategy.observers:
+            self.wrap(observer, '_next', f'observer:{type(observer).__name__}')
+
+        self.__wrap_broker(strategy.broker)
+        self.__count_earlier_orders(strategy.broker)
+
+    def __count_earlier_orders(self, broker):
+        '''Orders the strategy submitted before the broker was wrapped, e.g. from __init__, count on the first bar.'''
+        orders = {order.ref: order for order in getattr(broker, 'orders', ())}
+        for children in getattr(broker, '_pchildren', {}).values():
+            orders.update((order.ref, order) for order in children)
+        mine = [order for order in orders.values() if order.owner is self.strategy]
+        self.created += len(mine)
+        self.cancelled += sum(order.status == bt.Order.Canceled for order in mine)
+
+    def __wrap_broker(self, broker):
+        '''
+        Wrap the broker all strategies share once per run.
+
+        Calls are timed and counted by the instrumentation of the strategy
+        making them, the one with a frame open. broker.next, which cerebro
+        calls between strategies, goes to the first instrumentation.
+        '''
+        instrumentations = getattr(broker, '_instrumentations', None)
+        if instrumentations is not None:
+            instrumentations.append(self)
+            return
+        broker._instrumentations = instrumentations = [self]
+
+        def active():
+            for instrumentation in instrumentations:
+                if instrumentation.stack:
+                    return instrumentation
+            return instrumentations[0]
+
+        def wrap(method_name, counter):
+            original, frame_name = getattr(broker, method_name), f'broker.{method_name}'
+
+            def timed(*args, **kwargs):
+                instrumentation = active()
+                if counter is not None:
+                    setattr(instrumentation, counter, getattr(instrumentation, counter) + 1)
+                return instrumentation.call(frame_name, original, args, kwargs)
+            setattr(broker, method_name, timed)
+            return original
+
+        broker._instrumented = {'next': wrap('next', None), 'submit': wrap('submit', 'created'),
+                                'cancel': wrap('cancel', 'cancelled')}
+
+    def __unwrap_broker(self, broker):
+        instrumentations = broker._instrumentations
+        instrumentations.remove(self)
+        if instrumentations:
+            return
+        # Last one out restores the broker, a later run of the same cerebro wraps it afresh.
+        for method_name, original in broker._instrumented.items():
+            setattr(broker, method_name, original)
+        del broker._instrumentations, broker._instrumented
+
+    def __record_bar(self):
+        broker = self.strategy.broker
+        self.bars['datetime'].append(self.strategy.datetime[0])
+        self.bars['created'].append(self.created)
+        self.bars['cancelled'].append(self.cancelled)
+        self.bars['pending'].append(len(broker.pending) + len(broker.submitted))
+        self.created = self.cancelled = 0
+
+    def prenext(self):
+        self.__record_bar()
+
+    def nextstart(self):
+        self.__record_bar()
+
+    def next(self):
+        self.__record_bar()
+
+    def frame_table(self) -> pd.DataFrame:
+        rows = [{'stack': ';'.join(key), 'frame': key[-1], 'depth': len(key) - 1, 'calls': calls,
+                 'seconds': total, 'self_seconds': total - children}
+                for key, (calls, total, children) in self.frames.items() if calls]
+        df = pd.DataFrame(rows, columns=['stack', 'frame', 'depth', 'calls', 'seconds', 'self_seconds'])
+        df['us_per_call'] = df['seconds'] / df['calls'].clip(lower=1) * 1e6
+        return df.sort_values('seconds', ascending=False, kind='mergesort').reset_index(drop=True)
+
+    def bar_table(self) -> pd.DataFrame:
+        df = pd.DataFrame(self.bars)
+        df['datetime'] = [bt.num2date(num) for num in df['datetime']]
+        return df
+
+    def folded_stacks(self):
+        '''Lines of "frame;frame;frame self_microseconds", the flamegraph.pl input format.'''
+        return [f"{';'.join(key)} {int(round((total - children) * 1e6))}"
+                for key, (calls, total, children) in sorted(self.frames.items()) if calls]
+
+    def report(self):
+        frames, bars = self.frame_table(), self.bar_table()
+        lines = [f'instrumentation {type(self.strategy).__name__}: {len(bars)} bars']
+        with pd.option_context('display.width', 200, 'display.max_colwidth', 80):
+            lines.append(frames.head(self.p.top)[['stack', 'calls', 'seconds', 'self_seconds', 'us_per_call']]
+                         .to_string(index=False, float_format=lambda x: f'{x:.4f}'))
+        if len(bars):
+            lines.append(
+                f"orders created {bars['created'].sum()} (max {bars['created'].max()} per bar), "
+                f"cancelled {bars['cancelled'].sum()} (max {bars['cancelled'].max()} per bar), "
+                f"pending mean {bars['pending'].mean():.1f} max {bars['pending'].max()}")
+        return '\n'.join(lines)
+
+    def stop(self):
+        self.__unwrap_broker(self.strategy.broker)
+        logging.info(self.report())
+        if self.p.output_dir is None:
+            return
+        output_dir = Path(self.p.output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        stem = f"{type(self.strategy).__name__}_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+        (output_dir / f'{stem}.folded').write_text('\n'.join(self.folded_stacks()) + '\n')
+        self.bar_table().to_csv(output_dir / f'{stem}_bars.csv', index=False)
+        logging.info('instrumentation saved to %s', output_dir / stem)
+
+    def get_analysis(self):
+        return {'frames': self.frame_table(), 'bars': self.bar_table()}
@@ -1,10 +1,37 @@
 import backtrader as bt
 import logging
 import datetime
+import json
+import os
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
 
+ACTION_LABELS = ['BUY', 'SELL']
+FILE_FORMATS = {'csv', 'columnar'}
+COLUMN_DTYPES = {
+    'time': np.int64,  # ns since epoch
+    'order_ref': np.int64,
+    'parent_order_ref': np.int64,  # -1 without parent
+    'action': np.int8,  # index in ACTION_LABELS
+    'status': np.int8,  # bt.Order status
+    'order_type': np.int16,  # index in meta order_types, -1 when unset
+    'price': np.float64,
+    'position': np.float64,
+}
+
 
 class OrderHistoryTracker:
+    '''
+    Streams order events to history_path in batches.
+
+    Events are buffered in typed column arrays of batch_size rows and appended
+    to the file whenever the buffer is full, so memory stays bounded and a
+    crash loses at most one batch. file_format = 'csv', or 'columnar' for one
+    raw binary file per column plus meta.json in the history_path directory,
+    read back with read_order_history. Defaults to csv for a .csv path.
+    '''
     STATUS_VALUE_LABEL = {
         bt.Order.Created: 'CREATED',
         bt.Order.Accepted: 'ACCEPTED',
@@ -13,9 +40,12 @@ class OrderHistoryTracker:
         bt.Order.Canceled: 'CANCELED'
     }
 
-    def __init__(self, history_path, allow_order_status=None) -> None:
-        self.history_path = history_path
-        self.history: list = []
+    def __init__(self, history_path, allow_order_status=None, batch_size=10000, file_format=None) -> None:
+        self.history_path = Path(history_path)
+        self.file_format = file_format or ('csv' if self.history_path.suffix == '.csv' else 'columnar')
+        if self.file_format not in FILE_FORMATS:
+            raise ValueError(f'unknown order history format {self.file_format!r}, use one of {sorted(FILE_FORMATS)}')
+        self.batch_size = batch_size
 
         if allow_order_status is None:
             allow_order_status = [bt.Order.Created, bt.Order.Accepted,
@@ -23,37 +53,126 @@ class OrderHistoryTracker:
                                   bt.Order.Canceled]
         self.allow_order_status = allow_order_status
 
-    def notify_order(self, strategy: bt.Strategy, order: bt.Order):
-        dt = bt.num2date(strategy.datas[0].datetime[0])
+        self.buffer = {col: np.empty(batch_size, dtype=dtype) for col, dtype in COLUMN_DTYPES.items()}
+        # Times are buffered as backtrader date numbers and converted per batch.
+        self.buffer['time'] = np.empty(batch_size, dtype=np.float64)
+        self.buffered = 0
+        self.written = 0
+        self.order_types = {}
+        self.started = False
+
+    def __start_file(self):
+        self.started = True
+        if self.file_format == 'csv':
+            self.history_path.parent.mkdir(parents=True, exist_ok=True)
+            self.history_path.write_text('')
+        else:
+            self.history_path.mkdir(parents=True, exist_ok=True)
+            for col in COLUMN_DTYPES:
+                (self.history_path / f'{col}.bin').write_bytes(b'')
+            self.__write_meta()
 
+    def notify_order(self, strategy: bt.Strategy, order: bt.Order):
         if order.status not in self.allow_order_status:
             return
 
-        status_label = self.STATUS_VALUE_LABEL.get(order.status, None)
-
-        if order.isbuy():
-            order_action_label = 'BUY'
-        elif order.issell():
-            order_action_label = 'SELL'
-
         if order.status == bt.Order.Completed:
             price = order.executed.price
         else:
             price = order.created.price
 
-        order_history = {
-            'time': dt,
-            'order_ref': order.ref,
-            'parent_order_ref': order.parent.ref if order.parent is not None else None,
-            'action': order_action_label,
-            'status': status_label,
-            'order_type': order.order_type,
-            'price': price,
-            'position': f'{strategy.position.size:.3f}'
+        order_type = getattr(order, 'order_type', None)
+        if order_type is None:
+            order_type_code = -1
+        else:
+            order_type_code = self.order_types.setdefault(order_type, len(self.order_types))
+
+        row = self.buffered
+        buffer = self.buffer
+        buffer['time'][row] = strategy.datas[0].datetime[0]
+        buffer['order_ref'][row] = order.ref
+        buffer['parent_order_ref'][row] = order.parent.ref if order.parent is not None else -1
+        buffer['action'][row] = 0 if order.isbuy() else 1
+        buffer['status'][row] = order.status
+        buffer['order_type'][row] = order_type_code
+        buffer['price'][row] = price
+        buffer['position'][row] = strategy.position.size
+        self.buffered += 1
+
+        if self.buffered == self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffered == 0:
+            return
+        if not self.started:
+            self.__start_file()
+        columns = {col: values[:self.buffered] for col, values in self.buffer.items()}
+        columns['time'] = pd.to_datetime([bt.num2date(num) for num in columns['time'].tolist()]
+                                         ).values.astype('datetime64[ns]').astype(np.int64)
+        if self.file_format == 'csv':
+            self.__append_csv(columns)
+        else:
+            self.__append_columnar(columns)
+        self.written += self.buffered
+        self.buffered = 0
+
+    def __append_csv(self, columns):
+        df = decode_history(columns, list(self.order_types), self.STATUS_VALUE_LABEL)
+        df['position'] = np.char.mod('%.3f', columns['position'])
+        df.index += self.written
+        df.to_csv(self.history_path, mode='a', header=self.written == 0, index=True)
+
+    def __append_columnar(self, columns):
+        for col, values in columns.items():
+            with open(self.history_path / f'{col}.bin', 'ab') as f:
+                values.tofile(f)
+        self.__write_meta(self.written + len(columns['time']))
+
+    def __write_meta(self, rows=0):
+        meta = {
+            'rows': rows,
+            'columns': {col: np.dtype(dtype).str for col, dtype in COLUMN_DTYPES.items()},
+            'order_types': list(self.order_types),
+            'status_labels': {str(status): label for status, label in self.STATUS_VALUE_LABEL.items()},
         }
-        self.history.append(order_history)
+        tmp_path = self.history_path / 'meta.json.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.history_path / 'meta.json')
 
     def export_result(self):
-        df = pd.DataFrame(self.history)
-        df.index.name = 'id'
-        df.to_csv(self.history_path, index=True)
+        if not self.started:
+            self.__start_file()
+        self.flush()
+
+
+def decode_history(columns, order_types, status_labels) -> pd.DataFrame:
+    '''DataFrame with readable labels from typed history columns.'''
+    order_types = np.array([None] + list(order_types), dtype=object)
+    parent = np.where(columns['parent_order_ref'] < 0, np.nan, columns['parent_order_ref'])
+    return pd.DataFrame({
+        'time': pd.to_datetime(columns['time']),
+        'order_ref': columns['order_ref'],
+        'parent_order_ref': parent,
+        'action': np.array(ACTION_LABELS)[columns['action']],
+        'status': [status_labels.get(status) for status in columns['status'].tolist()],
+        'order_type': order_types[columns['order_type'] + 1],
+        'price': columns['price'],
+        'position': columns['position'],
+    }, index=pd.RangeIndex(len(columns['time']), name='id'))
+
+
+def read_order_history(history_path) -> pd.DataFrame:
+    '''Read a history written by OrderHistoryTracker in either format.'''
+    history_path = Path(history_path)
+    if history_path.suffix == '.csv':
+        return pd.read_csv(history_path, index_col='id', parse_dates=['time'])
+
+    with open(history_path / 'meta.json', 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    # Bytes past meta['rows'] belong to a flush that did not finish.
+    columns = {col: np.fromfile(history_path / f'{col}.bin', dtype=np.dtype(dtype), count=meta['rows'])
+               for col, dtype in meta['columns'].items()}
+    status_labels = {int(status): label for status, label in meta['status_labels'].items()}
+    return decode_history(columns, meta['order_types'], status_labels)
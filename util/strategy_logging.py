@@ -0,0 +1,99 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+
+LOG_FORMAT = '%(levelname)s:%(name)s:%(message)s'
+
+
+class StrategyLogger:
+    '''
+    Level-gated logger for a strategy's order and grid messages.
+
+    Messages take %-style args like logging and nothing, not even the date
+    or position lookup, is evaluated unless the level is enabled. Args are
+    formatted later on the logging thread, so pass plain values, not live
+    objects such as orders or the position. Logs to strategy.<ClassName>.
+    intraday = prefix the bar datetime instead of the date.
+    '''
+
+    def __init__(self, strategy, position_format='%s', intraday=False):
+        self.strategy = strategy
+        self.logger = logging.getLogger(f'strategy.{type(strategy).__name__}')
+        self.position_format = position_format
+        self.intraday = intraday
+
+    def log(self, level, txt, *args, dt=None):
+        if not self.logger.isEnabledFor(level):
+            return
+        data = self.strategy.datas[0]
+        if dt is None:
+            dt = data.datetime.datetime(0) if self.intraday else data.datetime.date(0)
+        self.logger.log(level, f'%s, {txt} position.size {self.position_format}',
+                        dt.isoformat(), *args, self.strategy.position.size)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    '''
+    QueueHandler that leaves formatting to the listener thread.
+
+    The stock prepare formats every record on the calling thread, which is
+    the cost this handler exists to move off the backtest loop. Records only
+    travel through an in-process queue, so they are passed on as is.
+    '''
+
+    def prepare(self, record):
+        return record
+
+
+# (listener, handlers) of the running start_queue_logging, None when stopped.
+_active = None
+
+
+def start_queue_logging(handlers, level=logging.DEBUG):
+    '''
+    Route the root logger through a queue to handlers on a background thread.
+
+    Replaces the root handlers and the listener of an earlier call, returns
+    the started QueueListener, which is also stopped, flushing the queue, at
+    interpreter exit. Forked children have no listener thread, they log to
+    handlers directly.
+    '''
+    global _active
+    if _active is not None:
+        stop_queue_logging(_active[0])
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [DeferredQueueHandler(log_queue)]
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _active = (listener, list(handlers))
+    return listener
+
+
+def stop_queue_logging(listener):
+    '''Flush and stop a listener from start_queue_logging, safe to call twice.'''
+    global _active
+    if _active is not None and _active[0] is listener:
+        _active = None
+        listener.stop()
+
+
+def _stop_active():
+    if _active is not None:
+        stop_queue_logging(_active[0])
+
+
+def _log_directly_after_fork():
+    global _active
+    if _active is not None:
+        logging.getLogger().handlers = list(_active[1])
+        _active = None
+
+
+atexit.register(_stop_active)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_log_directly_after_fork)